@@ -61,6 +61,7 @@ setup(
         'psycopg[pool]',
         'pillow',
         'pydantic',
+        'redis',
         'scipy',
         'slippers',  # required by django-allauth-ui
         # Production-only
@@ -71,6 +72,7 @@ setup(
         'worker': [
             'deepdrr==1.1.3',
             'pypng',
+            'zstandard',
         ],
         'dev': [
             'django-autotyping',
@@ -0,0 +1,448 @@
+"""
+Lightweight coordination between the web app and workers, through Redis.
+
+The DB remains the source of truth for every state transition; the signals here only let
+workers find out about those transitions promptly, without polling the DB.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterator
+import contextlib
+import dataclasses
+from datetime import timedelta
+import functools
+import json
+import logging
+import math
+import threading
+import time
+from typing import Self
+from uuid import uuid4
+
+from django.conf import settings
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Sessions can't run for longer than a day, so stale keys are never left behind for long
+SESSION_KEY_TTL = timedelta(days=1)
+# A claim on a shard expires unless it's refreshed this often, e.g. if its worker died. Claims
+# are refreshed in the background while they're held, see `ShardClaim.keep_alive`.
+SHARD_CLAIM_TTL = timedelta(minutes=1)
+# Preview workers are assumed to be gone unless they wait for a request at least this often
+POSE_PREVIEW_WORKER_TTL = timedelta(seconds=30)
+
+
+class SessionCancelledError(Exception):
+    """Raised from inside a render when its session has been cancelled."""
+
+
+@functools.cache
+def get_redis() -> redis.Redis:
+    config = dict(settings.COORDINATION_REDIS)
+    return redis.Redis.from_url(config.pop('address'), **config)
+
+
+def _cancellation_key(session_pk) -> str:
+    return f'xray_genius:session:{session_pk}:cancelled'
+
+
+def signal_session_cancelled(session_pk) -> None:
+    """
+    Notify any worker rendering the session that it has been cancelled.
+
+    This must only be called once the cancellation has been committed to the DB.
+    """
+    key = _cancellation_key(session_pk)
+    # The flag is for workers which start listening later, the message for those already listening
+    with get_redis().pipeline() as pipe:
+        pipe.set(key, 1, ex=SESSION_KEY_TTL)
+        pipe.publish(key, 1)
+        pipe.execute()
+
+
+def clear_session_cancelled(session_pk) -> None:
+    """Clear any previous cancellation of a session, before it's started again."""
+    get_redis().delete(_cancellation_key(session_pk))
+
+
+def _progress_key(session_pk) -> str:
+    return f'xray_genius:session:{session_pk}:progress'
+
+
+def reset_session_progress(session_pk) -> None:
+    get_redis().delete(_progress_key(session_pk))
+
+
+def add_session_progress(session_pk, count: int, *, counter: str = 'rendered') -> int:
+    """
+    Record that a number of images of a session were rendered, and get the total so far.
+
+    Other progress of the session can be aggregated across its shards under a different
+    ``counter``. Counts which a redelivered shard would record again should be recorded with
+    `set_shard_progress` instead.
+    """
+    key = _progress_key(session_pk)
+    with get_redis().pipeline() as pipe:
+        pipe.hincrby(key, counter, count)
+        pipe.expire(key, SESSION_KEY_TTL)
+        total, _ = pipe.execute()
+    return total
+
+
+# Set the count of a shard under a counter, and sum the counts of every shard under it
+_SET_SHARD_PROGRESS_SCRIPT = """
+local prefix = ARGV[1] .. ':'
+redis.call('HSET', KEYS[1], prefix .. ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local total = 0
+local fields = redis.call('HGETALL', KEYS[1])
+for i = 1, #fields, 2 do
+    if string.sub(fields[i], 1, #prefix) == prefix then
+        total = total + tonumber(fields[i + 1])
+    end
+end
+return total
+"""
+
+
+def set_shard_progress(session_pk, shard: int, count: int, *, counter: str) -> int:
+    """
+    Record the count of a shard (e.g. of the poses it resampled), and get the total of all shards.
+
+    Unlike with `add_session_progress`, recording a shard's count again replaces it, so a
+    redelivered shard doesn't count it twice.
+    """
+    return get_redis().eval(
+        _SET_SHARD_PROGRESS_SCRIPT,
+        1,
+        _progress_key(session_pk),
+        counter,
+        shard,
+        count,
+        int(SESSION_KEY_TTL.total_seconds()),
+    )
+
+
+class CancellationListener:
+    """
+    Receive the cancellation signal of a session in the background.
+
+    Checking for cancellation is then just a matter of checking a local event, which is cheap
+    enough to do between every frame, and from the encoding threads as well.
+    """
+
+    def __init__(self, session_pk) -> None:
+        self.session_pk = session_pk
+        self._event = threading.Event()
+        self._pubsub = None
+        self._thread = None
+
+    def __enter__(self) -> Self:
+        client = get_redis()
+        key = _cancellation_key(self.session_pk)
+        self._pubsub = client.pubsub()
+        self._pubsub.subscribe(**{key: self._on_message})
+        # Wait for the subscription to be confirmed before checking the flag, so that a
+        # cancellation can't slip in between the two unnoticed
+        self._pubsub.get_message(timeout=5)
+        if client.exists(key):
+            self._event.set()
+        self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread.join(timeout=5)
+        if self._pubsub is not None:
+            self._pubsub.close()
+
+    def _on_message(self, message: dict) -> None:
+        logger.info('Received cancellation signal for session %s', self.session_pk)
+        self._event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until the session is cancelled, or the timeout elapses."""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise SessionCancelledError(self.session_pk)
+
+
+_POSE_PREVIEW_QUEUE_KEY = 'xray_genius:pose_preview:requests'
+_POSE_PREVIEW_WORKER_KEY = 'xray_genius:pose_preview:worker'
+
+
+def _pose_preview_reply_key(request_id: str) -> str:
+    return f'xray_genius:pose_preview:{request_id}:reply'
+
+
+@dataclasses.dataclass(frozen=True)
+class PosePreviewRequest:
+    request_id: str
+    session_pk: str
+    # The pose to render, as (push/pull, head/foot, raise/lower, alpha, beta)
+    pose: list[float]
+    # The time (since the epoch) after which nobody is waiting for the preview anymore
+    deadline: float
+
+    @property
+    def expired(self) -> bool:
+        return time.time() > self.deadline
+
+
+def request_pose_preview(
+    session_pk, pose: list[float], *, timeout: float, max_queued: int
+) -> bytes | None:
+    """
+    Ask a preview worker to render a single pose of a session, and wait for its PNG.
+
+    Returns None if the preview failed, or wasn't rendered within ``timeout`` seconds. Returns
+    None right away if no preview worker is running, or ``max_queued`` requests are already
+    waiting for one, since they wouldn't be rendered in time anyway.
+    """
+    request = PosePreviewRequest(
+        request_id=uuid4().hex,
+        session_pk=str(session_pk),
+        pose=pose,
+        deadline=time.time() + timeout,
+    )
+    client = get_redis()
+    with client.pipeline() as pipe:
+        pipe.exists(_POSE_PREVIEW_WORKER_KEY)
+        pipe.llen(_POSE_PREVIEW_QUEUE_KEY)
+        worker_alive, queued = pipe.execute()
+    if not worker_alive:
+        logger.warning('No preview worker is running for the preview of session %s', session_pk)
+        return None
+    if queued >= max_queued:
+        logger.warning('Too many previews are queued for the preview of session %s', session_pk)
+        return None
+
+    with client.pipeline() as pipe:
+        pipe.lpush(_POSE_PREVIEW_QUEUE_KEY, json.dumps(dataclasses.asdict(request)))
+        # Concurrent requests may still overfill the queue, in which case the oldest ones (which
+        # are the closest to their deadline) are dropped. Nothing is left queued once every
+        # request has expired, e.g. if the worker stopped.
+        pipe.ltrim(_POSE_PREVIEW_QUEUE_KEY, 0, max_queued - 1)
+        pipe.expire(_POSE_PREVIEW_QUEUE_KEY, max(math.ceil(timeout), 1))
+        pipe.execute()
+    reply = client.blpop([_pose_preview_reply_key(request.request_id)], timeout=timeout)
+    if reply is None:
+        logger.warning('Timed out waiting for the preview of session %s', session_pk)
+        return None
+    _, png = reply
+    return png or None
+
+
+def signal_pose_preview_worker_alive() -> None:
+    """Let the API know a preview worker is running, for the next `POSE_PREVIEW_WORKER_TTL`."""
+    get_redis().set(_POSE_PREVIEW_WORKER_KEY, 1, ex=POSE_PREVIEW_WORKER_TTL)
+
+
+def next_pose_preview_request(timeout: float) -> PosePreviewRequest | None:
+    """
+    Wait for the oldest pose preview request, or None once ``timeout`` seconds elapse.
+
+    A ``timeout`` of 0 waits indefinitely. The caller is marked as a running preview worker
+    meanwhile, see `signal_pose_preview_worker_alive`; to keep that mark, this returns None
+    early if no request arrives within half of `POSE_PREVIEW_WORKER_TTL`.
+    """
+    signal_pose_preview_worker_alive()
+    heartbeat = POSE_PREVIEW_WORKER_TTL.total_seconds() / 2
+    item = get_redis().brpop(
+        [_POSE_PREVIEW_QUEUE_KEY], timeout=heartbeat if timeout == 0 else min(timeout, heartbeat)
+    )
+    if item is None:
+        return None
+    _, payload = item
+    return PosePreviewRequest(**json.loads(payload))
+
+
+def send_pose_preview(request: PosePreviewRequest, png: bytes) -> None:
+    """Reply to a pose preview request, with empty bytes if it failed."""
+    key = _pose_preview_reply_key(request.request_id)
+    with get_redis().pipeline() as pipe:
+        pipe.rpush(key, png)
+        # Nobody picks up the reply to a request which timed out in the meantime
+        pipe.expire(key, max(int(request.deadline - time.time()), 1))
+        pipe.execute()
+
+
+# Claim a key for an owner, unless another owner holds it, with a new token
+_ACQUIRE_CLAIM_SCRIPT = """
+local owner = redis.call('HGET', KEYS[1], 'owner')
+if owner and owner ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'owner', ARGV[1], 'token', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+# Refresh a claim, only if it's still held with the same token
+_REFRESH_CLAIM_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'token') ~= ARGV[1] then
+    return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+# Give up a claim, only if it's still held with the same token, and record its result if any
+_RELEASE_CLAIM_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'token') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+if ARGV[2] ~= '' then
+    redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+end
+return 1
+"""
+
+
+def _shard_key(session_pk, run: int, shard: int) -> str:
+    return f'xray_genius:session:{session_pk}:run:{run}:shard:{shard}'
+
+
+def _pending_shards_key(context: str) -> str:
+    return f'xray_genius:render_context:{context}:pending'
+
+
+class ShardClaim:
+    """
+    The exclusive right to render one shard of a session's run, for whichever task takes it.
+
+    A shard may be rendered by its own task, or by the task of another session with the same
+    render context (see `pop_pending_shard`). Its result is kept, so that its own task can
+    report it either way.
+
+    A claim is held by an owner, the ID of the task which took it. A task redelivered after its
+    worker died keeps its ID, so it takes its claim over rather than waiting for it to expire.
+    As the original task may still be alive (e.g. when it outlived the broker's visibility
+    timeout), each acquisition gets its own token. Only the latest holder of a claim may
+    refresh, release, or complete it; an earlier one finds out it lost the claim instead.
+    """
+
+    def __init__(self, session_pk, run: int, shard: int) -> None:
+        self._key = _shard_key(session_pk, run, shard)
+        self._token = ''
+
+    def acquire(self, owner: str) -> bool:
+        """Claim the shard, unless it's claimed already by another owner."""
+        token = uuid4().hex
+        acquired = get_redis().eval(
+            _ACQUIRE_CLAIM_SCRIPT,
+            1,
+            f'{self._key}:claim',
+            owner,
+            token,
+            int(SHARD_CLAIM_TTL.total_seconds()),
+        )
+        if acquired:
+            self._token = token
+        return bool(acquired)
+
+    def refresh(self) -> bool:
+        """Keep the claim from expiring while the shard is rendered, unless it was lost."""
+        return bool(
+            get_redis().eval(
+                _REFRESH_CLAIM_SCRIPT,
+                1,
+                f'{self._key}:claim',
+                self._token,
+                int(SHARD_CLAIM_TTL.total_seconds()),
+            )
+        )
+
+    @contextlib.contextmanager
+    def keep_alive(self) -> Iterator[None]:
+        """Refresh the claim in the background, however long its shard takes (e.g. to load)."""
+        stopped = threading.Event()
+
+        def run() -> None:
+            while not stopped.wait(SHARD_CLAIM_TTL.total_seconds() / 4):
+                try:
+                    if not self.refresh():
+                        logger.warning('Lost the claim %s to another task', self._key)
+                        return
+                except redis.RedisError:
+                    logger.exception('Failed to refresh the claim %s', self._key)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def _release(self, result: str) -> bool:
+        return bool(
+            get_redis().eval(
+                _RELEASE_CLAIM_SCRIPT,
+                2,
+                f'{self._key}:claim',
+                f'{self._key}:result',
+                self._token,
+                result,
+                int(SESSION_KEY_TTL.total_seconds()),
+            )
+        )
+
+    def release(self) -> bool:
+        """Give up the claim without a result, so the shard can be rendered again."""
+        return self._release('')
+
+    def complete(self, result: dict) -> bool:
+        """Record the result of the rendered shard, unless the claim was lost."""
+        return self._release(json.dumps(result))
+
+    def result(self) -> dict | None:
+        """Get the result of the shard, if it has been rendered."""
+        result = get_redis().get(f'{self._key}:result')
+        return None if result is None else json.loads(result)
+
+
+@dataclasses.dataclass(frozen=True)
+class PendingShard:
+    session_pk: str
+    # The run of the session the shard belongs to, identified by its sampler seed
+    run: int
+    shard: int
+    index_groups: list[list[int]]
+
+    def claim(self) -> ShardClaim:
+        return ShardClaim(self.session_pk, self.run, self.shard)
+
+
+def add_pending_shards(context: str, shards: list[PendingShard]) -> None:
+    """
+    Announce the shards of a run, which any task with the same render ``context`` may render.
+
+    A render context identifies everything needed to render a shard besides its poses, i.e.
+    the volume and the C-arm geometry.
+    """
+    if not shards:
+        return
+    key = _pending_shards_key(context)
+    with get_redis().pipeline() as pipe:
+        pipe.rpush(key, *(json.dumps(dataclasses.asdict(shard)) for shard in shards))
+        pipe.expire(key, SESSION_KEY_TTL)
+        pipe.execute()
+
+
+def pop_pending_shard(context: str) -> PendingShard | None:
+    """
+    Take the oldest announced shard of a render context, or None if there are none left.
+
+    The shard may have been claimed (or rendered) by its own task already; its claim must be
+    acquired before rendering it.
+    """
+    payload = get_redis().lpop(_pending_shards_key(context))
+    return None if payload is None else PendingShard(**json.loads(payload))
@@ -0,0 +1,39 @@
+import time
+
+import djclick as click
+
+from xray_genius.core.models import InputParameters
+from xray_genius.core.utils import DEFAULT_CHUNK_SIZE, ParameterSampler
+
+
+@click.command()
+@click.option('--num-poses', default=1_000_000, show_default=True)
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True)
+@click.option('--repeat', default=5, show_default=True)
+def benchmark_parameter_sampler(num_poses: int, chunk_size: int, repeat: int) -> None:
+    """Time sampling poses with every parameter randomized, all at once and in chunks."""
+    # Never saved, so the limit on the number of samples doesn't apply
+    input_parameters = InputParameters(
+        num_samples=num_poses,
+        carm_push_pull_std_dev=10,
+        carm_head_foot_std_dev=10,
+        carm_raise_lower_std_dev=10,
+        carm_alpha_kappa=5,
+        carm_beta_kappa=5,
+    )
+    sampler = ParameterSampler(input_parameters, seed=0)
+
+    def sample() -> None:
+        sampler.sample()
+
+    def stream() -> None:
+        for _ in sampler.iter_chunks(chunk_size):
+            pass
+
+    for name, benchmark in (('all at once', sample), (f'in chunks of {chunk_size}', stream)):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            benchmark()
+            timings.append(time.perf_counter() - start)
+        click.echo(f'Sampled {num_poses} poses {name}: best of {repeat} {min(timings):.3f}s')
@@ -0,0 +1,49 @@
+import logging
+
+from django.conf import settings
+from django.db import close_old_connections
+import djclick as click
+import numpy as np
+
+from xray_genius.core.coordination import next_pose_preview_request, send_pose_preview
+from xray_genius.core.models import Session
+from xray_genius.core.render.encoding import encode_preview
+from xray_genius.core.render.preview import PreviewRenderer
+
+logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option(
+    '--idle-timeout',
+    type=float,
+    default=lambda: settings.POSE_PREVIEW_IDLE_TIMEOUT,
+    show_default='POSE_PREVIEW_IDLE_TIMEOUT',
+    help='Seconds after which an unused volume is freed from the GPU.',
+)
+def run_pose_preview_worker(idle_timeout: float) -> None:
+    """Render the single-pose previews requested through the API, until interrupted."""
+    with PreviewRenderer(
+        sensor_size=settings.PREVIEW_DETECTOR_RESOLUTION, idle_timeout=idle_timeout
+    ) as renderer:
+        while True:
+            renderer.evict_idle()
+            # Wake up to free the projector once it's idle, or wait indefinitely if there's none
+            idle = renderer.seconds_until_idle()
+            request = next_pose_preview_request(timeout=0 if idle is None else max(idle, 0.1))
+            if request is None:
+                continue
+            if request.expired:
+                logger.info('Skipping expired preview of session %s', request.session_pk)
+                continue
+
+            close_old_connections()
+            try:
+                session = Session.objects.select_related('parameters', 'input_scan').get(
+                    pk=request.session_pk
+                )
+                png = encode_preview(renderer.render(session, np.array(request.pose)))
+            except Exception:
+                logger.exception('Failed to render a preview of session %s', request.session_pk)
+                png = b''
+            send_pose_preview(request, png)
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.12 on 2026-10-17 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0030_session_started'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ctinputfile',
+            name='render_artifact',
+            field=models.FileField(
+                blank=True,
+                help_text='The parsed volume, ready to be rendered.',
+                null=True,
+                upload_to='ct_render_artifacts',
+            ),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.12 on 2026-10-17 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0031_ctinputfile_render_artifact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outputimage',
+            name='index',
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text='The index of the sampled pose this image was rendered from.',
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='sampler_seed',
+            field=models.BigIntegerField(
+                blank=True,
+                help_text='The seed the poses of the current run were sampled with.',
+                null=True,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='outputimage',
+            constraint=models.UniqueConstraint(
+                fields=('session', 'index'), name='unique_output_image_session_index'
+            ),
+        ),
+    ]
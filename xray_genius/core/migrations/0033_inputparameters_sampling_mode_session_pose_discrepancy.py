@@ -0,0 +1,35 @@
+# Generated by Django 5.1.12 on 2026-10-17 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0032_session_sampler_seed_outputimage_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inputparameters',
+            name='sampling_mode',
+            field=models.CharField(
+                choices=[
+                    ('random', 'Random'),
+                    ('sobol', 'Sobol'),
+                    ('latin-hypercube', 'Latin Hypercube'),
+                ],
+                default='random',
+                help_text='How the randomized parameters of the C-arm pose are sampled.',
+                max_length=32,
+            ),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='pose_discrepancy',
+            field=models.FloatField(
+                blank=True,
+                help_text='The centered L2 discrepancy of the poses of the current run.',
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.12 on 2026-10-17 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0033_inputparameters_sampling_mode_session_pose_discrepancy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='fov_rejected_poses',
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text='The number of poses of the current run which missed the volume.',
+            ),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='fov_resampled_poses',
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text='The number of poses of the current run resampled to hit the volume.',
+            ),
+        ),
+    ]
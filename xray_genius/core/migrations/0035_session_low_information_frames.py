@@ -0,0 +1,20 @@
+# Generated by Django 5.1.12 on 2026-10-17 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0034_session_fov_resampled_poses_session_fov_rejected_poses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='low_information_frames',
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text='The number of images of the current run replaced for lack of detail.',
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.12 on 2026-10-17 20:06
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0035_session_low_information_frames'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inputparameters',
+            name='detector_resolution',
+            field=models.PositiveIntegerField(
+                default=1536,
+                help_text='The width and height of the detector in pixels.',
+                validators=[
+                    django.core.validators.MinValueValidator(64),
+                    django.core.validators.MaxValueValidator(2048),
+                ],
+            ),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='preview',
+            field=models.BooleanField(
+                default=False,
+                help_text='Whether the current run is a quick, low-resolution preview.',
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.12 on 2026-10-17 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0036_detector_resolution_session_preview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inputparameters',
+            name='output_format',
+            field=models.CharField(
+                choices=[
+                    ('png', '16-bit PNG'),
+                    ('npy', 'Float32 NPY'),
+                    ('npy-zstd', 'Float32 NPY (Zstandard)'),
+                    ('png+npy', '16-bit PNG and float32 NPY'),
+                ],
+                default='png',
+                help_text='How rendered images are stored; NPY images hold raw float32 values.',
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name='outputimage',
+            name='raw_image',
+            field=models.FileField(
+                blank=True,
+                help_text='The raw float32 image, as an NPY (possibly Zstandard-compressed).',
+                upload_to='output_images/raw',
+            ),
+        ),
+        migrations.AlterField(
+            model_name='outputimage',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='output_images'),
+        ),
+    ]
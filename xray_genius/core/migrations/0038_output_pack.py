@@ -0,0 +1,60 @@
+# Generated by Django 5.1.12 on 2026-10-17 20:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0037_output_format_raw_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outputimage',
+            name='pack_slices',
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text='The name, offset and length of each packed file, by field.',
+            ),
+        ),
+        migrations.AlterField(
+            model_name='outputimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, upload_to='output_images/thumbnails'),
+        ),
+        migrations.CreateModel(
+            name='OutputPack',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True)),
+                ('file', models.FileField(upload_to='output_images/packs')),
+                (
+                    'session',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='output_packs',
+                        to='core.session',
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='outputimage',
+            name='pack',
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name='output_images',
+                to='core.outputpack',
+            ),
+        ),
+    ]
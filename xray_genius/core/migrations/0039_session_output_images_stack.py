@@ -0,0 +1,32 @@
+# Generated by Django 5.1.12 on 2026-10-17 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0038_output_pack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='output_images_poses',
+            field=models.FileField(
+                blank=True,
+                help_text='The pose of each image of the stack, as an NPZ of columns.',
+                null=True,
+                upload_to='output_images/poses',
+            ),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='output_images_stack',
+            field=models.FileField(
+                blank=True,
+                help_text='The output images, as one memory-mappable (N, H, W) NPY.',
+                null=True,
+                upload_to='output_images/stacks',
+            ),
+        ),
+    ]
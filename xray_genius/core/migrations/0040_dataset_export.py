@@ -0,0 +1,104 @@
+# Generated by Django 5.1.12 on 2026-10-17 20:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0039_session_output_images_stack'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetExport',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True)),
+                (
+                    'session_ids',
+                    models.JSONField(
+                        default=list,
+                        help_text=(
+                            'The IDs of the exported sessions, in the order their samples are '
+                            'exported. They are fixed once the export is created, so each shard '
+                            'always holds the same samples.'
+                        ),
+                    ),
+                ),
+                (
+                    'status',
+                    models.CharField(
+                        choices=[
+                            ('queued', 'Queued'),
+                            ('running', 'Running'),
+                            ('finished', 'Finished'),
+                            ('failed', 'Failed'),
+                        ],
+                        default='queued',
+                        max_length=32,
+                    ),
+                ),
+                (
+                    'samples_per_shard',
+                    models.PositiveIntegerField(
+                        default=1000,
+                        help_text='The number of samples in each shard, except the last.',
+                    ),
+                ),
+                (
+                    'progressed',
+                    models.DateTimeField(
+                        blank=True,
+                        help_text='When the export last started running, or stored a shard.',
+                        null=True,
+                    ),
+                ),
+                (
+                    'owner',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='dataset_exports',
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DatasetExportShard',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('index', models.PositiveIntegerField()),
+                ('num_samples', models.PositiveIntegerField()),
+                ('file', models.FileField(upload_to='dataset_exports')),
+                (
+                    'export',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='shards',
+                        to='core.datasetexport',
+                    ),
+                ),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(
+                        fields=('export', 'index'), name='unique_dataset_export_shard_index'
+                    )
+                ],
+            },
+        ),
+    ]
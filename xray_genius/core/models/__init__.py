@@ -1,15 +1,19 @@
 from .contact_form import ContactFormSubmission
 from .ct_input_file import CTInputFile
+from .dataset_export import DatasetExport, DatasetExportShard
 from .input_parameters import InputParameters
-from .output_image import OutputImage
+from .output_image import OutputImage, OutputPack
 from .sample_dataset import SampleDataset, SampleDatasetFile
 from .session import Session
 
 __all__ = [
     'CTInputFile',
     'ContactFormSubmission',
+    'DatasetExport',
+    'DatasetExportShard',
     'InputParameters',
     'OutputImage',
+    'OutputPack',
     'SampleDataset',
     'SampleDatasetFile',
     'Session',
@@ -1,6 +1,7 @@
 from pathlib import Path
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.db.models import signals
 from django.dispatch import receiver
 from django_extensions.db.fields import CreationDateTimeField
@@ -13,6 +14,13 @@ class CTInputFile(models.Model):
     created = CreationDateTimeField()
 
     file = S3FileField()
+    # Produced by preprocessing, see `xray_genius.core.render.volumes`
+    render_artifact = models.FileField(
+        upload_to='ct_render_artifacts',
+        null=True,
+        blank=True,
+        help_text='The parsed volume, ready to be rendered.',
+    )
 
     def __str__(self) -> str:
         return self.filename
@@ -22,8 +30,28 @@ class CTInputFile(models.Model):
         return Path(self.file.name).name
 
 
+@receiver(signals.post_save, sender=CTInputFile)
+def preprocess_file(sender: type[CTInputFile], instance: CTInputFile, *, created: bool, **kwargs):
+    if created:
+        # Imported here to avoid a circular import
+        from xray_genius.core.tasks import preprocess_ct_input_file_task
+
+        # Preprocessing doesn't need a GPU, so it may be routed to a queue of CPU-only workers
+        transaction.on_commit(
+            lambda: preprocess_ct_input_file_task.apply_async(
+                (instance.pk,), queue=settings.VOLUME_PREPROCESSING_QUEUE
+            )
+        )
+
+
 @receiver(signals.post_delete, sender=CTInputFile)
 def delete_file(sender: type[CTInputFile], instance: CTInputFile, **kwargs):
     # Only delete the associated S3 blob if it is not part of a sample dataset
     if not SampleDatasetFile.objects.filter(file=instance.file).exists():
         instance.file.delete()
+    # Files of sample datasets share their render artifact
+    if (
+        instance.render_artifact
+        and not CTInputFile.objects.filter(render_artifact=instance.render_artifact).exists()
+    ):
+        instance.render_artifact.delete(save=False)
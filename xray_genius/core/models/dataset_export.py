@@ -0,0 +1,78 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import signals
+from django.dispatch import receiver
+from django.utils import timezone
+from django_extensions.db.fields import CreationDateTimeField
+
+DEFAULT_SAMPLES_PER_SHARD = 1000
+
+
+class DatasetExport(models.Model):
+    """An export of the output images of many sessions, as a series of WebDataset tar shards."""
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        FINISHED = 'finished', 'Finished'
+        FAILED = 'failed', 'Failed'
+
+    created = CreationDateTimeField()
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='dataset_exports')
+    session_ids = models.JSONField(
+        default=list,
+        help_text=(
+            'The IDs of the exported sessions, in the order their samples are exported. They are '
+            'fixed once the export is created, so each shard always holds the same samples.'
+        ),
+    )
+    status = models.CharField(max_length=32, choices=Status.choices, default=Status.QUEUED)
+    samples_per_shard = models.PositiveIntegerField(
+        default=DEFAULT_SAMPLES_PER_SHARD,
+        help_text='The number of samples in each shard, except the last.',
+    )
+    progressed = models.DateTimeField(
+        null=True, blank=True, help_text='When the export last started running, or stored a shard.'
+    )
+
+    def __str__(self) -> str:
+        return f'Dataset Export {self.pk} ({self.status})'
+
+    @property
+    def is_stale(self) -> bool:
+        """Whether the export is running, but hasn't made progress for a while."""
+        timeout = timedelta(seconds=settings.DATASET_EXPORT_STALE_TIMEOUT)
+        return (
+            self.status == DatasetExport.Status.RUNNING
+            and self.progressed is not None
+            and timezone.now() - self.progressed > timeout
+        )
+
+    @property
+    def resumable(self) -> bool:
+        return self.status == DatasetExport.Status.FAILED or self.is_stale
+
+
+class DatasetExportShard(models.Model):
+    export = models.ForeignKey(DatasetExport, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveIntegerField()
+    num_samples = models.PositiveIntegerField()
+    file = models.FileField(upload_to='dataset_exports')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['export', 'index'], name='unique_dataset_export_shard_index'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'Dataset Export Shard {self.index} (Dataset Export {self.export_id})'
+
+
+@receiver(signals.post_delete, sender=DatasetExportShard)
+def delete_file(sender: type[DatasetExportShard], instance: DatasetExportShard, **kwargs):
+    instance.file.delete(save=False)
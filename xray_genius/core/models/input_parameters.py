@@ -8,6 +8,8 @@ from .session import Session
 
 # The default is the default sensor width/height from deepdrr.device.mobile_carm.MobileCArm
 DEFAULT_SENSOR_SIZE = 1536
+MIN_SENSOR_SIZE = 64
+MAX_SENSOR_SIZE = 2048
 
 
 def concentration_to_degrees(conc: float) -> float:
@@ -15,6 +17,17 @@ def concentration_to_degrees(conc: float) -> float:
 
 
 class InputParameters(models.Model):
+    class SamplingMode(models.TextChoices):
+        RANDOM = 'random', 'Random'
+        SOBOL = 'sobol', 'Sobol'
+        LATIN_HYPERCUBE = 'latin-hypercube', 'Latin Hypercube'
+
+    class OutputFormat(models.TextChoices):
+        PNG = 'png', '16-bit PNG'
+        NPY = 'npy', 'Float32 NPY'
+        NPY_ZSTD = 'npy-zstd', 'Float32 NPY (Zstandard)'
+        PNG_AND_NPY = 'png+npy', '16-bit PNG and float32 NPY'
+
     created = CreationDateTimeField()
 
     session = models.OneToOneField(Session, related_name='parameters', on_delete=models.CASCADE)
@@ -57,8 +70,30 @@ class InputParameters(models.Model):
         ],
         help_text='The number of x-rays to generate with DeepDRR.',
     )
+    sampling_mode = models.CharField(
+        max_length=32,
+        choices=SamplingMode.choices,
+        default=SamplingMode.RANDOM,
+        help_text='How the randomized parameters of the C-arm pose are sampled.',
+    )
     # Defaults to a 9" diameter
     detector_diameter = models.FloatField(help_text='The detector diameter in mm.', default=228.6)
+    # The detector diameter stays the same at any resolution, only its pixels change size
+    detector_resolution = models.PositiveIntegerField(
+        default=DEFAULT_SENSOR_SIZE,
+        validators=[
+            MinValueValidator(MIN_SENSOR_SIZE),
+            MaxValueValidator(MAX_SENSOR_SIZE),
+        ],
+        help_text='The width and height of the detector in pixels.',
+    )
+    # Uncompressed NPY images can be memory-mapped, with `np.load(mmap_mode='r')`
+    output_format = models.CharField(
+        max_length=16,
+        choices=OutputFormat.choices,
+        default=OutputFormat.PNG,
+        help_text='How rendered images are stored; NPY images hold raw float32 values.',
+    )
 
     def __str__(self) -> str:
         return f'Input Parameters (Session {self.session_id})'
@@ -66,7 +101,15 @@ class InputParameters(models.Model):
     @property
     def sensor_pixel_pitch(self):
         """The sensor pixel pitch."""
-        return self.detector_diameter / DEFAULT_SENSOR_SIZE
+        return self.detector_diameter / self.detector_resolution
+
+    @property
+    def stores_png(self) -> bool:
+        return self.output_format in (self.OutputFormat.PNG, self.OutputFormat.PNG_AND_NPY)
+
+    @property
+    def stores_npy(self) -> bool:
+        return self.output_format != self.OutputFormat.PNG
 
     @property
     def carm_alpha_kappa_degrees(self):
@@ -1,16 +1,57 @@
 from django.db import models
 from django.db.models import signals
 from django.dispatch import receiver
+from django.urls import reverse
 from django_extensions.db.fields import CreationDateTimeField
 
+from xray_genius.core.render.download import read_range
+
 from .session import Session
 
+# The fields of an output image which hold a file, either on its own or in a pack
+FILE_FIELDS = ('image', 'thumbnail', 'raw_image')
+
+
+class OutputPack(models.Model):
+    """The files of a batch of output images, concatenated into a single stored object."""
+
+    created = CreationDateTimeField()
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='output_packs')
+    file = models.FileField(upload_to='output_images/packs')
+
+    def __str__(self) -> str:
+        return f'Output Pack {self.pk} (Session {self.session_id})'
+
 
 class OutputImage(models.Model):
     created = CreationDateTimeField()
-    image = models.ImageField(upload_to='output_images')
-    thumbnail = models.ImageField(upload_to='output_images/thumbnails')
+    # Either or both of the images are stored, depending on the session's output format
+    image = models.ImageField(upload_to='output_images', blank=True)
+    raw_image = models.FileField(
+        upload_to='output_images/raw',
+        blank=True,
+        help_text='The raw float32 image, as an NPY (possibly Zstandard-compressed).',
+    )
+    thumbnail = models.ImageField(upload_to='output_images/thumbnails', blank=True)
+    # Packed images have none of the above, but a slice of their pack for each of them instead
+    pack = models.ForeignKey(
+        OutputPack,
+        on_delete=models.CASCADE,
+        related_name='output_images',
+        null=True,
+        blank=True,
+    )
+    pack_slices = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text='The name, offset and length of each packed file, by field.',
+    )
     session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='output_images')
+    index = models.PositiveIntegerField(
+        help_text='The index of the sampled pose this image was rendered from.',
+        null=True,
+        blank=True,
+    )
 
     # Parameters for this specific output image
     carm_push_pull = models.FloatField(null=True, blank=True)
@@ -23,11 +64,81 @@ class OutputImage(models.Model):
         null=True, blank=True, help_text='The desired secondary angulation of the C-arm in degrees.'
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['session', 'index'], name='unique_output_image_session_index'
+            ),
+        ]
+
     def __str__(self) -> str:
         return f'Output Image {self.pk} (Session {self.session_id})'
 
+    def has_file(self, field_name: str) -> bool:
+        return field_name in self.pack_slices or bool(getattr(self, field_name))
+
+    def file_name(self, field_name: str) -> str:
+        """Get the base name of one of the image's files."""
+        if packed := self.pack_slices.get(field_name):
+            return packed['name']
+        return getattr(self, field_name).name.rsplit('/', 1)[-1]
+
+    def read_file(self, field_name: str) -> bytes:
+        """Read one of the image's files, whether it's stored on its own or in a pack."""
+        if packed := self.pack_slices.get(field_name):
+            return read_range(self.pack.file, packed['offset'], packed['length'])
+        with getattr(self, field_name).open('rb') as f:
+            return f.read()
+
+    def file_url(self, field_name: str) -> str:
+        """Get a URL of one of the image's files; packed files are served by the app."""
+        if field_name in self.pack_slices:
+            return reverse(
+                'output-image-file',
+                kwargs={
+                    'session_pk': self.session_id,
+                    'output_image_pk': self.pk,
+                    'field_name': field_name,
+                },
+            )
+        return getattr(self, field_name).url
+
+    @property
+    def image_url(self) -> str:
+        return self.file_url('image') if self.has_file('image') else ''
 
-@receiver(signals.pre_delete, sender=OutputImage)
+    @property
+    def thumbnail_url(self) -> str:
+        return self.file_url('thumbnail') if self.has_file('thumbnail') else ''
+
+    @property
+    def raw_image_url(self) -> str:
+        return self.file_url('raw_image') if self.has_file('raw_image') else ''
+
+
+@receiver(signals.post_delete, sender=OutputImage)
 def delete_file(sender: type[OutputImage], instance: OutputImage, **kwargs):
-    instance.image.delete(save=False)
-    instance.thumbnail.delete(save=False)
+    # Images of identical poses share their files, so only delete those no longer referenced
+    if instance.image and not OutputImage.objects.filter(image=instance.image.name).exists():
+        instance.image.delete(save=False)
+    if (
+        instance.raw_image
+        and not OutputImage.objects.filter(raw_image=instance.raw_image.name).exists()
+    ):
+        instance.raw_image.delete(save=False)
+    if (
+        instance.thumbnail
+        and not OutputImage.objects.filter(thumbnail=instance.thumbnail.name).exists()
+    ):
+        instance.thumbnail.delete(save=False)
+    # A pack is deleted along with the last image in it
+    if (
+        instance.pack_id is not None
+        and not OutputImage.objects.filter(pack_id=instance.pack_id).exists()
+    ):
+        OutputPack.objects.filter(pk=instance.pack_id).delete()
+
+
+@receiver(signals.post_delete, sender=OutputPack)
+def delete_pack_file(sender: type[OutputPack], instance: OutputPack, **kwargs):
+    instance.file.delete(save=False)
@@ -54,11 +54,59 @@ class Session(models.Model):
     input_scan = models.ForeignKey(CTInputFile, on_delete=models.CASCADE, related_name='sessions')
     status = models.CharField(max_length=32, choices=Status.choices, default=Status.NOT_STARTED)
     celery_task_id = models.CharField(max_length=255, default='')
+    sampler_seed = models.BigIntegerField(
+        help_text='The seed the poses of the current run were sampled with.',
+        null=True,
+        blank=True,
+    )
+    pose_discrepancy = models.FloatField(
+        help_text='The centered L2 discrepancy of the poses of the current run.',
+        null=True,
+        blank=True,
+    )
+    fov_resampled_poses = models.PositiveIntegerField(
+        help_text='The number of poses of the current run resampled to hit the volume.',
+        default=0,
+    )
+    fov_rejected_poses = models.PositiveIntegerField(
+        help_text='The number of poses of the current run which missed the volume.',
+        default=0,
+    )
+    low_information_frames = models.PositiveIntegerField(
+        help_text='The number of images of the current run replaced for lack of detail.',
+        default=0,
+    )
+    preview = models.BooleanField(
+        help_text='Whether the current run is a quick, low-resolution preview.',
+        default=False,
+    )
 
     output_images_zip = models.FileField(upload_to='output_images/zips', null=True, blank=True)
+    # The images stacked into a single array, and the pose of each of them, for ML pipelines
+    output_images_stack = models.FileField(
+        upload_to='output_images/stacks',
+        null=True,
+        blank=True,
+        help_text='The output images, as one memory-mappable (N, H, W) NPY.',
+    )
+    output_images_poses = models.FileField(
+        upload_to='output_images/poses',
+        null=True,
+        blank=True,
+        help_text='The pose of each image of the stack, as an NPZ of columns.',
+    )
 
     objects = SessionManager()
     stuck_objects = StuckSessionsManager()
 
     def __str__(self) -> str:
         return f'Session {self.id} ({self.status})'
+
+    @property
+    def is_finished_preview(self) -> bool:
+        return self.status == Session.Status.PROCESSED and self.preview
+
+    def discard_preview(self) -> None:
+        """Delete the output images of a finished preview, so the session can run again."""
+        if self.is_finished_preview:
+            self.output_images.all().delete()
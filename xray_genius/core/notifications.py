@@ -67,27 +67,32 @@ class TaskTracker:
             self._dirty = False
 
     @contextmanager
-    def running(self):
+    def running(self, *, finish: bool = True):
+        # When a task is only one part of a larger job (e.g. one shard of a session), it must
+        # not report success, as the job as a whole is still running; failure is still final.
         self.status = TaskStatus.RUNNING
         self.flush()
 
         try:
             yield self
-            self.status = TaskStatus.SUCCEEDED
+            if finish:
+                self.status = TaskStatus.SUCCEEDED
         except Exception:
             self.status = TaskStatus.FAILED
             self.description = 'An error occurred'
+            finish = True
             raise
         finally:
             self.flush()
-            for group in self.groups:
-                self._sync_group_send(
-                    group,
-                    {
-                        'type': 'close_connection',
-                        'message': {},
-                    },
-                )
+            if finish:
+                for group in self.groups:
+                    self._sync_group_send(
+                        group,
+                        {
+                            'type': 'close_connection',
+                            'message': {},
+                        },
+                    )
 
     @property
     def description(self):
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
+import shutil
+from tempfile import TemporaryFile
+from typing import IO, Self
+from uuid import uuid4
+from zipfile import ZipFile
+
+from xray_genius.core.models import OutputImage, Session
+
+from .outputs import store_output_file
+
+# The files of each output image which are archived, in the order of their entries
+ARCHIVED_FIELDS = ('image', 'raw_image')
+
+
+def archive_entry_name(output_image: OutputImage, field_name: str, names: set[str]) -> str:
+    """
+    Name the entry of an output image's file, unique among the ``names`` already taken.
+
+    Images of identical poses share their files, but each gets its own entry.
+    """
+    name = output_image.file_name(field_name)
+    if name in names:
+        stem, _, extensions = name.partition('.')
+        name = f'{stem}_{output_image.pk}.{extensions}'
+    names.add(name)
+    return name
+
+
+class ArchivePart:
+    """
+    A zip of the output images of one shard, built as they're saved.
+
+    Images are added with the contents their shard already holds in memory, so that the
+    session's zip can be put together from the parts of its shards, rather than by reading
+    every image back from storage. The part is spooled to a temporary file until it's stored.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._file = TemporaryFile()  # noqa: SIM115
+        self._zip = ZipFile(self._file, 'w')
+        self._names: set[str] = set()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def add(self, output_image: OutputImage, contents: dict[str, bytes]) -> None:
+        """Add the files of a saved output image, by the field they're stored for."""
+        for field_name in ARCHIVED_FIELDS:
+            if field_name in contents:
+                name = archive_entry_name(output_image, field_name, self._names)
+                self._zip.writestr(name, contents[field_name])
+        self.count += 1
+
+    def store(self) -> str:
+        """Finish the zip and upload it, returning its name in the storage of session zips."""
+        self._zip.close()
+        self._file.seek(0)
+        return store_output_file('output_images_zip', f'{uuid4()}.zip', self._file, model=Session)
+
+    def close(self) -> None:
+        self._zip.close()
+        self._file.close()
+
+
+def merge_archives(sources: Iterable[IO[bytes]], dest: IO[bytes]) -> None:
+    """Merge zips into a single one, copying each of their entries as is, in order."""
+    with ZipFile(dest, 'w') as dest_zip:
+        for source in sources:
+            with ZipFile(source) as source_zip:
+                for info in source_zip.infolist():
+                    with source_zip.open(info) as src, dest_zip.open(info, 'w') as dst:
+                        shutil.copyfileobj(src, dst)
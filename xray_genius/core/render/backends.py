@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+from django.core.exceptions import ImproperlyConfigured
+import numpy as np
+
+from .geometry import CArmGeometry
+from .raycast import (
+    attenuate,
+    detector_rays,
+    material_densities,
+    neglog,
+    trace_area_densities,
+)
+
+if TYPE_CHECKING:
+    from deepdrr import Volume
+
+# The X-ray spectrum images are rendered with, which is deepdrr's default
+SPECTRUM = '90KV_AL40'
+
+
+def spectral_attenuation(materials: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Get the energies of `SPECTRUM` in keV, their probabilities, and the coefficients of materials.
+
+    The coefficients are the mass attenuation coefficient of each material at each energy, as
+    (E, M), from deepdrr's tables.
+    """
+    from deepdrr.projector import mass_attenuation, spectral_data
+
+    spectrum = spectral_data.spectrums[SPECTRUM]
+    # Spectra are tabulated in eV
+    energies = spectrum[:, 0] / 1000
+    pdf = spectrum[:, 1] / spectrum[:, 1].sum()
+    coefficients = np.array(
+        [
+            [mass_attenuation.get_absorption_coefs(energy, material) for material in materials]
+            for energy in energies
+        ]
+    )
+    return energies, pdf, coefficients
+
+
+class ProjectorBackend(ABC):
+    """
+    Renders images of one volume, with the detector of one C-arm geometry.
+
+    A backend holds no resources until it's initialized, and must be freed once done with.
+    Rendered images are scaled to [0, 1], with empty space at 0.
+    """
+
+    def __init__(self, volume: Volume, geometry: CArmGeometry) -> None:
+        self.volume = volume
+        self.geometry = geometry
+
+    @abstractmethod
+    def initialize(self) -> None:
+        pass
+
+    @abstractmethod
+    def render(self, camera3d_from_world: np.ndarray) -> np.ndarray:
+        """Render the volume from a camera frame, e.g. one of `CArmGeometry.frames`."""
+
+    @abstractmethod
+    def free(self) -> None:
+        pass
+
+
+class CudaBackend(ProjectorBackend):
+    """Render with deepdrr's projector, on the GPU."""
+
+    def initialize(self) -> None:
+        # Imported here to avoid attempting to load CUDA on the web server
+        from deepdrr.projector import Projector
+
+        self._carm = self.geometry.mobile_carm()
+        self._projector = Projector(self.volume, carm=self._carm, spectrum=SPECTRUM)
+        self._projector.initialize()
+
+    def render(self, camera3d_from_world: np.ndarray) -> np.ndarray:
+        from deepdrr import geo
+
+        return self._projector(
+            geo.CameraProjection(
+                self._carm.camera_intrinsics, geo.FrameTransform(camera3d_from_world)
+            )
+        )
+
+    def free(self) -> None:
+        self._projector.free()
+
+
+class NumpyBackend(ProjectorBackend):
+    """
+    Render by ray marching through the volume with NumPy, on the CPU.
+
+    This follows the model of deepdrr's projector (without scatter or noise): the density of
+    each material is integrated along each ray, attenuated by the spectrum, and then negative
+    log transformed. It's much slower, so it's meant for tests and low-resolution renders on
+    workers without a GPU.
+    """
+
+    # The distance between samples along each ray, relative to the volume's smallest spacing
+    step_voxels = 0.5
+
+    def initialize(self) -> None:
+        materials = list(self.volume.materials)
+        self._densities = material_densities(
+            self.volume.data, [self.volume.materials[material] for material in materials]
+        )
+        world_from_ijk = self.volume.world_from_ijk.data
+        self._ijk_from_world = np.linalg.inv(world_from_ijk)
+        self._step = self.step_voxels * np.linalg.norm(world_from_ijk[:3, :3], axis=0).min()
+        self._energies, self._pdf, self._coefficients = spectral_attenuation(materials)
+
+    def render(self, camera3d_from_world: np.ndarray) -> np.ndarray:
+        size = self.geometry.sensor_size
+        source, directions = detector_rays(self.geometry.intrinsic, camera3d_from_world, size)
+        area_densities = trace_area_densities(
+            self._densities, self._ijk_from_world, source, directions, self._step
+        )
+        intensity = attenuate(area_densities, self._energies, self._pdf, self._coefficients)
+        return neglog(intensity.reshape(size, size))
+
+    def free(self) -> None:
+        del self._densities
+
+
+PROJECTOR_BACKENDS: dict[str, type[ProjectorBackend]] = {
+    'cuda': CudaBackend,
+    'numpy': NumpyBackend,
+}
+
+
+def create_backend(name: str, volume: Volume, geometry: CArmGeometry) -> ProjectorBackend:
+    """Create an (uninitialized) projector backend, by its name in `PROJECTOR_BACKENDS`."""
+    try:
+        backend = PROJECTOR_BACKENDS[name]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f'Unknown projector backend {name!r}, expected one of {", ".join(PROJECTOR_BACKENDS)}'
+        ) from None
+    return backend(volume, geometry)
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import dataclasses
+from io import BytesIO
+import logging
+import threading
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (64, 64)
+
+# Each encoding thread reuses its own output buffers, rather than allocating new ones per image
+_buffers = threading.local()
+
+
+@dataclasses.dataclass
+class EncodedFrame:
+    """
+    The encoded bytes of a rendered image (in each requested format) and its thumbnail.
+
+    The buffers are owned by the thread which encoded them, and are overwritten by that thread's
+    next call to `encode_frame`, so they must be consumed (e.g. uploaded) before then.
+    """
+
+    thumbnail: BytesIO
+    # The 16-bit PNG
+    image: BytesIO | None = None
+    # The float32 NPY, which may be Zstandard-compressed
+    raw: BytesIO | None = None
+
+
+def quantize(image: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Convert a rendered image to 16-bit and 8-bit unsigned integer images."""
+    if image.dtype in (np.float16, np.float32, np.float64):
+        image_u16 = np.clip(image * 0xFFFF, 0, 0xFFFF).astype(np.uint16)
+        image_u8 = np.clip(image * 0xFF, 0, 0xFF).astype(np.uint8)
+    else:
+        logger.warning('Naive cast image (unknown dtype %r).', image.dtype)
+        image_u16 = image.astype(np.uint16)
+        image_u8 = image.astype(np.uint8)
+    return image_u16, image_u8
+
+
+def _reset(buffer: BytesIO) -> BytesIO:
+    # Overwrite from the start and truncate afterwards, so the underlying allocation is reused
+    buffer.seek(0)
+    return buffer
+
+
+def _finish(buffer: BytesIO) -> BytesIO:
+    buffer.truncate()
+    buffer.seek(0)
+    return buffer
+
+
+def _encode_npy(image: np.ndarray, *, compress: bool) -> BytesIO:
+    raw_buffer = _reset(_buffers.raw)
+    np.save(raw_buffer, np.asarray(image, dtype=np.float32), allow_pickle=False)
+    raw_buffer = _finish(raw_buffer)
+    if not compress:
+        return raw_buffer
+
+    # Imported here, since this is only installed on workers
+    import zstandard
+
+    compressed_buffer = _reset(_buffers.compressed)
+    with raw_buffer.getbuffer() as raw:
+        # The frame records its decompressed size, so it can be decompressed in one call
+        compressed_buffer.write(zstandard.ZstdCompressor().compress(raw))
+    return _finish(compressed_buffer)
+
+
+def encode_frame(
+    image: np.ndarray, *, png: bool = True, npy: bool = False, compress_npy: bool = False
+) -> EncodedFrame:
+    """
+    Encode a rendered image and its thumbnail, in memory.
+
+    The image is encoded as a 16-bit PNG and/or as a float32 NPY of its raw values, which is
+    optionally compressed with Zstandard. The thumbnail is always an 8-bit PNG.
+    """
+    if not hasattr(_buffers, 'image'):
+        _buffers.image = BytesIO()
+        _buffers.thumbnail = BytesIO()
+        _buffers.raw = BytesIO()
+        _buffers.compressed = BytesIO()
+
+    image_u16, image_u8 = quantize(image)
+    encoded = EncodedFrame(thumbnail=_reset(_buffers.thumbnail))
+
+    if png:
+        # Imported here, since this is only installed on workers
+        import png as pypng
+
+        image_buffer = _reset(_buffers.image)
+        pypng.from_array(image_u16, mode='L;16').write(image_buffer)
+        encoded.image = _finish(image_buffer)
+    if npy:
+        encoded.raw = _encode_npy(image, compress=compress_npy)
+
+    thumbnail = Image.fromarray(image_u8)
+    thumbnail.thumbnail(THUMBNAIL_SIZE)
+    thumbnail.save(encoded.thumbnail, format='PNG')
+    _finish(encoded.thumbnail)
+
+    return encoded
+
+
+def encode_preview(image: np.ndarray) -> bytes:
+    """Encode a rendered image as an 8-bit PNG, which is enough to be looked at in a browser."""
+    _, image_u8 = quantize(image)
+    buffer = BytesIO()
+    Image.fromarray(image_u8).save(buffer, format='PNG')
+    return buffer.getvalue()
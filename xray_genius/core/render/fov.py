@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+import dataclasses
+import itertools
+
+import numpy as np
+
+from .geometry import CArmGeometry
+
+
+def volume_corners(shape: tuple[int, int, int], world_from_ijk: np.ndarray) -> np.ndarray:
+    """Get the 8 world-space corners of a volume's (cell-centered) voxel grid, as (8, 3)."""
+    ijk = np.array(list(itertools.product(*((-0.5, size - 0.5) for size in shape))))
+    return ijk @ world_from_ijk[:3, :3].T + world_from_ijk[:3, 3]
+
+
+def detector_coverage(geometry: CArmGeometry, poses: np.ndarray, corners: np.ndarray) -> np.ndarray:
+    """
+    Estimate the fraction of the detector which a volume projects onto, for (N, 5) poses.
+
+    The bounding rectangle of the projected corners is used, which never underestimates the
+    coverage. If the source is level with (or inside) the volume, its projection is unbounded,
+    and the coverage is taken to be complete.
+    """
+    projections = geometry.frames(poses).projections
+    homogeneous = np.einsum(
+        'nij,kj->nki', projections, np.column_stack([corners, np.ones(len(corners))])
+    )
+    depths = homogeneous[:, :, 2]
+    in_front = (depths > 0).all(axis=1)
+    pixels = homogeneous[:, :, :2] / np.where(depths > 0, depths, 1)[:, :, np.newaxis]
+
+    lower = np.clip(pixels.min(axis=1), 0, geometry.sensor_size)
+    upper = np.clip(pixels.max(axis=1), 0, geometry.sensor_size)
+    covered = np.prod(upper - lower, axis=1) / geometry.sensor_size**2
+    return np.where(in_front, covered, 1.0)
+
+
+@dataclasses.dataclass
+class FieldOfViewCheck:
+    """The poses to render, once those which miss the volume have been resampled or rejected."""
+
+    # Each pose (of 5 parameters), with the indices of the samples it's rendered for
+    renders: list[tuple[np.ndarray, list[int]]]
+    # The number of samples whose pose was replaced by a resampled one
+    resampled: int = 0
+    # The number of samples for which no pose within the field of view was found
+    rejected: int = 0
+
+
+def check_field_of_view(  # noqa: PLR0913
+    poses: np.ndarray,
+    index_groups: list[list[int]],
+    *,
+    geometry: CArmGeometry,
+    corners: np.ndarray,
+    min_coverage: float,
+    max_resamples: int,
+    resample: Callable[[int, int], np.ndarray],
+) -> FieldOfViewCheck:
+    """
+    Find the poses whose projection of the volume covers too little of the detector.
+
+    Each item of ``index_groups`` is a list of the indices of identical poses, which are only
+    checked (and rendered) once. The samples of a group which fails the check are resampled
+    individually by ``resample(index, attempt)``, until a pose passes or ``max_resamples``
+    attempts have been made; samples which never pass are rejected.
+    """
+    if min_coverage <= 0 or not index_groups:
+        return FieldOfViewCheck([(poses[group[0]], group) for group in index_groups])
+
+    coverage = detector_coverage(geometry, poses[[group[0] for group in index_groups]], corners)
+    check = FieldOfViewCheck(
+        [
+            (poses[group[0]], group)
+            for group, covered in zip(index_groups, coverage, strict=True)
+            if covered >= min_coverage
+        ]
+    )
+    remaining = [
+        index
+        for group, covered in zip(index_groups, coverage, strict=True)
+        if covered < min_coverage
+        for index in group
+    ]
+
+    for attempt in range(max_resamples):
+        if not remaining:
+            break
+        candidates = np.array([resample(index, attempt) for index in remaining])
+        coverage = detector_coverage(geometry, candidates, corners)
+        check.renders.extend(
+            (candidate, [index])
+            for index, candidate, covered in zip(remaining, candidates, coverage, strict=True)
+            if covered >= min_coverage
+        )
+        check.resampled += int((coverage >= min_coverage).sum())
+        remaining = [
+            index
+            for index, covered in zip(remaining, coverage, strict=True)
+            if covered < min_coverage
+        ]
+
+    check.rejected = len(remaining)
+    check.renders.sort(key=lambda render: render[1][0])
+    return check
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import dataclasses
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from xray_genius.core.models import InputParameters
+from xray_genius.core.models.input_parameters import DEFAULT_SENSOR_SIZE
+
+if TYPE_CHECKING:
+    from deepdrr import MobileCArm
+
+# The angle limits the C-arm is configured with, in degrees
+MIN_ANGLE = -180
+MAX_ANGLE = 180
+
+# Rotates the camera about the principal ray so that down in the image is toward -X, as
+# deepdrr's `MobileCArm(rotate_camera_left=True)` does
+_ROTATE_CAMERA_LEFT = np.array([[0.0, -1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
+
+
+def pose_isocenters(poses: np.ndarray) -> np.ndarray:
+    """
+    Get the world-space isocenters of (N, 5) poses, as an (N, 3) array.
+
+    Pose translations are in LPS, but the CT is placed supine in ILA (-Z, +X, -Y), so
+    head/foot is along -X, push/pull along +Y, and raise/lower along -Z.
+    """
+    return np.column_stack([-poses[:, 1], poses[:, 0], -poses[:, 2]])
+
+
+def _rotations(poses: np.ndarray) -> np.ndarray:
+    """Get the (N, 3, 3) rotations of the arm, about X by alpha and then about Y by beta."""
+    alpha = np.deg2rad(np.clip(poses[:, 3], MIN_ANGLE, MAX_ANGLE))
+    beta = np.deg2rad(np.clip(poses[:, 4], MIN_ANGLE, MAX_ANGLE))
+    ca, sa, cb, sb = np.cos(alpha), np.sin(alpha), np.cos(beta), np.sin(beta)
+    zeros, ones = np.zeros_like(alpha), np.ones_like(alpha)
+    rotate_x = np.stack([ones, zeros, zeros, zeros, ca, -sa, zeros, sa, ca], axis=-1).reshape(
+        -1, 3, 3
+    )
+    rotate_y = np.stack([cb, zeros, sb, zeros, ones, zeros, -sb, zeros, cb], axis=-1).reshape(
+        -1, 3, 3
+    )
+    return rotate_y @ rotate_x
+
+
+@dataclasses.dataclass(frozen=True)
+class PoseFrames:
+    """The camera frames and projections of N poses, all in world space."""
+
+    # The (3, 3) intrinsic matrix, shared by every pose
+    intrinsic: np.ndarray
+    # The (N, 4, 4) transforms to the camera frame, whose Z axis points from source to detector
+    camera3d_from_world: np.ndarray
+    # The (N, 3, 4) projections to pixel indices of the detector
+    projections: np.ndarray
+    # The (N, 3) positions of the X-ray source
+    sources: np.ndarray
+    # The (N, 3) positions of the detector's center
+    detector_centers: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.projections)
+
+
+@dataclasses.dataclass(frozen=True)
+class CArmGeometry:
+    """
+    The geometry of the C-arm which images are rendered with.
+
+    This computes the same frames as deepdrr's `MobileCArm` (as configured for rendering, with
+    the source halfway between the detector and the isocenter), but for every pose at once.
+    """
+
+    source_to_detector_distance: float
+    pixel_size: float
+    sensor_size: int = DEFAULT_SENSOR_SIZE
+
+    @classmethod
+    def from_parameters(
+        cls, parameters: InputParameters, sensor_size: int | None = None
+    ) -> CArmGeometry:
+        """Get the geometry of the parameters' C-arm, optionally at another detector resolution."""
+        sensor_size = sensor_size or parameters.detector_resolution
+        return cls(
+            source_to_detector_distance=parameters.source_to_detector_distance,
+            pixel_size=parameters.detector_diameter / sensor_size,
+            sensor_size=sensor_size,
+        )
+
+    @property
+    def source_to_isocenter_distance(self) -> float:
+        return self.source_to_detector_distance / 2
+
+    @property
+    def intrinsic(self) -> np.ndarray:
+        focal_length = self.source_to_detector_distance / self.pixel_size
+        center = self.sensor_size / 2
+        return np.array([[focal_length, 0.0, center], [0.0, focal_length, center], [0.0, 0.0, 1.0]])
+
+    def mobile_carm(self) -> MobileCArm:
+        """Get deepdrr's C-arm of this geometry, which provides the intrinsics of projectors."""
+        # Imported here to avoid attempting to load CUDA on the web server
+        from deepdrr import MobileCArm
+
+        return MobileCArm(
+            source_to_detector_distance=self.source_to_detector_distance,
+            source_to_isocenter_vertical_distance=self.source_to_isocenter_distance,
+            sensor_height=self.sensor_size,
+            sensor_width=self.sensor_size,
+            pixel_size=self.pixel_size,
+            min_alpha=MIN_ANGLE,
+            max_alpha=MAX_ANGLE,
+            min_beta=MIN_ANGLE,
+            max_beta=MAX_ANGLE,
+        )
+
+    def frames(self, poses: np.ndarray) -> PoseFrames:
+        """Compute the camera frames and projections of (N, 5) poses."""
+        poses = np.asarray(poses, dtype=np.float64).reshape(-1, 5)
+        rotations = _rotations(poses)
+        isocenters = pose_isocenters(poses)
+
+        # camera3d_from_arm @ arm_from_device, where the device frame is the world
+        arm_from_world = rotations.transpose(0, 2, 1)
+        camera_rotations = _ROTATE_CAMERA_LEFT @ arm_from_world
+        camera_translations = (
+            np.array([0.0, 0.0, self.source_to_isocenter_distance])
+            - np.einsum('nij,nj->ni', arm_from_world, isocenters)
+        ) @ _ROTATE_CAMERA_LEFT.T
+        camera3d_from_world = np.zeros((len(poses), 4, 4))
+        camera3d_from_world[:, :3, :3] = camera_rotations
+        camera3d_from_world[:, :3, 3] = camera_translations
+        camera3d_from_world[:, 3, 3] = 1
+
+        # The camera frame's origin is the source, and its Z axis the principal ray
+        world_from_camera3d_rotations = camera_rotations.transpose(0, 2, 1)
+        sources = -np.einsum('nij,nj->ni', world_from_camera3d_rotations, camera_translations)
+        principal_rays = world_from_camera3d_rotations[:, :, 2]
+
+        return PoseFrames(
+            intrinsic=self.intrinsic,
+            camera3d_from_world=camera3d_from_world,
+            projections=self.intrinsic @ camera3d_from_world[:, :3, :],
+            sources=sources,
+            detector_centers=sources + self.source_to_detector_distance * principal_rays,
+        )
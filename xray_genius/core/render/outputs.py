@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
+import dataclasses
+from io import BytesIO
+import logging
+import time
+from typing import IO, TYPE_CHECKING, Self
+from uuid import uuid4
+
+from django.core.files.base import File
+from django.db import models, transaction
+
+from xray_genius.core.models import OutputImage, OutputPack, Session
+
+if TYPE_CHECKING:
+    from .archive import ArchivePart
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class StoredFrame:
+    """
+    A rendered image which has been encoded and uploaded, but not yet saved to the DB.
+
+    Packed frames are only encoded; their files are uploaded in the pack of their batch, see
+    `OutputImageWriter`.
+    """
+
+    # Empty if the image wasn't stored as a PNG, or is packed
+    image_name: str
+    thumbnail_name: str
+    carm_push_pull: float
+    carm_head_foot_translation: float
+    carm_raise_lower: float
+    carm_alpha: float
+    carm_beta: float
+    # The index of the sampled pose, which lets an interrupted run skip it when resumed
+    index: int | None = None
+    # Empty if the image wasn't stored as an NPY, or is packed
+    raw_image_name: str = ''
+    # The name and content of each file to pack, by the `OutputImage` field it's stored for.
+    # Frames of identical poses share the same dict, and so the same slices of their pack.
+    packed_files: dict[str, tuple[str, bytes]] = dataclasses.field(default_factory=dict)
+    # The content of each file to archive once the frame is saved, see `ArchivePart`
+    archive_contents: dict[str, bytes] = dataclasses.field(default_factory=dict)
+
+    @property
+    def file_names(self) -> dict[str, str]:
+        """Get the name of each stored file, by the `OutputImage` field it's stored for."""
+        names = {
+            'image': self.image_name,
+            'thumbnail': self.thumbnail_name,
+            'raw_image': self.raw_image_name,
+        }
+        return {field_name: name for field_name, name in names.items() if name}
+
+
+def store_output_file(
+    field_name: str, filename: str, content: IO[bytes], *, model: type[models.Model] = OutputImage
+) -> str:
+    """Upload a file for an `OutputImage` field, without needing a model instance."""
+    field = model._meta.get_field(field_name)
+    name = field.generate_filename(None, filename)
+    return field.storage.save(name, File(content, name=filename), max_length=field.max_length)
+
+
+def delete_stored_frames(frames: Iterable[StoredFrame]) -> None:
+    """Delete the uploaded files of frames which will never be saved to the DB."""
+    # Frames of identical poses share their files
+    for file_names in {tuple(f.file_names.items()) for f in frames}:
+        try:
+            for field_name, name in file_names:
+                OutputImage._meta.get_field(field_name).storage.delete(name)
+        except Exception:
+            logger.exception('Failed to delete files of unsaved image %s', dict(file_names))
+
+
+class OutputImageWriter:
+    """
+    Buffer stored frames and save them to the DB in batches.
+
+    A batch is written with a single INSERT once it holds ``batch_size`` frames, or once its
+    oldest frame has waited ``max_delay_seconds``, and whatever remains is written when the
+    writer is closed. A batch is written atomically, so a frame is either fully saved or still
+    buffered; buffered frames are never visible to the rest of the application, and their files
+    are deleted by `discard()` (which also happens when the writer exits with an error).
+
+    Frames may share their files (e.g. when rendered from identical poses); files which are
+    already referenced by a saved frame are never deleted by `discard()`.
+
+    The files of packed frames are concatenated into a single pack per batch, which is
+    uploaded right before the batch is written, and deleted if that fails. A batch thus costs
+    a single upload, rather than one for each file of each frame.
+
+    If given an ``archive``, each saved frame is added to it right after its batch is written.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        *,
+        batch_size: int,
+        max_delay_seconds: float,
+        archive: ArchivePart | None = None,
+    ) -> None:
+        self.session = session
+        self.archive = archive
+        self.batch_size = max(batch_size, 1)
+        self.max_delay_seconds = max_delay_seconds
+        self.created = 0
+        self._buffer: list[StoredFrame] = []
+        self._buffered_since = 0.0
+        # Every frame has a thumbnail, so it identifies the (possibly shared) files of a frame
+        self._saved_thumbnail_names: set[str] = set()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+    def add(self, frame: StoredFrame) -> None:
+        self.extend([frame])
+
+    def extend(self, frames: Iterable[StoredFrame]) -> None:
+        if not self._buffer:
+            self._buffered_since = time.monotonic()
+        self._buffer.extend(frames)
+        if (
+            len(self._buffer) >= self.batch_size
+            or time.monotonic() - self._buffered_since >= self.max_delay_seconds
+        ):
+            self.flush()
+
+    def _store_pack(self) -> tuple[str, dict[int, dict]]:
+        """
+        Upload the files of the buffered packed frames, concatenated into a single pack.
+
+        Returns the name of the stored pack (empty if no frame is packed), and the slices of
+        each frame's files, by the id of their `StoredFrame.packed_files`.
+        """
+        content = BytesIO()
+        slices: dict[int, dict] = {}
+        for frame in self._buffer:
+            if not frame.packed_files or id(frame.packed_files) in slices:
+                continue
+            frame_slices = slices[id(frame.packed_files)] = {}
+            for field_name, (name, data) in frame.packed_files.items():
+                frame_slices[field_name] = {
+                    'name': name,
+                    'offset': content.tell(),
+                    'length': len(data),
+                }
+                content.write(data)
+        if not slices:
+            return '', slices
+        content.seek(0)
+        return store_output_file('file', f'{uuid4()}.pack', content, model=OutputPack), slices
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        try:
+            pack_name, slices = self._store_pack()
+        except Exception:
+            self.discard()
+            raise
+        try:
+            with transaction.atomic():
+                pack = (
+                    OutputPack.objects.create(session=self.session, file=pack_name)
+                    if pack_name
+                    else None
+                )
+                output_images = self._bulk_create(
+                    [
+                        OutputImage(
+                            session=self.session,
+                            index=frame.index,
+                            image=frame.image_name,
+                            thumbnail=frame.thumbnail_name,
+                            raw_image=frame.raw_image_name,
+                            pack=pack if frame.packed_files else None,
+                            pack_slices=slices.get(id(frame.packed_files), {}),
+                            carm_push_pull=frame.carm_push_pull,
+                            carm_head_foot_translation=frame.carm_head_foot_translation,
+                            carm_raise_lower=frame.carm_raise_lower,
+                            carm_alpha=frame.carm_alpha,
+                            carm_beta=frame.carm_beta,
+                        )
+                        for frame in self._buffer
+                    ]
+                )
+        except Exception:
+            if pack_name:
+                OutputPack._meta.get_field('file').storage.delete(pack_name)
+            self.discard()
+            raise
+        frames, self._buffer = self._buffer, []
+        # Only once the frames are no longer buffered, so they're never discarded after this
+        self._saved_thumbnail_names.update(
+            frame.thumbnail_name
+            for frame, output_image in zip(frames, output_images, strict=True)
+            if output_image is not None
+        )
+        duplicates = [
+            frame
+            for frame, output_image in zip(frames, output_images, strict=True)
+            if output_image is None
+        ]
+        if duplicates:
+            logger.warning(
+                'Dropped %d images of session %s, which were saved by another task',
+                len(duplicates),
+                self.session.pk,
+            )
+            delete_stored_frames(
+                frame
+                for frame in duplicates
+                if frame.thumbnail_name not in self._saved_thumbnail_names
+            )
+        self.created += len(frames) - len(duplicates)
+        if self.archive is not None:
+            for output_image, frame in zip(output_images, frames, strict=True):
+                if output_image is not None:
+                    self.archive.add(output_image, frame.archive_contents)
+
+    def _bulk_create(self, output_images: list[OutputImage]) -> list[OutputImage | None]:
+        """
+        Save output images, returning each of them, or None if its sample was already saved.
+
+        A redelivered copy of a shard's task may be saving the same samples at the same time
+        (see `ShardClaim`), in which case whichever saves a sample first keeps it.
+        """
+        OutputImage.objects.bulk_create(
+            [output_image for output_image in output_images if output_image.index is None]
+        )
+        indexed = [output_image for output_image in output_images if output_image.index is not None]
+        if not indexed:
+            return output_images
+        # Rows which conflict aren't inserted, and the others don't get their pk set
+        OutputImage.objects.bulk_create(indexed, ignore_conflicts=True)
+        saved = {
+            output_image.index: output_image
+            for output_image in OutputImage.objects.filter(
+                session=self.session, index__in=[output_image.index for output_image in indexed]
+            )
+        }
+        created: list[OutputImage | None] = []
+        for output_image in output_images:
+            if output_image.index is not None:
+                saved_image = saved[output_image.index]
+                # Files are never shared between tasks, and a pack only holds its own batch
+                ours = (
+                    saved_image.thumbnail.name == output_image.thumbnail.name
+                    and saved_image.pack_id == output_image.pack_id
+                )
+                output_image = saved_image if ours else None  # noqa: PLW2901
+            created.append(output_image)
+        return created
+
+    def discard(self) -> None:
+        """Drop all buffered frames, deleting their uploaded files."""
+        delete_stored_frames(
+            frame
+            for frame in self._buffer
+            if frame.thumbnail_name not in self._saved_thumbnail_names
+        )
+        self._buffer.clear()
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+from typing import Self
+
+logger = logging.getLogger(__name__)
+
+
+class RenderPipeline[T]:
+    """
+    Overlap frame production with a bounded pool of encode/upload workers.
+
+    The producing thread (i.e. the one driving the projector) submits work for each frame,
+    which is then executed by a pool of ``max_workers`` threads. At most ``max_pending``
+    frames may be in flight at once; when that limit is reached, ``submit`` blocks until the
+    oldest frame has finished, which applies backpressure to the producer so that memory use
+    stays bounded no matter how slow the downstream stages are.
+
+    Finished frames are handed to ``on_result`` in submission order, on the producing thread,
+    so that anything which touches the database stays single-threaded and deterministic.
+
+    If a worker raises, the exception is re-raised from the next call into the pipeline on the
+    producing thread. Frames that were finished but never handed over (because of an error
+    or an ``abort()``) are passed to ``on_discard`` so their side effects can be undone.
+    """
+
+    def __init__(
+        self,
+        on_result: Callable[[T], None],
+        *,
+        max_workers: int,
+        max_pending: int | None = None,
+        on_discard: Callable[[T], None] | None = None,
+    ) -> None:
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        self._on_result = on_result
+        self._on_discard = on_discard
+        self._max_pending = max(max_pending or 2 * max_workers, 1)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='render-pipeline'
+        )
+        self._pending: deque[Future[T]] = deque()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self.join()
+        finally:
+            self.abort()
+            self._executor.shutdown(wait=True)
+
+    def submit[**P](self, fn: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> None:
+        """Queue a frame for processing, blocking while too many frames are in flight."""
+        self._raise_for_failures()
+        while len(self._pending) >= self._max_pending:
+            self._complete_oldest()
+        self._pending.append(self._executor.submit(fn, *args, **kwargs))
+        self.collect()
+
+    def collect(self) -> None:
+        """Hand over every frame at the head of the queue which has already finished."""
+        while self._pending and self._pending[0].done():
+            self._complete_oldest()
+        self._raise_for_failures()
+
+    def join(self) -> None:
+        """Block until every submitted frame has been handed over."""
+        while self._pending:
+            self._complete_oldest()
+
+    def abort(self) -> None:
+        """Stop processing, discarding any frames which have not been handed over yet."""
+        while self._pending:
+            future = self._pending.popleft()
+            # Frames which have not started yet never run; running ones must be waited on,
+            # as their side effects can only be undone once they are complete.
+            # A failed frame has nothing to undo, and its error is either already being
+            # propagated or irrelevant after an abort.
+            if future.cancel() or future.exception() is not None:
+                continue
+            if self._on_discard is not None:
+                try:
+                    self._on_discard(future.result())
+                except Exception:
+                    logger.exception('Failed to discard an aborted frame')
+
+    @property
+    def pending(self) -> int:
+        """The number of frames which have been submitted but not handed over yet."""
+        return len(self._pending)
+
+    def _complete_oldest(self) -> None:
+        future = self._pending.popleft()
+        self._on_result(future.result())
+
+    def _raise_for_failures(self) -> None:
+        # Fail fast: don't wait for a failed frame to reach the head of the queue
+        for future in self._pending:
+            if future.done() and not future.cancelled() and future.exception() is not None:
+                raise future.exception()  # type: ignore[misc]
@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+import numpy as np
+
+# Poses are in mm and degrees, so anything closer than this is indistinguishable once rendered
+POSE_DECIMALS = 6
+
+
+def group_identical_poses(poses: np.ndarray, decimals: int = POSE_DECIMALS) -> list[list[int]]:
+    """
+    Group the indices of poses which are numerically equal.
+
+    Poses are compared after rounding to ``decimals`` decimal places. Groups are ordered by
+    their first index, so rendering one pose of each group keeps the original order.
+    """
+    groups: dict[tuple[float, ...], list[int]] = {}
+    for index, pose in enumerate(np.round(np.asarray(poses, dtype=np.float64), decimals)):
+        groups.setdefault(tuple(pose.tolist()), []).append(index)
+    return list(groups.values())
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from typing import Self
+
+import numpy as np
+
+from xray_genius.core.models import Session
+
+from .geometry import CArmGeometry
+from .projectors import acquire_projector, get_projector_pool
+
+
+class PreviewRenderer:
+    """
+    Render single poses of sessions at interactive rates.
+
+    Projectors are kept in the worker's pool, with their volume on the GPU, so that further
+    previews of the same input file and geometry are rendered right away. They're freed once
+    they've been idle for ``idle_timeout`` seconds, see `evict_idle`.
+
+    Projectors belong to the thread which created them, so every method must be called from
+    the same thread.
+    """
+
+    def __init__(self, *, sensor_size: int, idle_timeout: float) -> None:
+        self.pool = get_projector_pool()
+        self.sensor_size = sensor_size
+        self.idle_timeout = idle_timeout
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.pool.close()
+
+    def render(self, session: Session, pose: np.ndarray) -> np.ndarray:
+        """Render a (5,) pose of a session, with the volume of its input file."""
+        geometry = CArmGeometry.from_parameters(session.parameters, sensor_size=self.sensor_size)
+        with acquire_projector(session.input_scan, geometry) as pooled:
+            [camera3d_from_world] = geometry.frames(pose).camera3d_from_world
+            return pooled.render(camera3d_from_world)
+
+    def seconds_until_idle(self) -> float | None:
+        """Get how long until a projector is freed for being unused, if there are any."""
+        return self.pool.seconds_until_idle(self.idle_timeout)
+
+    def evict_idle(self) -> None:
+        """Free the projectors which have been idle for longer than the timeout."""
+        self.pool.evict_idle(self.idle_timeout)
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+import contextlib
+import dataclasses
+import functools
+import logging
+import time
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+import numpy as np
+
+from .backends import ProjectorBackend, create_backend
+from .geometry import CArmGeometry
+from .volumes import file_fingerprint, load_ct_volume, place_supine
+
+if TYPE_CHECKING:
+    from deepdrr import Volume
+
+    from xray_genius.core.models import CTInputFile
+
+logger = logging.getLogger(__name__)
+
+_FLOAT32_BYTES = 4
+
+
+@dataclasses.dataclass(frozen=True)
+class ProjectorKey:
+    # Identifies the content of the volume, see `file_fingerprint`
+    volume: str
+    geometry: CArmGeometry
+
+
+def estimate_projector_bytes(volume: Volume, geometry: CArmGeometry) -> int:
+    """
+    Estimate the memory an initialized projector of a volume holds (on the device, for CUDA).
+
+    The volume and each of its material segmentations are uploaded as float32 arrays, and the
+    detector needs a float32 image per material, along with a few of its own.
+    """
+    materials = len(volume.materials)
+    return _FLOAT32_BYTES * (
+        volume.data.size * (1 + materials) + geometry.sensor_size**2 * (3 + materials)
+    )
+
+
+@dataclasses.dataclass(eq=False)
+class PooledProjector:
+    """An initialized projector backend, with the (world-placed) volume it renders."""
+
+    key: ProjectorKey
+    volume: Volume
+    backend: ProjectorBackend
+    nbytes: int
+    last_used: float = dataclasses.field(default_factory=time.monotonic)
+    # Set once a render fails, after which the state of the device memory is unknown
+    failed: bool = False
+
+    def render(self, camera3d_from_world: np.ndarray) -> np.ndarray:
+        """Render the volume from a camera frame, e.g. one of `CArmGeometry.frames`."""
+        self.last_used = time.monotonic()
+        try:
+            return self.backend.render(camera3d_from_world)
+        except Exception:
+            self.failed = True
+            raise
+
+    def free(self) -> None:
+        self.backend.free()
+
+
+@dataclasses.dataclass
+class ProjectorPoolStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class ProjectorPool:
+    """
+    Keep initialized projectors between renders, up to ``max_bytes`` of memory in total.
+
+    Initializing a projector prepares its volume (e.g. uploads it to the GPU), which is then
+    skipped for later renders of the same volume with the same C-arm geometry (e.g.
+    back-to-back sessions of a sample dataset). The least recently used projectors are freed
+    to make room for new ones. A projector larger than ``max_bytes`` on its own (always, with a
+    ``max_bytes`` of 0) is freed as soon as it's released.
+
+    Projectors are created with the named ``backend``, see `PROJECTOR_BACKENDS`.
+
+    Projectors belong to the thread which created them, so a pool must only be used by one.
+    """
+
+    def __init__(self, max_bytes: int, backend: str = 'cuda') -> None:
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self._projectors: OrderedDict[ProjectorKey, PooledProjector] = OrderedDict()
+        self._stats = ProjectorPoolStats()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(pooled.nbytes for pooled in self._projectors.values())
+
+    def stats(self) -> ProjectorPoolStats:
+        return dataclasses.replace(self._stats)
+
+    def _evict(self, key: ProjectorKey) -> None:
+        self._projectors.pop(key).free()
+        self._stats.evictions += 1
+
+    def _initialize(self, key: ProjectorKey, load: Callable[[], Volume]) -> PooledProjector:
+        volume = load()
+        nbytes = estimate_projector_bytes(volume, key.geometry)
+        # Make room before allocating, so the device never holds more than the limit
+        while self._projectors and self.nbytes + nbytes > self.max_bytes:
+            self._evict(next(iter(self._projectors)))
+
+        backend = create_backend(self.backend, volume, key.geometry)
+        backend.initialize()
+        return PooledProjector(key, volume, backend, nbytes)
+
+    @contextlib.contextmanager
+    def acquire(self, key: ProjectorKey, load: Callable[[], Volume]) -> Iterator[PooledProjector]:
+        """
+        Get an initialized projector for a key, calling ``load`` for its volume if there's none.
+
+        Once released, the projector is kept for later renders, unless one of its renders failed.
+        """
+        pooled = self._projectors.pop(key, None)
+        if pooled is None:
+            self._stats.misses += 1
+            pooled = self._initialize(key, load)
+        else:
+            self._stats.hits += 1
+
+        try:
+            yield pooled
+        finally:
+            pooled.last_used = time.monotonic()
+            if pooled.nbytes <= self.max_bytes and not pooled.failed:
+                self._projectors[key] = pooled
+            else:
+                pooled.free()
+
+    def seconds_until_idle(self, timeout: float) -> float | None:
+        """Get how long until the least recently used projector is idle for ``timeout``."""
+        if not self._projectors:
+            return None
+        oldest = min(pooled.last_used for pooled in self._projectors.values())
+        return max(oldest + timeout - time.monotonic(), 0)
+
+    def evict_idle(self, timeout: float) -> None:
+        """Free the projectors which haven't been used for ``timeout`` seconds."""
+        now = time.monotonic()
+        for key, pooled in list(self._projectors.items()):
+            if now - pooled.last_used >= timeout:
+                logger.info('Freeing the idle projector of volume %s', key.volume)
+                self._evict(key)
+
+    def close(self) -> None:
+        while self._projectors:
+            self._evict(next(iter(self._projectors)))
+
+
+@functools.cache
+def get_projector_pool() -> ProjectorPool:
+    """Get the projector pool of this worker process."""
+    return ProjectorPool(
+        settings.PROJECTOR_POOL_MAX_BYTES, backend=settings.RENDER_PROJECTOR_BACKEND
+    )
+
+
+def acquire_projector(
+    ct_input_file: CTInputFile, geometry: CArmGeometry
+) -> contextlib.AbstractContextManager[PooledProjector]:
+    """
+    Get an initialized projector of an input file's volume, from the worker's projector pool.
+
+    The volume is placed at the center of the world, face up (see `place_supine`).
+    """
+
+    def load() -> Volume:
+        volume = load_ct_volume(ct_input_file)
+        place_supine(volume)
+        return volume
+
+    # Every session started from a sample dataset has its own input file, but they all share
+    # the same file, so they can share the same projector as well
+    source = ct_input_file.render_artifact or ct_input_file.file
+    return get_projector_pool().acquire(ProjectorKey(file_fingerprint(source), geometry), load)
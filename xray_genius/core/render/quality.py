@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import dataclasses
+
+import numpy as np
+
+# Rendered images are scaled to [0, 1] with air at 0, so pixels at or below this are background
+BACKGROUND_LEVEL = 0.02
+# Statistics are computed on every n-th pixel along each axis, e.g. 192x192 of 1536x1536
+_STRIDE = 8
+_ENTROPY_BINS = 64
+
+
+@dataclasses.dataclass(frozen=True)
+class FrameStatistics:
+    # The fraction of pixels which aren't background
+    foreground_fraction: float
+    # The spread between the 1st and 99th percentiles of the pixel values
+    dynamic_range: float
+    # The Shannon entropy of the pixel values' histogram, in bits
+    entropy: float
+
+
+def frame_statistics(image: np.ndarray) -> FrameStatistics:
+    """Compute cheap statistics of how much information a rendered image holds."""
+    sample = np.asarray(image[::_STRIDE, ::_STRIDE], dtype=np.float32)
+    if not sample.size:
+        return FrameStatistics(foreground_fraction=0, dynamic_range=0, entropy=0)
+
+    low, high = np.percentile(sample, [1, 99])
+    counts = np.bincount(
+        np.clip(sample * _ENTROPY_BINS, 0, _ENTROPY_BINS - 1).astype(np.intp).ravel(),
+        minlength=_ENTROPY_BINS,
+    )
+    probabilities = counts[counts > 0] / sample.size
+    return FrameStatistics(
+        foreground_fraction=float((sample > BACKGROUND_LEVEL).mean()),
+        dynamic_range=float(high - low),
+        entropy=float(-(probabilities * np.log2(probabilities)).sum()),
+    )
+
+
+@dataclasses.dataclass(frozen=True)
+class FrameQualityThresholds:
+    """The least information a rendered image must hold to be kept; 0 disables a threshold."""
+
+    min_foreground_fraction: float = 0
+    min_dynamic_range: float = 0
+    min_entropy: float = 0
+
+    @property
+    def enabled(self) -> bool:
+        return any(dataclasses.astuple(self))
+
+    def is_low_information(self, statistics: FrameStatistics) -> bool:
+        return (
+            statistics.foreground_fraction < self.min_foreground_fraction
+            or statistics.dynamic_range < self.min_dynamic_range
+            or statistics.entropy < self.min_entropy
+        )
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import itertools
+
+import numpy as np
+
+# Rays are marched in chunks of about this many samples at once, which bounds the memory of a
+# render, e.g. about 12MB per material for each corner of the trilinear interpolation
+_CHUNK_SAMPLES = 2**20
+# Added to intensities before the negative log transform, as deepdrr's `neglog` does
+_NEGLOG_EPSILON = 0.01
+# Rays parallel to an axis of the voxel grid are nudged off it, to clip them to its faces
+_MIN_DIRECTION = 1e-12
+
+
+def material_densities(density: np.ndarray, segmentations: list[np.ndarray]) -> np.ndarray:
+    """
+    Stack the density of each material of an (I, J, K) volume, as (I + 2, J + 2, K + 2, M).
+
+    The volume is padded with a voxel of zeros on each side, so that samples near its edges
+    fade out to empty space, as a texture lookup with a zero border would.
+    """
+    densities = np.zeros(
+        (*(size + 2 for size in density.shape), len(segmentations)), dtype=np.float32
+    )
+    for m, segmentation in enumerate(segmentations):
+        densities[1:-1, 1:-1, 1:-1, m] = density * segmentation
+    return densities
+
+
+def detector_rays(
+    intrinsic: np.ndarray, camera3d_from_world: np.ndarray, sensor_size: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the world-space source and the (H * W, 3) unit directions of the rays to each pixel.
+
+    Rays are cast through the center of each pixel, in row-major order of the image.
+    """
+    world_from_camera3d = np.linalg.inv(camera3d_from_world)
+    v, u = np.mgrid[:sensor_size, :sensor_size] + 0.5
+    pixels = np.column_stack([u.ravel(), v.ravel(), np.ones(u.size)])
+    directions = pixels @ np.linalg.inv(intrinsic).T @ world_from_camera3d[:3, :3].T
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    return world_from_camera3d[:3, 3], directions
+
+
+def _interpolate(densities: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Trilinearly interpolate padded material densities at (..., 3) unpadded voxel indices."""
+    *shape, materials = densities.shape
+    flat = densities.reshape(-1, materials)
+    # Voxel centers are at integer indices, and the padding shifts them all by one
+    padded = points + 1
+    lower = np.clip(np.floor(padded), 0, np.array(shape) - 2).astype(np.intp)
+    fractions = (padded - lower).astype(np.float32)
+    strides = np.array([shape[1] * shape[2], shape[2], 1])
+
+    base = lower @ strides
+    samples = np.zeros((*points.shape[:-1], materials), dtype=np.float32)
+    for corner in itertools.product((0, 1), repeat=3):
+        weights = np.prod(np.where(corner, fractions, 1 - fractions), axis=-1)
+        samples += weights[..., np.newaxis] * flat[base + np.dot(corner, strides)]
+    return samples
+
+
+def trace_area_densities(
+    densities: np.ndarray,
+    ijk_from_world: np.ndarray,
+    source: np.ndarray,
+    directions: np.ndarray,
+    step: float,
+) -> np.ndarray:
+    """
+    Integrate the density of each material along (N, 3) rays, in g/cm^2, as (N, M).
+
+    Each ray is marched from where it enters the volume's voxel grid to where it leaves it,
+    every ``step`` (in world units, i.e. mm), sampling the (padded, see `material_densities`)
+    densities with trilinear interpolation. As deepdrr's kernel does, the first and last
+    samples are given half the weight of the others. All the rays are marched together, a
+    chunk of steps at a time.
+    """
+    shape = np.array(densities.shape[:3]) - 2
+    source_ijk = ijk_from_world[:3, :3] @ source + ijk_from_world[:3, 3]
+    # The length of each ray's steps along each axis of the voxel grid, per world unit
+    directions_ijk = directions @ ijk_from_world[:3, :3].T
+    safe_directions = np.where(
+        np.abs(directions_ijk) < _MIN_DIRECTION, _MIN_DIRECTION, directions_ijk
+    )
+
+    # Clip the rays to the slabs between the grid's faces, on each axis
+    to_lower = (-0.5 - source_ijk) / safe_directions
+    to_upper = (shape - 0.5 - source_ijk) / safe_directions
+    entry = np.maximum(np.minimum(to_lower, to_upper).max(axis=1), 0)
+    exit_ = np.maximum(to_lower, to_upper).min(axis=1)
+    num_steps = np.where(exit_ > entry, np.ceil((exit_ - entry) / step), 0).astype(np.intp)
+
+    area_densities = np.zeros((len(directions), densities.shape[3]), dtype=np.float32)
+    chunk = max(_CHUNK_SAMPLES // max(np.count_nonzero(num_steps), 1), 1)
+    for start in range(0, num_steps.max(initial=0), chunk):
+        rays = np.flatnonzero(num_steps > start)
+        steps = np.arange(start, min(start + chunk, num_steps[rays].max()))
+        alphas = entry[rays, np.newaxis] + steps * step
+        points = source_ijk + alphas[:, :, np.newaxis] * directions_ijk[rays, np.newaxis, :]
+
+        remaining = num_steps[rays, np.newaxis]
+        weights = np.where(steps < remaining, 1.0, 0.0)
+        weights[(steps == 0) | (steps == remaining - 1)] *= 0.5
+        area_densities[rays] += np.einsum(
+            'rs,rsm->rm', weights.astype(np.float32), _interpolate(densities, points)
+        )
+
+    # Densities are in g/cm^3, and steps in mm
+    return area_densities * (step / 10)
+
+
+def attenuate(
+    area_densities: np.ndarray,
+    energies: np.ndarray,
+    pdf: np.ndarray,
+    coefficients: np.ndarray,
+) -> np.ndarray:
+    """
+    Get the intensity reaching the detector through (..., M) area densities, in keV per photon.
+
+    ``coefficients`` holds the mass attenuation coefficient of each material, in cm^2/g, at each
+    of the spectrum's ``energies`` (in keV), as (B, M); ``pdf`` is the spectrum's distribution.
+    """
+    return np.exp(-area_densities @ np.asarray(coefficients).T) @ (energies * pdf)
+
+
+def neglog(intensity: np.ndarray) -> np.ndarray:
+    """
+    Take the negative log transform of an intensity image, scaled to [0, 1].
+
+    Like deepdrr's transform, empty space maps to 0, and a constant image to all zeros.
+    """
+    image = -np.log(intensity + intensity.min() + _NEGLOG_EPSILON)
+    low, high = image.min(), image.max()
+    if high == low:
+        return np.zeros_like(image, dtype=np.float32)
+    return ((image - low) / (high - low)).astype(np.float32)
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
+import dataclasses
+from io import BytesIO
+import json
+from pathlib import Path
+import tarfile
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from xray_genius.core.models import OutputImage
+
+# The files of each output image which are exported, besides its pose
+_SAMPLE_FIELDS = ('image', 'raw_image')
+_POSE_FIELDS = (
+    'carm_push_pull',
+    'carm_head_foot_translation',
+    'carm_raise_lower',
+    'carm_alpha',
+    'carm_beta',
+)
+
+
+@dataclasses.dataclass
+class ShardSample:
+    """The files of one sample of a shard, by their extension, all named after its key."""
+
+    key: str
+    files: dict[str, bytes]
+
+
+def output_image_sample(output_image: OutputImage) -> ShardSample:
+    """
+    Read an output image's files into a sample, along with a JSON of its pose.
+
+    The key of the sample is unique across sessions, and has no dots, since WebDataset splits
+    the names of a sample's files at the first one.
+    """
+    files = {}
+    for field_name in _SAMPLE_FIELDS:
+        if output_image.has_file(field_name):
+            _, _, extension = output_image.file_name(field_name).partition('.')
+            files[extension] = output_image.read_file(field_name)
+    files['json'] = json.dumps(
+        {
+            'session': str(output_image.session_id),
+            'index': output_image.index,
+            **{field: getattr(output_image, field) for field in _POSE_FIELDS},
+        }
+    ).encode()
+    return ShardSample(key=f'{output_image.session_id}_{output_image.pk}', files=files)
+
+
+def write_tar_shard(path: Path, samples: Iterable[ShardSample]) -> int:
+    """
+    Write samples into an uncompressed tar, in order, and return how many there were.
+
+    The files of each sample are adjacent, so the shard can be read in a single sequential pass
+    (e.g. by `webdataset.WebDataset`). Entries have no timestamps or owners, so a shard's
+    content only depends on its samples.
+    """
+    count = 0
+    with tarfile.open(path, 'w', format=tarfile.USTAR_FORMAT) as tar:
+        for sample in samples:
+            for extension, content in sample.files.items():
+                info = tarfile.TarInfo(f'{sample.key}.{extension}')
+                info.size = len(content)
+                info.mode = 0o444
+                tar.addfile(info, BytesIO(content))
+            count += 1
+    return count
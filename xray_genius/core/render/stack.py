@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+from collections.abc import Iterable, Mapping
+from io import BytesIO
+from pathlib import Path
+import shutil
+from tempfile import TemporaryFile
+from typing import IO, Self
+from uuid import uuid4
+
+import numpy as np
+
+from xray_genius.core.models import OutputImage, Session
+
+from .encoding import quantize
+from .outputs import store_output_file
+
+# The columns of the pose table, in the order of the `OutputImage` fields they come from
+POSE_COLUMNS = (
+    'index',
+    'carm_push_pull',
+    'carm_head_foot_translation',
+    'carm_raise_lower',
+    'carm_alpha',
+    'carm_beta',
+)
+# The zstd magic number, which marks a compressed NPY
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def decode_raw_image(data: bytes) -> np.ndarray:
+    """Decode a stored raw image, an NPY which may be Zstandard-compressed."""
+    if data.startswith(_ZSTD_MAGIC):
+        # Imported here, since this is only installed on workers
+        import zstandard
+
+        data = zstandard.ZstdDecompressor().decompress(data)
+    return np.load(BytesIO(data), allow_pickle=False)
+
+
+def decode_png_image(data: bytes) -> np.ndarray:
+    """Decode a stored 16-bit PNG image, without losing its bit-depth."""
+    # Imported here, since this is only installed on workers
+    import png as pypng
+
+    _, _, rows, _ = pypng.Reader(bytes=data).read()
+    return np.vstack([np.asarray(row, dtype=np.uint16) for row in rows])
+
+
+def read_image(output_image: OutputImage) -> np.ndarray:
+    """Read the pixels of an output image, from its raw image if it has one."""
+    if output_image.has_file('raw_image'):
+        return decode_raw_image(output_image.read_file('raw_image'))
+    return decode_png_image(output_image.read_file('image'))
+
+
+def write_stack(
+    path: Path, images: Iterable[np.ndarray], shape: tuple[int, int, int], dtype: np.dtype
+) -> None:
+    """
+    Write images into a single (N, H, W) NPY, one at a time.
+
+    The array is memory-mapped while it's written, so only one image is held in memory at once.
+    Its header is padded so that the data is aligned, which lets it be memory-mapped when read,
+    e.g. with `np.load(path, mmap_mode='r')`.
+    """
+    stack = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    count = 0
+    for image in images:
+        if count == shape[0]:
+            raise ValueError(f'Expected {shape[0]} images, got more')
+        stack[count] = image
+        count += 1
+    if count != shape[0]:
+        raise ValueError(f'Expected {shape[0]} images, got {count}')
+    stack.flush()
+
+
+def output_image_pose(output_image: OutputImage) -> dict[str, float | int | None]:
+    """Get the row of an output image in the pose table."""
+    return {column: getattr(output_image, column) for column in POSE_COLUMNS}
+
+
+def write_pose_table(file: IO[bytes], poses: Iterable[Mapping[str, float | int | None]]) -> None:
+    """
+    Write poses as an NPZ, with an array for each of `POSE_COLUMNS`.
+
+    Rows are in the order of ``poses``, and poses without a sampled pose index have an index
+    of -1.
+    """
+    rows = [
+        tuple(
+            -1 if column == 'index' and pose[column] is None else pose[column]
+            for column in POSE_COLUMNS
+        )
+        for pose in poses
+    ]
+    columns = zip(*rows, strict=True) if rows else [()] * len(POSE_COLUMNS)
+    np.savez(
+        file,
+        **{
+            column: np.asarray(values, dtype=np.int64 if column == 'index' else np.float64)
+            for column, values in zip(POSE_COLUMNS, columns, strict=True)
+        },
+    )
+
+
+class StackPart:
+    """
+    The images of one shard stacked as they're rendered, with a table of their poses.
+
+    Each image is added once for each of the (identical) poses it was rendered for, as each of
+    them is a row of the session's stack. Rows are spooled to a temporary file until the part
+    is stored, so that the session's stack can be put together from the parts of its shards,
+    rather than by reading every image back from storage, see `merge_stack_parts`.
+    """
+
+    def __init__(self, dtype: np.dtype) -> None:
+        self.dtype = np.dtype(dtype)
+        self._file = TemporaryFile()  # noqa: SIM115
+        self._image_shape: tuple[int, ...] = ()
+        self._poses: list[Mapping[str, float | int | None]] = []
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @property
+    def count(self) -> int:
+        return len(self._poses)
+
+    def add(self, image: np.ndarray, poses: list[Mapping[str, float | int | None]]) -> None:
+        """Add a rendered image, as it would be read back from its stored files."""
+        # PNGs hold the quantized image
+        data = np.ascontiguousarray(
+            image if self.dtype == np.float32 else quantize(image)[0], dtype=self.dtype
+        )
+        self._image_shape = data.shape
+        for pose in poses:
+            self._file.write(data.data)
+            self._poses.append(pose)
+
+    def store(self) -> tuple[str, str]:
+        """Upload the stack (as an NPY) and its pose table, returning their names."""
+        self._file.seek(0)
+        with TemporaryFile() as stack, TemporaryFile() as poses:
+            np.lib.format.write_array_header_1_0(
+                stack,
+                {
+                    'descr': np.lib.format.dtype_to_descr(self.dtype),
+                    'fortran_order': False,
+                    'shape': (self.count, *self._image_shape),
+                },
+            )
+            shutil.copyfileobj(self._file, stack)
+            stack.seek(0)
+            write_pose_table(poses, self._poses)
+            poses.seek(0)
+            return (
+                store_output_file('output_images_stack', f'{uuid4()}.npy', stack, model=Session),
+                store_output_file('output_images_poses', f'{uuid4()}.npz', poses, model=Session),
+            )
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def merge_stack_parts(
+    parts: Iterable[tuple[Path, Path]], stack_path: Path, poses_path: Path
+) -> None:
+    """
+    Merge the (stack, pose table) files of `StackPart`s into those of a session.
+
+    Rows are sorted by the index of their sampled pose, as they'd be with `write_stack`. The
+    parts are memory-mapped, and the merged stack written one row at a time.
+    """
+    stacks = [np.load(stack, mmap_mode='r') for stack, _ in parts]
+    tables = []
+    for _, poses in parts:
+        with np.load(poses) as table:
+            tables.append({column: table[column] for column in POSE_COLUMNS})
+    merged = {
+        column: np.concatenate([table[column] for table in tables]) for column in POSE_COLUMNS
+    }
+    order = np.argsort(merged['index'], kind='stable')
+
+    [first, *_] = stacks
+    stack = np.lib.format.open_memmap(
+        stack_path,
+        mode='w+',
+        dtype=first.dtype,
+        shape=(len(order), *first.shape[1:]),
+    )
+    # The row of the merged stack of each row of the parts, in order
+    positions = iter(np.argsort(order, kind='stable'))
+    for part in stacks:
+        for row in part:
+            stack[next(positions)] = row
+    stack.flush()
+    with poses_path.open('wb') as f:
+        np.savez(f, **{column: values[order] for column, values in merged.items()})
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+import dataclasses
+import fcntl
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+
+logger = logging.getLogger(__name__)
+
+# Written last when an entry is built, so an entry without it is incomplete
+_MANIFEST = 'entry.json'
+
+
+@contextmanager
+def _flock(path: Path, *, shared: bool = False, blocking: bool = True) -> Iterator[bool]:
+    """Hold an advisory lock on a file, which is shared by every process on the machine."""
+    flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+    with path.open('a') as f:
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _directory_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+
+@dataclasses.dataclass
+class VolumeCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class VolumeCache:
+    """
+    An on-disk cache of input volumes, shared by every worker process on a machine.
+
+    Each entry is a directory, which is built at most once (by whichever process first needs
+    it) through a ``build`` callback, and is then reused by every later session with the same
+    key. Entries are evicted in least recently used order, once the cache outgrows
+    ``max_bytes``; entries which are in use by any process are never evicted.
+
+    Concurrent access is coordinated through ``flock``: entries are built while holding an
+    exclusive lock on them, and used while holding a shared one.
+    """
+
+    def __init__(self, root: Path, max_bytes: int) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._entries = self.root / 'entries'
+        self._locks = self.root / 'locks'
+        self._staging = self.root / 'staging'
+        for path in (self._entries, self._locks, self._staging):
+            path.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def open(self, key: str, build: Callable[[Path], None]) -> Iterator[Path]:
+        """
+        Yield the directory of a cache entry, building it first if it doesn't exist yet.
+
+        ``build`` is called with an empty directory, which it must populate. The yielded
+        directory must not be modified, and must not be used after the context exits.
+        """
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        entry = self._entries / digest
+        lock = self._locks / f'{digest}.lock'
+        built = False
+        while True:
+            with _flock(lock, shared=True):
+                if (entry / _MANIFEST).exists():
+                    if not built:
+                        self._record(hits=1)
+                        logger.info('Volume cache hit for %s', key)
+                    # The manifest's mtime tracks the last use of the entry, for LRU eviction
+                    os.utime(entry / _MANIFEST)
+                    yield entry
+                    return
+
+            with _flock(lock):
+                # Another process may have built the entry while the lock was released
+                if not (entry / _MANIFEST).exists():
+                    logger.info('Volume cache miss for %s', key)
+                    self._build(key, entry, build)
+                    self._record(misses=1)
+                    built = True
+            self.evict(keep=entry)
+
+    def _build(self, key: str, entry: Path, build: Callable[[Path], None]) -> None:
+        staging = self._staging / entry.name
+        # Left over from a build which crashed
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.rmtree(entry, ignore_errors=True)
+        staging.mkdir()
+        try:
+            build(staging)
+            size = _directory_size(staging)
+            (staging / _MANIFEST).write_text(json.dumps({'key': key, 'size': size}))
+            staging.rename(entry)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+    def evict(self, keep: Path | None = None) -> None:
+        """Delete the least recently used entries, until the cache fits within its budget."""
+        with _flock(self.root / 'cache.lock'):
+            entries = []
+            for manifest in self._entries.glob(f'*/{_MANIFEST}'):
+                try:
+                    stat = manifest.stat()
+                    size = json.loads(manifest.read_text())['size']
+                except (OSError, ValueError, KeyError):
+                    continue
+                entries.append((stat.st_mtime, size, manifest.parent))
+
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, entry in sorted(entries, key=lambda e: e[0]):
+                if total <= self.max_bytes:
+                    break
+                if entry == keep:
+                    continue
+                with _flock(self._locks / f'{entry.name}.lock', blocking=False) as locked:
+                    # Skip entries which are in use
+                    if not locked:
+                        continue
+                    # Remove the manifest first, so a partially deleted entry is never used
+                    (entry / _MANIFEST).unlink()
+                    shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+                evicted += 1
+                logger.info('Evicted %s from the volume cache', entry.name)
+
+        if evicted:
+            self._record(evictions=evicted)
+
+    def stats(self) -> VolumeCacheStats:
+        """Get the hit, miss and eviction counts of the cache, across all processes."""
+        with _flock(self.root / 'stats.lock', shared=True):
+            return self._read_stats()
+
+    def _read_stats(self) -> VolumeCacheStats:
+        try:
+            return VolumeCacheStats(**json.loads((self.root / 'stats.json').read_text()))
+        except (OSError, ValueError, TypeError):
+            return VolumeCacheStats()
+
+    def _record(self, *, hits: int = 0, misses: int = 0, evictions: int = 0) -> None:
+        with _flock(self.root / 'stats.lock'):
+            stats = self._read_stats()
+            stats.hits += hits
+            stats.misses += misses
+            stats.evictions += evictions
+            path = self.root / 'stats.json'
+            path.with_suffix('.tmp').write_text(json.dumps(dataclasses.asdict(stats)))
+            path.with_suffix('.tmp').replace(path)
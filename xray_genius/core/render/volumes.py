@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import functools
+import json
+import logging
+from pathlib import Path
+import tarfile
+from tempfile import TemporaryDirectory
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.db.models.fields.files import FieldFile
+import numpy as np
+
+from xray_genius.core.models import CTInputFile
+
+from .download import download_file
+from .volume_cache import VolumeCache
+
+if TYPE_CHECKING:
+    from deepdrr import Volume
+
+logger = logging.getLogger(__name__)
+
+
+@functools.cache
+def get_volume_cache() -> VolumeCache | None:
+    """Get the volume cache of this worker, or None if caching is disabled."""
+    if settings.VOLUME_CACHE_MAX_BYTES <= 0:
+        return None
+    return VolumeCache(Path(settings.VOLUME_CACHE_DIR), settings.VOLUME_CACHE_MAX_BYTES)
+
+
+def file_fingerprint(file: FieldFile) -> str:
+    """
+    Identify the current content of a stored file.
+
+    The storage key alone isn't enough, as a file could be overwritten in place; its size and
+    modification time (which change along with the object's ETag) are included as well.
+    """
+    storage = file.storage
+    return (
+        f'{file.name}:{storage.size(file.name)}:{storage.get_modified_time(file.name).isoformat()}'
+    )
+
+
+def _file_suffix(file: FieldFile) -> str:
+    return f'.{".".join(file.name.split(".")[1:]).lower()}'
+
+
+def _download(file: FieldFile, dest: Path) -> None:
+    download_file(
+        file,
+        dest,
+        chunk_size=settings.INPUT_DOWNLOAD_CHUNK_SIZE,
+        connections=settings.INPUT_DOWNLOAD_CONNECTIONS,
+    )
+
+
+def _parse_volume(path: Path) -> Volume:
+    # Imported here to avoid attempting to load CUDA on the web server
+    from deepdrr import Volume
+
+    if path.suffix == '.nrrd':
+        return Volume.from_nrrd(path)
+    if path.suffix == '.dcm':
+        return Volume.from_dicom(
+            path,
+            # TODO: remove this when the cache_dir is set correctly upstream.
+            cache_dir=path.parent / 'cache',
+        )
+    return Volume.from_nifti(path)
+
+
+def _write_volume_arrays(volume: Volume, dest: Path) -> None:
+    """Write the arrays of a parsed volume as ``.npy`` files, which can be memory-mapped."""
+    np.save(dest / 'data.npy', volume.data)
+    (dest / 'materials').mkdir()
+    for material, segmentation in volume.materials.items():
+        np.save(dest / 'materials' / f'{material}.npy', segmentation)
+    (dest / 'volume.json').write_text(
+        json.dumps(
+            {
+                'anatomical_from_ijk': volume.anatomical_from_IJK.data.tolist(),
+                'anatomical_coordinate_system': volume.anatomical_coordinate_system,
+            }
+        )
+    )
+
+
+def _read_volume_arrays(path: Path) -> Volume:
+    from deepdrr import Volume, geo
+
+    metadata = json.loads((path / 'volume.json').read_text())
+    return Volume(
+        np.load(path / 'data.npy', mmap_mode='r'),
+        {
+            material.stem: np.load(material, mmap_mode='r')
+            for material in sorted((path / 'materials').glob('*.npy'))
+        },
+        anatomical_from_IJK=geo.FrameTransform(np.array(metadata['anatomical_from_ijk'])),
+        anatomical_coordinate_system=metadata['anatomical_coordinate_system'],
+    )
+
+
+def _extract_render_artifact(artifact: FieldFile, dest: Path) -> None:
+    with artifact.open('rb'), tarfile.open(fileobj=artifact, mode='r|') as tar:
+        tar.extractall(dest, filter='data')
+
+
+def write_render_artifact(ct_input_file: CTInputFile, dest: Path) -> None:
+    """
+    Parse a CT input file, and write the render-ready volume to an (uncompressed) tar file.
+
+    Rendering from the artifact skips parsing and material segmentation entirely, as the
+    arrays it contains only need to be memory-mapped.
+    """
+    with TemporaryDirectory() as tmp:
+        raw = Path(tmp) / f'input{_file_suffix(ct_input_file.file)}'
+        _download(ct_input_file.file, raw)
+        arrays = Path(tmp) / 'arrays'
+        arrays.mkdir()
+        _write_volume_arrays(_parse_volume(raw), arrays)
+
+        with tarfile.open(dest, 'w') as tar:
+            for path in sorted(arrays.rglob('*')):
+                tar.add(path, arcname=str(path.relative_to(arrays)), recursive=False)
+
+
+def _build_cache_entry(ct_input_file: CTInputFile, entry: Path) -> None:
+    if ct_input_file.render_artifact:
+        _extract_render_artifact(ct_input_file.render_artifact, entry)
+        return
+
+    raw = entry / 'raw' / f'input{_file_suffix(ct_input_file.file)}'
+    raw.parent.mkdir()
+    _download(ct_input_file.file, raw)
+    _write_volume_arrays(_parse_volume(raw), entry)
+
+
+def place_supine(ct: Volume) -> None:
+    """
+    Place the volume at the center of the world, turned to be face up.
+
+    This aligns the patient so that, in world space,
+    the anterior side is toward +Z, inferior is toward +X,
+    and left is toward +Y.
+
+    Raises:
+        NotImplementedError: If the anatomical coordinate system is not "RAS" or "LPS".
+
+    """
+    from deepdrr import geo
+    from scipy.spatial.transform import Rotation
+
+    if ct.anatomical_coordinate_system == 'RAS':
+        ct.world_from_anatomical = geo.FrameTransform.from_rt(
+            rotation=Rotation.from_euler('xz', [90, -90], degrees=True).as_matrix().squeeze(),
+        )
+    elif ct.anatomical_coordinate_system == 'LPS':
+        ct.world_from_anatomical = geo.FrameTransform.from_rt(
+            rotation=Rotation.from_euler('xz', [-90, 90], degrees=True).as_matrix().squeeze(),
+        )
+    else:
+        raise NotImplementedError(
+            f'Cannot handle anatomical coordinate system {ct.anatomical_coordinate_system}'
+        )
+    ct.place_center(geo.p(0, 0, 0))
+
+
+def load_ct_volume(ct_input_file: CTInputFile) -> Volume:
+    """
+    Load the volume of a CT input file, through the worker's volume cache if enabled.
+
+    If the file has been preprocessed, its render artifact is used, so parsing is skipped.
+    Otherwise, both the downloaded file and the volume parsed from it are cached, so neither
+    has to be repeated for later sessions of the same file (e.g. those of sample datasets).
+    """
+    cache = get_volume_cache()
+    if cache is None:
+        with TemporaryDirectory() as tmp:
+            if ct_input_file.render_artifact:
+                _extract_render_artifact(ct_input_file.render_artifact, Path(tmp))
+                return _read_volume_arrays(Path(tmp))
+            dest = Path(tmp) / f'temp{_file_suffix(ct_input_file.file)}'
+            _download(ct_input_file.file, dest)
+            return _parse_volume(dest)
+
+    source = ct_input_file.render_artifact or ct_input_file.file
+    with cache.open(
+        file_fingerprint(source),
+        functools.partial(_build_cache_entry, ct_input_file),
+    ) as entry:
+        volume = _read_volume_arrays(entry)
+    stats = cache.stats()
+    logger.info(
+        'Volume cache: %d hits, %d misses, %d evictions', stats.hits, stats.misses, stats.evictions
+    )
+    return volume
@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.http import Http404, HttpRequest, HttpResponseBadRequest
+from django.shortcuts import get_object_or_404
+from ninja import Router, Schema
+from pydantic import Field
+from pydantic.types import UUID4
+
+from xray_genius.core.models import DatasetExport, Session
+from xray_genius.core.models.dataset_export import DEFAULT_SAMPLES_PER_SHARD
+from xray_genius.core.tasks import export_dataset_task
+
+dataset_export_router = Router()
+
+
+class DatasetExportRequestSchema(Schema):
+    sessions: list[UUID4] = Field(min_length=1)
+    samples_per_shard: int = Field(default=DEFAULT_SAMPLES_PER_SHARD, ge=1)
+
+
+class DatasetExportShardSchema(Schema):
+    index: int
+    num_samples: int
+    url: str
+
+
+class DatasetExportSchema(Schema):
+    id: int
+    status: str
+    samples_per_shard: int
+    shards: list[DatasetExportShardSchema]
+
+
+def _export_schema(export: DatasetExport) -> DatasetExportSchema:
+    return DatasetExportSchema(
+        id=export.pk,
+        status=export.status,
+        samples_per_shard=export.samples_per_shard,
+        shards=[
+            DatasetExportShardSchema(
+                index=shard.index, num_samples=shard.num_samples, url=shard.file.url
+            )
+            for shard in export.shards.order_by('index')
+        ],
+    )
+
+
+def _get_owned_export(request: HttpRequest, export_pk: int) -> DatasetExport:
+    export = get_object_or_404(DatasetExport, pk=export_pk)
+    if export.owner != request.user:
+        raise Http404
+    return export
+
+
+@dataset_export_router.post('/', response={200: DatasetExportSchema})
+def create_dataset_export(request: HttpRequest, export_data: DatasetExportRequestSchema):
+    """Export the output images of some processed sessions, as WebDataset tar shards."""
+    sessions = Session.objects.filter(
+        pk__in=export_data.sessions,
+        owner=request.user,
+        status=Session.Status.PROCESSED,
+        preview=False,
+    )
+    if sessions.count() != len(set(export_data.sessions)):
+        return HttpResponseBadRequest('Sessions must be your own, and finished processing')
+
+    with transaction.atomic():
+        export = DatasetExport.objects.create(
+            owner=request.user,
+            session_ids=[
+                str(session_id)
+                for session_id in sessions.order_by('created', 'pk').values_list('pk', flat=True)
+            ],
+            samples_per_shard=export_data.samples_per_shard,
+        )
+        transaction.on_commit(lambda: export_dataset_task.delay(export.pk))
+
+    return _export_schema(export)
+
+
+@dataset_export_router.get('/{export_pk}/', response={200: DatasetExportSchema})
+def get_dataset_export(request: HttpRequest, export_pk: int):
+    return _export_schema(_get_owned_export(request, export_pk))
+
+
+@dataset_export_router.post('/{export_pk}/resume/', response={200: DatasetExportSchema})
+def resume_dataset_export(request: HttpRequest, export_pk: int):
+    """Export the shards which a failed (or stalled) export didn't get to."""
+    with transaction.atomic():
+        export = _get_owned_export(request, export_pk)
+        export = DatasetExport.objects.select_for_update().get(pk=export.pk)
+        if not export.resumable:
+            return HttpResponseBadRequest('Only failed or stalled exports can be resumed')
+
+        export.status = DatasetExport.Status.QUEUED
+        export.save(update_fields=['status'])
+        transaction.on_commit(lambda: export_dataset_task.delay(export.pk))
+
+    return _export_schema(export)
@@ -1,10 +1,18 @@
+from django.conf import settings
 from django.db import transaction
-from django.http import Http404, HttpRequest, HttpResponseBadRequest
+from django.http import Http404, HttpRequest, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404
-from ninja import ModelSchema, Router
+from ninja import ModelSchema, Router, Schema
+from pydantic import Field
 from pydantic.types import UUID4
 
+from xray_genius.core.coordination import request_pose_preview
 from xray_genius.core.models import InputParameters, Session
+from xray_genius.core.models.input_parameters import (
+    DEFAULT_SENSOR_SIZE,
+    MAX_SENSOR_SIZE,
+    MIN_SENSOR_SIZE,
+)
 
 session_router = Router()
 
@@ -25,9 +33,17 @@ class ParametersRequestSchema(ModelSchema):
             'carm_raise_lower_std_dev',
             'source_to_detector_distance',
             'detector_diameter',
+            'detector_resolution',
             'num_samples',
+            'sampling_mode',
+            'output_format',
         ]
 
+    # The projector allocates the whole detector, so its size is bounded
+    detector_resolution: int = Field(
+        default=DEFAULT_SENSOR_SIZE, ge=MIN_SENSOR_SIZE, le=MAX_SENSOR_SIZE
+    )
+
 
 @session_router.post('/{session_pk}/parameters/')
 def set_parameters(
@@ -39,12 +55,53 @@ def set_parameters(
         if session.owner != request.user:
             raise Http404
 
-        if session.status not in (Session.Status.NOT_STARTED, Session.Status.CANCELLED):
+        if (
+            session.status not in (Session.Status.NOT_STARTED, Session.Status.CANCELLED)
+            and not session.is_finished_preview
+        ):
             return HttpResponseBadRequest('Session is not in a valid state to update parameters')
 
+        session.discard_preview()
+
         InputParameters.objects.update_or_create(session=session, defaults=parameter_data.dict())
         session.status = Session.Status.NOT_STARTED
         session.save()
 
     # TODO: what do we return to VolView here?
     return 200
+
+
+class PoseSchema(Schema):
+    carm_push_pull: float = 0
+    carm_head_foot_translation: float = 0
+    carm_raise_lower: float = 0
+    carm_alpha: float = 0
+    carm_beta: float = 0
+
+
+@session_router.post('/{session_pk}/preview/')
+def preview_pose(request: HttpRequest, session_pk: UUID4, pose: PoseSchema):
+    """Render a single, low-resolution image of a pose with the session's parameters."""
+    session = get_object_or_404(Session, pk=session_pk)
+
+    if session.owner != request.user:
+        raise Http404
+
+    if not InputParameters.objects.filter(session=session).exists():
+        return HttpResponseBadRequest('Parameters missing')
+
+    png = request_pose_preview(
+        session_pk,
+        [
+            pose.carm_push_pull,
+            pose.carm_head_foot_translation,
+            pose.carm_raise_lower,
+            pose.carm_alpha,
+            pose.carm_beta,
+        ],
+        timeout=settings.POSE_PREVIEW_TIMEOUT,
+        max_queued=settings.POSE_PREVIEW_MAX_QUEUED,
+    )
+    if png is None:
+        return HttpResponse('Preview unavailable', status=503)
+    return HttpResponse(png, content_type='image/png')
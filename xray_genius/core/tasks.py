@@ -1,32 +1,153 @@
+from collections import deque
+from contextlib import ExitStack
 from datetime import timedelta
-from io import BytesIO
+import hashlib
+import math
 from pathlib import Path
+import secrets
 import shutil
 from tempfile import NamedTemporaryFile, TemporaryDirectory
+from typing import NotRequired, TypedDict
 from uuid import uuid4
 from zipfile import ZipFile
 
-from celery import shared_task
+from celery import chord, shared_task
 from celery.utils.log import get_task_logger
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files.base import ContentFile, File
 from django.core.mail import EmailMessage
 from django.db import transaction
-from django.db.models import QuerySet
+from django.db.models import Case, QuerySet, When
 from django.template.loader import render_to_string
+from django.utils import timezone
+import numpy as np
 import sentry_sdk
 
-from .models import ContactFormSubmission, OutputImage, Session
-from .models.input_parameters import DEFAULT_SENSOR_SIZE
+from .coordination import (
+    CancellationListener,
+    PendingShard,
+    SessionCancelledError,
+    ShardClaim,
+    add_pending_shards,
+    add_session_progress,
+    pop_pending_shard,
+    reset_session_progress,
+    set_shard_progress,
+)
+from .models import (
+    ContactFormSubmission,
+    CTInputFile,
+    DatasetExport,
+    DatasetExportShard,
+    InputParameters,
+    OutputImage,
+    Session,
+)
 from .notifications import TaskTracker
+from .render.archive import ARCHIVED_FIELDS, ArchivePart, archive_entry_name, merge_archives
+from .render.encoding import encode_frame
+from .render.fov import check_field_of_view, detector_coverage, volume_corners
+from .render.geometry import CArmGeometry
+from .render.outputs import (
+    OutputImageWriter,
+    StoredFrame,
+    delete_stored_frames,
+    store_output_file,
+)
+from .render.pipeline import RenderPipeline
+from .render.poses import group_identical_poses
+from .render.projectors import acquire_projector, get_projector_pool
+from .render.quality import FrameQualityThresholds, frame_statistics
+from .render.shards import output_image_sample, write_tar_shard
+from .render.stack import (
+    StackPart,
+    merge_stack_parts,
+    output_image_pose,
+    read_image,
+    write_pose_table,
+    write_stack,
+)
+from .render.volumes import write_render_artifact
 from .utils import ParameterSampler
 
 logger = get_task_logger(__name__)
 
 
+def _encode_and_store_frame(  # noqa: PLR0913
+    image,
+    poses: list[dict[str, float | int]],
+    *,
+    parameters: InputParameters,
+    pack: bool,
+    archive: bool,
+    cancellation: CancellationListener,
+) -> list[StoredFrame]:
+    """
+    Encode a rendered image in the output format and its thumbnail, and upload them to storage.
+
+    One frame is returned for each of the (identical) poses the image was rendered for, all of
+    which share the same files. If ``pack`` is set, the files are left to be uploaded in the
+    pack of their batch instead, see `OutputImageWriter`. If ``archive`` is set, the frames
+    also keep the content of their archived files, see `ArchivePart`.
+    """
+    name = uuid4()
+    compress_npy = parameters.output_format == InputParameters.OutputFormat.NPY_ZSTD
+    encoded = encode_frame(
+        image, png=parameters.stores_png, npy=parameters.stores_npy, compress_npy=compress_npy
+    )
+    files = {
+        'image': (f'{name}.png', encoded.image),
+        'thumbnail': (f'{name}_thumbnail.png', encoded.thumbnail),
+        'raw_image': (f'{name}.npy{".zst" if compress_npy else ""}', encoded.raw),
+    }
+    files = {field_name: file for field_name, file in files.items() if file[1] is not None}
+    # The encoded buffers are reused by this thread's next frame, so whatever is kept is copied
+    archive_contents = (
+        {
+            field_name: files[field_name][1].getvalue()
+            for field_name in ARCHIVED_FIELDS
+            if field_name in files
+        }
+        if archive
+        else {}
+    )
+    if pack:
+        packed_files = {
+            field_name: (filename, archive_contents.get(field_name) or content.getvalue())
+            for field_name, (filename, content) in files.items()
+        }
+        return [
+            StoredFrame(
+                image_name='',
+                thumbnail_name='',
+                packed_files=packed_files,
+                archive_contents=archive_contents,
+                **pose,
+            )
+            for pose in poses
+        ]
+
+    # Skip the uploads of frames which would be deleted right away
+    cancellation.raise_if_cancelled()
+    names = {
+        field_name: store_output_file(field_name, filename, content)
+        for field_name, (filename, content) in files.items()
+    }
+    return [
+        StoredFrame(
+            image_name=names.get('image', ''),
+            thumbnail_name=names['thumbnail'],
+            raw_image_name=names.get('raw_image', ''),
+            archive_contents=archive_contents,
+            **pose,
+        )
+        for pose in poses
+    ]
+
+
 def _maybe_cancel_session(session: Session) -> bool:
-    """Check if the session has been cancelled, and abort and clean up if so."""
+    """Check if the session has been cancelled, and clean up if so."""
     session.refresh_from_db(fields=['status'])
     if session.status == Session.Status.CANCELLED:
         logger.info('Session %s was cancelled', session.pk)
@@ -38,214 +159,773 @@ def _maybe_cancel_session(session: Session) -> bool:
     return False
 
 
-@shared_task(
-    soft_time_limit=timedelta(minutes=30).total_seconds(),
-)
-def run_deepdrr_task(session_pk: str) -> None:
+def _run_sampler(session: Session, seed: int | None) -> ParameterSampler:
+    """Get the sampler of the current run of a session, which samples fewer poses in previews."""
+    samples = (
+        min(settings.PREVIEW_NUM_SAMPLES, session.parameters.num_samples)
+        if session.preview
+        else None
+    )
+    return ParameterSampler(session.parameters, seed=seed, samples=samples)
+
+
+def _run_geometry(session: Session) -> CArmGeometry:
+    """Get the C-arm geometry of the current run of a session, at a low resolution in previews."""
+    return CArmGeometry.from_parameters(
+        session.parameters,
+        sensor_size=settings.PREVIEW_DETECTOR_RESOLUTION if session.preview else None,
+    )
+
+
+def start_deepdrr_run(session: Session, *, preview: bool = False) -> str:
+    """
+    Sample the poses of a queued session, and dispatch their rendering.
+
+    The poses are split into shards of at most ``RENDER_SHARD_SIZE`` images, each of which is
+    rendered by its own task, so a session can make use of several workers at once. Once every
+    shard is done, `finish_deepdrr_run_task` completes the session.
+
+    Shards only refer to poses by their index; the sampler seed is saved on the session, so
+    that each shard (including one redelivered after its worker died) samples the same poses.
+
+    A ``preview`` run only renders ``PREVIEW_NUM_SAMPLES`` poses, at a detector resolution of
+    ``PREVIEW_DETECTOR_RESOLUTION`` pixels, so the parameters can be checked quickly.
+
+    Returns:
+        The ID of the task which completes the session.
+
+    """
+    session.preview = preview
+    sampler = _run_sampler(session, seed=secrets.randbits(63))
+    poses = sampler.sample()
+    session.sampler_seed = sampler.seed
+    session.pose_discrepancy = sampler.discrepancy(poses)
+    Session.objects.filter(pk=session.pk).update(
+        sampler_seed=session.sampler_seed,
+        pose_discrepancy=session.pose_discrepancy,
+        fov_resampled_poses=0,
+        fov_rejected_poses=0,
+        low_information_frames=0,
+        preview=session.preview,
+    )
+
+    # Identical poses (e.g. when nothing is randomized) are only rendered once
+    index_groups = group_identical_poses(poses)
+    logger.info(
+        'Rendering %d unique poses of %d for session %s (%s sampling, discrepancy %s)',
+        len(index_groups),
+        len(poses),
+        session.pk,
+        sampler.mode,
+        session.pose_discrepancy,
+    )
+
+    shard_size = settings.RENDER_SHARD_SIZE or len(index_groups)
+    shards = [
+        index_groups[start : start + shard_size]
+        for start in range(0, len(index_groups), max(shard_size, 1))
+    ] or [[]]
+
+    reset_session_progress(session.pk)
+    # Any task rendering the same volume may take shards of this session, if it gets to them
+    # before their own tasks start, see `run_deepdrr_task`
+    add_pending_shards(
+        _render_context(session),
+        [
+            PendingShard(str(session.pk), session.sampler_seed, i, index_groups)
+            for i, index_groups in enumerate(shards)
+        ],
+    )
+    result = chord(
+        run_deepdrr_task.s(str(session.pk), index_groups, shard=i)
+        for i, index_groups in enumerate(shards)
+    )(
+        finish_deepdrr_run_task.s(str(session.pk)).on_error(
+            fail_deepdrr_run_task.s(str(session.pk), session.sampler_seed, len(shards))
+        )
+    )
+    return result.id
+
+
+class ShardResult(TypedDict):
+    # The number of output images created
+    created: int
+    # The number of poses which missed the input volume, and were resampled or rejected
+    resampled: int
+    rejected: int
+    # The number of samples whose rendered image was replaced for holding too little information
+    replaced: int
+    # The stored zip of the created output images, if any, see `ArchivePart`
+    archive: NotRequired[str]
+    # The stored stack of the created output images and its pose table, if any, see `StackPart`
+    stack: NotRequired[str]
+    poses: NotRequired[str]
+
+
+def _low_information_replacement(  # noqa: PLR0913
+    sampler: ParameterSampler,
+    index: int,
+    first_attempt: int,
+    *,
+    pose: np.ndarray,
+    geometry: CArmGeometry,
+    corners: np.ndarray,
+    min_coverage: float,
+) -> tuple[np.ndarray, int] | None:
+    """
+    Draw a fresh pose for a sample whose image, rendered from ``pose``, was low-information.
+
+    The replacement must differ from ``pose``, and pass the same field of view check as the
+    sampled poses, within ``RENDER_FOV_MAX_RESAMPLES`` attempts of ``first_attempt``. It's
+    returned with the attempt after its own, from which the sample's next replacement should be
+    drawn.
+    """
+    for attempt in range(first_attempt, first_attempt + max(settings.RENDER_FOV_MAX_RESAMPLES, 1)):
+        replacement = sampler.resample(index, attempt)
+        # Rendering the same pose again would only give the same image
+        if np.array_equal(replacement, pose):
+            continue
+        if (
+            min_coverage <= 0
+            or detector_coverage(geometry, replacement[np.newaxis], corners)[0] >= min_coverage
+        ):
+            return replacement, attempt + 1
+    return None
+
+
+def _pending_renders(
+    session: Session, renders: list[tuple[np.ndarray, list[int]]]
+) -> list[tuple[np.ndarray, list[int]]]:
+    """Drop the samples which already have a saved output image from the renders of poses."""
+    indices = [index for _, group in renders for index in group]
+    saved = set(
+        OutputImage.objects.filter(session=session, index__in=indices).values_list(
+            'index', flat=True
+        )
+    )
+    return [
+        (pose, pending)
+        for pose, group in renders
+        if (pending := [index for index in group if index not in saved])
+    ]
+
+
+_EMPTY_SHARD_RESULT = ShardResult(created=0, resampled=0, rejected=0, replaced=0)
+
+
+def _start_shard(session_pk: str) -> Session | None:
+    """Get a session to render a shard of, or None if it's no longer running."""
     try:
         with transaction.atomic():
             # First, lock the session and ensure it's in the proper state.
             # Then, before releasing the lock, update the state.
-            # This is done to prevent race conditions if this task is executed
-            # multiple times concurrently, which is always a possibility due to
-            # us using `acks_late` in Celery.
+            # This is done to prevent race conditions with the other shards of the session,
+            # and with cancellation.
             session = Session.objects.select_for_update().get(pk=session_pk)
-            if session.status != Session.Status.QUEUED:
+            if session.status == Session.Status.QUEUED:
+                # This is the first shard to start
+                session.status = Session.Status.RUNNING
+                session.save()
+            elif session.status != Session.Status.RUNNING:
                 logger.error('Session %s is not queued, aborting processing', session_pk)
-                return
-            session.status = Session.Status.RUNNING
-            session.save()
+                return None
         # Refetch the session without the lock with joined data
-        session = Session.objects.select_related('parameters', 'input_scan').get(pk=session_pk)
+        return Session.objects.select_related('parameters', 'input_scan').get(pk=session_pk)
     except Session.DoesNotExist:
         logger.info('Session %s was deleted, aborting processing', session_pk)
-        return
+        return None
 
-    # Import here to avoid attempting to load CUDA on the web server
-    from deepdrr import MobileCArm, Volume, geo
-    from deepdrr.projector import Projector  # separate import for CUDA init
-    import numpy as np
-    from PIL import Image
-    import png
-    from scipy.spatial.transform import Rotation
-
-    def to_supine(ct: Volume):
-        """
-        Turn the volume to be face up.
-
-        This aligns the patient so that, in world space,
-        the anterior side is toward +Z, inferior is toward +X,
-        and left is toward +Y.
-
-        Raises:
-            NotImplementedError: If the anatomical coordinate system is not "RAS" or "LPS".
-
-        """
-        if ct.anatomical_coordinate_system == 'RAS':
-            ct.world_from_anatomical = geo.FrameTransform.from_rt(
-                rotation=Rotation.from_euler('xz', [90, -90], degrees=True).as_matrix().squeeze(),
-            )
-        elif ct.anatomical_coordinate_system == 'LPS':
-            ct.world_from_anatomical = geo.FrameTransform.from_rt(
-                rotation=Rotation.from_euler('xz', [-90, 90], degrees=True).as_matrix().squeeze(),
-            )
-        else:
-            raise NotImplementedError(
-                f'Cannot handle anatomical coordinate system {ct.anatomical_coordinate_system}'
+
+def _render_context(session: Session) -> str:
+    """Identify the volume and C-arm geometry the shards of a session are rendered with."""
+    # Stored files are never overwritten in place, so their name identifies them
+    source = session.input_scan.render_artifact or session.input_scan.file
+    return hashlib.sha256(repr((source.name, _run_geometry(session))).encode()).hexdigest()[:32]
+
+
+# Also about how long a shard's own task waits for another task to render it
+RENDER_SHARD_TIME_LIMIT = timedelta(minutes=30)
+
+
+@shared_task(
+    bind=True,
+    soft_time_limit=RENDER_SHARD_TIME_LIMIT.total_seconds(),
+)
+def run_deepdrr_task(
+    self, session_pk: str, index_groups: list[list[int]], shard: int = 0
+) -> ShardResult:
+    """
+    Render one shard of a session, along with pending shards of other sessions.
+
+    Each item of ``index_groups`` is a list of the indices of identical poses, which are
+    rendered only once. Poses which would miss the input volume are resampled (or rejected)
+    before rendering, see `check_field_of_view`. Samples which already have an output image
+    (e.g. when the task is redelivered after its worker died) are skipped, so the shard
+    resumes where it stopped.
+
+    Rendered images which hold too little information (see `FrameQualityThresholds`) are
+    dropped, and their samples rendered again from fresh poses, within a budget of
+    ``RENDER_LOW_INFORMATION_RETRIES`` renders per shard; once it's spent, such images are kept.
+
+    Once its own shard is done, the task renders up to ``RENDER_COSCHEDULED_SHARDS`` shards of
+    other sessions with the same volume and geometry, whose tasks haven't started yet, while
+    the projector is still warm. Such a shard's own task then only reports its result, or
+    waits for it if it's still being rendered.
+    """
+    session = _start_shard(session_pk)
+    if session is None:
+        return _EMPTY_SHARD_RESULT
+
+    claim = ShardClaim(session_pk, session.sampler_seed, shard)
+    if (result := claim.result()) is not None:
+        logger.info('Shard %d of session %s was rendered by another task', shard, session_pk)
+        return result
+    # A redelivered task takes over the claim it held before its worker died
+    if not claim.acquire(self.request.id):
+        logger.info('Shard %d of session %s is being rendered by another task', shard, session_pk)
+        # Once a render would have timed out, the task holding the claim is assumed to be stuck
+        # (while still refreshing it), and the shard fails, so that the run does as well
+        delay = settings.RENDER_COSCHEDULED_RETRY_DELAY
+        raise self.retry(
+            countdown=delay,
+            max_retries=math.ceil(RENDER_SHARD_TIME_LIMIT.total_seconds() / max(delay, 1)),
+        )
+
+    result = _render_claimed_shard(session, index_groups, shard, claim)
+
+    context = _render_context(session)
+    coscheduled = 0
+    while coscheduled < settings.RENDER_COSCHEDULED_SHARDS and (
+        pending := pop_pending_shard(context)
+    ):
+        try:
+            coscheduled += _render_pending_shard(pending, owner=self.request.id)
+        except Exception:
+            # The shard's claim was released, so its own task renders it instead
+            logger.exception(
+                'Failed to render shard %d of session %s', pending.shard, pending.session_pk
             )
+            break
 
+    return result
+
+
+def _render_pending_shard(pending: PendingShard, *, owner: str) -> bool:
+    """Render a shard announced by another session, unless its own task has claimed it."""
+    claim = pending.claim()
+    # Entries of an earlier run of the session are stale, and its shards already rendered
+    current_run = Session.objects.filter(pk=pending.session_pk, sampler_seed=pending.run)
+    if not current_run.exists() or claim.result() is not None or not claim.acquire(owner):
+        return False
+
+    session = _start_shard(pending.session_pk)
+    if session is None:
+        claim.complete(_EMPTY_SHARD_RESULT)
+        return False
+    logger.info(
+        'Rendering shard %d of session %s along with another session',
+        pending.shard,
+        pending.session_pk,
+    )
+    _render_claimed_shard(session, pending.index_groups, pending.shard, claim)
+    return True
+
+
+def _render_claimed_shard(
+    session: Session, index_groups: list[list[int]], shard: int, claim: ShardClaim
+) -> ShardResult:
+    """Render a shard, and record its result on its claim; the claim is released on failure."""
+    try:
+        with claim.keep_alive():
+            result = _render_shard(session, index_groups, shard)
+    except BaseException:
+        claim.release()
+        raise
+    if not claim.complete(result):
+        logger.warning(
+            'Lost the claim of a shard of session %s, not recording its result', session.pk
+        )
+    return result
+
+
+def _render_shard(session: Session, index_groups: list[list[int]], shard: int) -> ShardResult:
+    """Render a shard of a session, with a projector from the worker's pool."""
+    session_pk = str(session.pk)
+    sampler = _run_sampler(session, seed=session.sampler_seed)
+    poses = sampler.sample()
+
+    num_samples = sampler.samples
     state = {'type': 'session_update', 'session_pk': str(session_pk)}
     tracker = TaskTracker(state=state, group_names=[f'dashboard_{session.owner.pk}'])
-    with tracker.running():
+    # The session is only complete once every shard is, see `finish_deepdrr_run_task`
+    with tracker.running(finish=False), ExitStack() as resources:
         tracker.description = 'Reading input file'
         tracker.flush()
 
-        with TemporaryDirectory() as f:
-            dest = Path(f) / f'temp.{".".join(session.input_scan.file.name.split(".")[1:]).lower()}'
-            dest.write_bytes(session.input_scan.file.read())
-            if dest.suffix == '.nrrd':
-                ct = Volume.from_nrrd(dest)
-            elif dest.suffix == '.dcm':
-                ct = Volume.from_dicom(
-                    dest,
-                    # TODO: remove this when the cache_dir is set correctly upstream.
-                    cache_dir=dest.parent / 'cache',
-                )
-            else:
-                ct = Volume.from_nifti(dest)
-
-        # place CT at center of the world, oriented supine (ILA)
-        to_supine(ct)
-        ct.place_center(geo.p(0, 0, 0))
-
-        source_to_detector_distance: float = session.parameters.source_to_detector_distance
-
-        carm = MobileCArm(
-            source_to_detector_distance=source_to_detector_distance,
-            source_to_isocenter_vertical_distance=source_to_detector_distance / 2,
-            sensor_height=DEFAULT_SENSOR_SIZE,
-            sensor_width=DEFAULT_SENSOR_SIZE,
-            pixel_size=session.parameters.sensor_pixel_pitch,
-            min_alpha=-180,
-            max_alpha=180,
-            min_beta=-180,
-            max_beta=180,
+        # The projector (with its volume already on the GPU) may be left over from an earlier
+        # task of the same input file, in which case nothing is read at all
+        geometry = _run_geometry(session)
+        pooled = resources.enter_context(acquire_projector(session.input_scan, geometry))
+        ct = pooled.volume
+
+        # Every pose of the shard is checked (even those already rendered, if the shard was
+        # redelivered), so that its results are always the same
+        corners = volume_corners(ct.shape, ct.world_from_ijk.data)
+        fov = check_field_of_view(
+            poses,
+            index_groups,
+            geometry=geometry,
+            corners=corners,
+            min_coverage=settings.RENDER_MIN_DETECTOR_COVERAGE,
+            max_resamples=settings.RENDER_FOV_MAX_RESAMPLES,
+            resample=sampler.resample,
+        )
+        if fov.resampled or fov.rejected:
+            logger.info(
+                'Session %s: %d poses resampled, %d rejected outside the field of view',
+                session_pk,
+                fov.resampled,
+                fov.rejected,
+            )
+        # Reported across all the shards of the session (once per shard, even if redelivered)
+        resampled = set_shard_progress(session_pk, shard, fov.resampled, counter='fov_resampled')
+        rejected = set_shard_progress(session_pk, shard, fov.rejected, counter='fov_rejected')
+        fov_summary = (
+            f' ({resampled} poses resampled, {rejected} skipped outside the field of view)'
+            if resampled or rejected
+            else ''
         )
 
-        param_sampler = ParameterSampler(session.parameters)
-
-        # Initialize the Projector object (allocates GPU memory)
-        with Projector(ct, carm=carm) as projector:
-            for i, (
-                push_pull_translation,
-                head_foot_translation,
-                raise_lower_translation,
-                alpha,
-                beta,
-            ) in enumerate(
-                zip(
-                    param_sampler.carm_push_pull_translation,
-                    param_sampler.carm_head_foot_translation,
-                    param_sampler.carm_raise_lower_translation,
-                    param_sampler.carm_alpha,
-                    param_sampler.carm_beta,
-                    strict=True,
-                )
+        renders = _pending_renders(session, fov.renders)
+        if len(renders) < len(fov.renders):
+            logger.info(
+                'Resuming shard of session %s, %d of %d poses left to render',
+                session_pk,
+                len(renders),
+                len(fov.renders),
+            )
+        # Rejected samples will never be rendered, so count them as done
+        add_session_progress(session_pk, fov.rejected)
+        tracker.description = f'Checked the field of view{fov_summary}'
+        tracker.flush()
+
+        # The camera frames of every pose are computed at once, rather than by moving the
+        # C-arm to each pose in turn
+        frames = geometry.frames(np.array([pose for pose, _ in renders]))
+        queue = deque(
+            (pose, group, camera3d_from_world)
+            for (pose, group), camera3d_from_world in zip(
+                renders, frames.camera3d_from_world, strict=True
+            )
+        )
+        thresholds = FrameQualityThresholds(
+            min_foreground_fraction=settings.RENDER_MIN_FOREGROUND_FRACTION,
+            min_dynamic_range=settings.RENDER_MIN_DYNAMIC_RANGE,
+            min_entropy=settings.RENDER_MIN_FRAME_ENTROPY,
+        )
+        # Without a randomized parameter, every replacement would be the very same pose
+        retries = (
+            settings.RENDER_LOW_INFORMATION_RETRIES
+            if thresholds.enabled and sampler.randomized
+            else 0
+        )
+        # Replacements continue from the attempts of the field of view check, so that they
+        # never reuse one of its poses
+        next_attempts = dict.fromkeys(
+            (index for _, group in renders for index in group), settings.RENDER_FOV_MAX_RESAMPLES
+        )
+        # A sample counts as replaced once, however many of its replacements it took
+        replaced_samples: set[int] = set()
+        # Previews are never exported
+        archive = None if session.preview else resources.enter_context(ArchivePart())
+        stack = (
+            None
+            if session.preview
+            else resources.enter_context(StackPart(_stack_dtype(session.parameters)))
+        )
+
+        # Encoding and uploading of each image happens on the pipeline's worker threads,
+        # so the projector can move on to the next image in the meantime. Uploaded images
+        # are then saved to the DB in batches by the writer.
+        # On cancellation, leaving the pipeline and writer discards every image which hasn't
+        # been saved yet; those already in the DB are cleaned up once every shard has stopped.
+        try:
+            with (
+                CancellationListener(session_pk) as cancellation,
+                OutputImageWriter(
+                    session,
+                    batch_size=settings.OUTPUT_IMAGE_BATCH_SIZE,
+                    max_delay_seconds=settings.OUTPUT_IMAGE_BATCH_MAX_DELAY,
+                    archive=archive,
+                ) as writer,
+                RenderPipeline(
+                    writer.extend,
+                    on_discard=delete_stored_frames,
+                    max_workers=settings.RENDER_PIPELINE_WORKERS,
+                    max_pending=settings.RENDER_PIPELINE_MAX_PENDING,
+                ) as pipeline,
             ):
-                tracker.progress = i / param_sampler.samples
-                tracker.description = f'Generating image {i + 1} of {param_sampler.samples}'
-                tracker.flush(max_rate_seconds=0.5)
-                logger.info(
-                    'Running DeepDRR for session %s (%d/%d)',
-                    session_pk,
-                    i + 1,
-                    param_sampler.samples,
-                )
+                while queue:
+                    pose, group, camera3d_from_world = queue.popleft()
+                    cancellation.raise_if_cancelled()
 
-                carm.move_to(
-                    alpha=alpha,
-                    beta=beta,
-                    degrees=True,
-                    isocenter=geo.p(
-                        # incoming parameters are in LPS, but deepdrr supine
-                        # is in ILA (-Z, +X, -Y).
-                        # head_foot: +Z, push_pull: +X, raise_lower: +Y
-                        -head_foot_translation,
-                        push_pull_translation,
-                        -raise_lower_translation,
-                    ),
-                )
+                    logger.info(
+                        'Running DeepDRR for session %s (%d left in shard)',
+                        session_pk,
+                        len(queue) + 1,
+                    )
 
-                image = projector()
-
-                with TemporaryDirectory() as tmpdir:
-                    dest = Path(tmpdir) / 'image.png'
-                    name = uuid4()
-
-                    if image.dtype in (np.float16, np.float32, np.float64):
-                        image_u16 = np.clip(image * 0xFFFF, 0, 0xFFFF).astype(np.uint16)
-                        image_u8 = np.clip(image * 0xFF, 0, 0xFF).astype(np.uint8)
-                    else:
-                        logger.warning('Naive cast image %r (unknown dtype %r).', name, image.dtype)
-                        image_u16 = image.astype(np.uint16)
-                        image_u8 = image.astype(np.uint8)
-
-                    png.from_array(image_u16, mode='L;16').save(dest)
-                    img = File(BytesIO(dest.read_bytes()), name=f'{name}.png')
-
-                    thumbnail_dest = Path(tmpdir) / 'thumbnail.png'
-                    thumbnail_img = Image.fromarray(image_u8)
-                    thumbnail_img.thumbnail((64, 64))
-                    thumbnail_img.save(thumbnail_dest)
-                    thumbnail = File(
-                        BytesIO(thumbnail_dest.read_bytes()), name=f'{name}_thumbnail.png'
+                    image = pooled.render(camera3d_from_world)
+
+                    if retries and thresholds.is_low_information(frame_statistics(image)):
+                        replacements = [
+                            (index, replacement)
+                            for index in group[:retries]
+                            if (
+                                replacement := _low_information_replacement(
+                                    sampler,
+                                    index,
+                                    next_attempts[index],
+                                    pose=pose,
+                                    geometry=geometry,
+                                    corners=corners,
+                                    min_coverage=settings.RENDER_MIN_DETECTOR_COVERAGE,
+                                )
+                            )
+                        ]
+                        if replacements:
+                            replaced_frames = geometry.frames(
+                                np.array([replacement for _, (replacement, _) in replacements])
+                            )
+                            # The rest of the group is still saved with the original pose
+                            for (index, (replacement, next_attempt)), replacement_frame in zip(
+                                replacements, replaced_frames.camera3d_from_world, strict=True
+                            ):
+                                next_attempts[index] = next_attempt
+                                queue.append((replacement, [index], replacement_frame))
+                            retries -= len(replacements)
+                            # The rest of the group (if any) keeps this image
+                            replaced_indices = {index for index, _ in replacements}
+                            replaced_samples |= replaced_indices
+                            group = [index for index in group if index not in replaced_indices]
+                            if not group:
+                                continue
+
+                    frame_poses = [
+                        {
+                            'index': index,
+                            'carm_push_pull': pose[0],
+                            'carm_head_foot_translation': pose[1],
+                            'carm_raise_lower': pose[2],
+                            'carm_alpha': pose[3],
+                            'carm_beta': pose[4],
+                        }
+                        for index in group
+                    ]
+                    pipeline.submit(
+                        _encode_and_store_frame,
+                        image,
+                        frame_poses,
+                        parameters=session.parameters,
+                        pack=settings.OUTPUT_IMAGE_PACKING,
+                        archive=archive is not None,
+                        cancellation=cancellation,
                     )
+                    if stack is not None:
+                        stack.add(image, frame_poses)
 
-                    output_image = OutputImage.objects.create(
-                        image=img,
-                        thumbnail=thumbnail,
-                        session=session,
-                        carm_push_pull=push_pull_translation,
-                        carm_head_foot_translation=head_foot_translation,
-                        carm_raise_lower=raise_lower_translation,
-                        carm_alpha=alpha,
-                        carm_beta=beta,
+                    # Progress is aggregated across all the shards of the session
+                    rendered = add_session_progress(session_pk, len(group))
+                    # A redelivered shard may count some poses again
+                    rendered = min(rendered, num_samples)
+                    tracker.progress = rendered / num_samples
+                    tracker.description = (
+                        f'Generating image {rendered} of {num_samples}{fov_summary}'
                     )
+                    tracker.flush(max_rate_seconds=0.5)
+        except SessionCancelledError:
+            logger.info('Session %s was cancelled, stopped rendering shard', session_pk)
+            return ShardResult(
+                created=0,
+                resampled=fov.resampled,
+                rejected=fov.rejected,
+                replaced=len(replaced_samples),
+            )
+        archive_name = archive.store() if archive is not None and archive.count else ''
+        stack_names = stack.store() if stack is not None and stack.count else None
+
+    if replaced_samples:
+        logger.info(
+            'Session %s: %d low-information images replaced', session_pk, len(replaced_samples)
+        )
+    stats = get_projector_pool().stats()
+    logger.info(
+        'Projector pool: %d hits, %d misses, %d evictions',
+        stats.hits,
+        stats.misses,
+        stats.evictions,
+    )
+    result = ShardResult(
+        created=writer.created,
+        resampled=fov.resampled,
+        rejected=fov.rejected,
+        replaced=len(replaced_samples),
+    )
+    if archive_name:
+        result['archive'] = archive_name
+    if stack_names:
+        result['stack'], result['poses'] = stack_names
+    return result
+
+
+# The session field where each kind of part of a shard's results is stored
+_PART_FIELDS = {
+    'archive': 'output_images_zip',
+    'stack': 'output_images_stack',
+    'poses': 'output_images_poses',
+}
+
+
+def _complete_parts(session: Session, shard_results: list[ShardResult], key: str) -> list[str]:
+    """
+    Get a kind of part (e.g. the zips) of a session's shards, if they hold every output image.
+
+    They don't if a shard was redelivered, since its part then only holds what it created after.
+    Incomplete parts are deleted.
+    """
+    parts = [result[key] for result in shard_results if result.get(key)]
+    created = sum(result['created'] for result in shard_results)
+    if all(result.get(key) for result in shard_results if result['created']) and (
+        created == session.output_images.count()
+    ):
+        return parts
+    _delete_parts(key, parts)
+    return []
+
+
+def _delete_parts(key: str, parts: list[str]) -> None:
+    storage = Session._meta.get_field(_PART_FIELDS[key]).storage
+    for part in parts:
+        storage.delete(part)
+
+
+def _rename_part(key: str, part: str, name: str) -> str:
+    """Store a part under the name of the session's file, returning its stored name."""
+    field_name = _PART_FIELDS[key]
+    storage = Session._meta.get_field(field_name).storage
+    with storage.open(part, 'rb') as src:
+        stored = store_output_file(field_name, name, src, model=Session)
+    storage.delete(part)
+    return stored
 
-                if _maybe_cancel_session(session):
-                    return
 
+def _merge_stack_parts(stacks: list[str], poses: list[str], *, count: int) -> dict[str, str]:
+    """
+    Store the stack and pose table of a session, merged from those of its shards, by field.
+
+    The merged stack must have ``count`` rows, i.e. one for each of the session's images.
+    """
+    stack_storage = Session._meta.get_field('output_images_stack').storage
+    poses_storage = Session._meta.get_field('output_images_poses').storage
+    with TemporaryDirectory() as tmp:
+        sources = []
+        for i, (stack_part, poses_part) in enumerate(zip(stacks, poses, strict=True)):
+            stack_path, poses_path = Path(tmp) / f'{i}.npy', Path(tmp) / f'{i}.npz'
+            for storage, part, path in (
+                (stack_storage, stack_part, stack_path),
+                (poses_storage, poses_part, poses_path),
+            ):
+                with storage.open(part, 'rb') as src, path.open('wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            sources.append((stack_path, poses_path))
+
+        stack_path = Path(tmp) / 'images.npy'
+        poses_path = Path(tmp) / 'poses.npz'
+        merge_stack_parts(sources, stack_path, poses_path)
+        # A shard's stack also holds the images it dropped, if they were saved by another task
+        if (rows := len(np.load(stack_path, mmap_mode='r'))) != count:
+            raise ValueError(f'Expected {count} stacked images, got {rows}')
+        with stack_path.open('rb') as stack, poses_path.open('rb') as table:
+            return {
+                'output_images_stack': store_output_file(
+                    'output_images_stack', 'images.npy', stack, model=Session
+                ),
+                'output_images_poses': store_output_file(
+                    'output_images_poses', 'poses.npz', table, model=Session
+                ),
+            }
+
+
+@shared_task(soft_time_limit=timedelta(minutes=10).total_seconds())
+def finish_deepdrr_run_task(shard_results: list[ShardResult], session_pk: str) -> None:
+    """Complete a session, once every shard of it has been rendered."""
+    try:
+        session = Session.objects.select_related('owner').get(pk=session_pk)
+    except Session.DoesNotExist:
+        logger.info('Session %s was deleted, aborting processing', session_pk)
+        return
+
+    state = {'type': 'session_update', 'session_pk': str(session_pk)}
+    tracker = TaskTracker(state=state, group_names=[f'dashboard_{session.owner.pk}'])
+    with tracker.running():
         # Update the session status to PROCESSED.
         # Note, we include the status filter here to ensure that we only update the status
         # to PROCESSED if the session has not been cancelled. If the query doesn't return 1,
-        # (i.e. it doesn't update any rows), then we know the session was cancelled between
-        # this line of code and the end of the loop just before this.
+        # (i.e. it doesn't update any rows), then we know the session was cancelled while
+        # it was rendering, and clean up whatever the shards created.
+        parts = _complete_parts(session, shard_results, 'archive')
+        ready_files = {}
+        if len(parts) == 1:
+            # The zip of a single shard is already the session's, so it's ready right away
+            ready_files['output_images_zip'] = _rename_part('archive', parts.pop(), 'images.zip')
+        # The stacks of the shards are merged right away, so the session's is ready along with it
+        stack_parts = _complete_parts(session, shard_results, 'stack')
+        poses_parts = _complete_parts(session, shard_results, 'poses')
+        if stack_parts and len(stack_parts) == len(poses_parts):
+            try:
+                ready_files |= _merge_stack_parts(
+                    stack_parts,
+                    poses_parts,
+                    count=sum(result['created'] for result in shard_results),
+                )
+            except Exception:
+                # The stack is then put together from the stored images instead
+                logger.exception('Failed to merge the stacks of session %s', session_pk)
+        _delete_parts('stack', stack_parts)
+        _delete_parts('poses', poses_parts)
         sessions_modified = Session.objects.filter(
             pk=session_pk, status=Session.Status.RUNNING
-        ).update(status=Session.Status.PROCESSED)
+        ).update(
+            status=Session.Status.PROCESSED,
+            fov_resampled_poses=sum(result['resampled'] for result in shard_results),
+            fov_rejected_poses=sum(result['rejected'] for result in shard_results),
+            low_information_frames=sum(result['replaced'] for result in shard_results),
+            **ready_files,
+        )
 
         if sessions_modified == 1:
-            logger.info('Created output image %s for session %s', output_image.pk, session_pk)
-            zip_images_task.delay(session_pk)
+            logger.info(
+                'Created %d output images for session %s',
+                sum(result['created'] for result in shard_results),
+                session_pk,
+            )
+            # Previews are only looked at on the dashboard, never exported
+            if not session.preview:
+                if parts:
+                    zip_images_task.delay(session_pk, parts)
+                elif 'output_images_zip' not in ready_files:
+                    zip_images_task.delay(session_pk)
+                if 'output_images_stack' not in ready_files:
+                    stack_images_task.delay(session_pk)
         else:
+            _delete_parts('archive', parts)
+            for field_name, name in ready_files.items():
+                Session._meta.get_field(field_name).storage.delete(name)
             _maybe_cancel_session(session)
             logger.info('Session %s was cancelled, did not set status to PROCESSED', session_pk)
 
 
+@shared_task
+def fail_deepdrr_run_task(
+    _request, exc: Exception, _traceback, session_pk: str, run: int, num_shards: int
+) -> None:
+    """
+    Delete the parts stored by the shards of a run, once one of its shards has failed.
+
+    The run is never finished then, see `finish_deepdrr_run_task`, so nothing else would. The
+    parts are found from the results each shard recorded on its claim.
+    """
+    logger.error('Rendering session %s failed: %r', session_pk, exc)
+    for shard in range(num_shards):
+        result = ShardClaim(session_pk, run, shard).result() or {}
+        for key in _PART_FIELDS:
+            if result.get(key):
+                _delete_parts(key, [result[key]])
+
+
+@shared_task(soft_time_limit=timedelta(minutes=15).total_seconds())
+def preprocess_ct_input_file_task(ct_input_file_pk: int) -> None:
+    try:
+        ct_input_file = CTInputFile.objects.get(pk=ct_input_file_pk)
+    except CTInputFile.DoesNotExist:
+        logger.info('Input file %s was deleted, aborting preprocessing', ct_input_file_pk)
+        return
+    if ct_input_file.render_artifact:
+        return
+
+    # Every session started from a sample dataset has its own input file, but they all share
+    # the same file, so they can share the same artifact as well.
+    existing_artifact = (
+        CTInputFile.objects.filter(file=ct_input_file.file.name)
+        .exclude(render_artifact__isnull=True)
+        .exclude(render_artifact='')
+        .values_list('render_artifact', flat=True)
+        .first()
+    )
+    if existing_artifact is None:
+        with TemporaryDirectory() as tmp:
+            artifact_path = Path(tmp) / 'artifact.tar'
+            write_render_artifact(ct_input_file, artifact_path)
+            with artifact_path.open('rb') as artifact:
+                ct_input_file.render_artifact.save(f'{uuid4()}.tar', File(artifact), save=False)
+        existing_artifact = ct_input_file.render_artifact.name
+
+    CTInputFile.objects.filter(pk=ct_input_file_pk).update(render_artifact=existing_artifact)
+    logger.info('Preprocessed input file %s', ct_input_file_pk)
+
+
 @shared_task(soft_time_limit=120)
-def zip_images_task(session_pk: str) -> None:
-    session = Session.objects.get(pk=session_pk)
+def zip_images_task(session_pk: str, archive_parts: list[str] | None = None) -> None:
+    """
+    Zip the images of a session, from the zips of its shards if given, see `ArchivePart`.
+
+    Otherwise, every image is read back from storage.
+    """
+    try:
+        session = Session.objects.get(pk=session_pk, status=Session.Status.PROCESSED)
+    except Session.DoesNotExist:
+        # e.g. it was deleted, or started again, in the meantime
+        logger.info('Session %s is no longer processed, not zipping its images', session_pk)
+        _delete_parts('archive', archive_parts or [])
+        return
+
+    if archive_parts:
+        storage = Session._meta.get_field('output_images_zip').storage
+        try:
+            with ExitStack() as stack, NamedTemporaryFile() as buffer:
+                sources = []
+                for part in archive_parts:
+                    source = stack.enter_context(NamedTemporaryFile())
+                    with storage.open(part, 'rb') as src:
+                        shutil.copyfileobj(src, source)
+                    source.seek(0)
+                    sources.append(source)
+                merge_archives(sources, buffer)
+                buffer.seek(0)
+                session.output_images_zip.save('images.zip', File(buffer), save=True)
+        finally:
+            _delete_parts('archive', archive_parts)
+        logger.info('Merged %d zip files for session %s', len(archive_parts), session_pk)
+        return
 
     with NamedTemporaryFile() as buffer:
         with ZipFile(buffer.name, 'w') as zip_file:
             output_images: QuerySet[OutputImage] = session.output_images.all()
-            for output_image in output_images.iterator():
-                image_name = Path(output_image.image.name).name
+            image_names: set[str] = set()
+            for output_image in output_images.select_related('pack').iterator():
+                for field_name in ARCHIVED_FIELDS:
+                    if not output_image.has_file(field_name):
+                        continue
+                    image_name = archive_entry_name(output_image, field_name, image_names)
 
-                # Preserve bit-depth. Do not use Image.open.
-                with output_image.image.open('rb') as src, NamedTemporaryFile() as dst:
-                    shutil.copyfileobj(src, dst)
-                    zip_file.write(filename=dst.name, arcname=image_name)
+                    # Preserve bit-depth. Do not use Image.open.
+                    if field_name in output_image.pack_slices:
+                        zip_file.writestr(image_name, output_image.read_file(field_name))
+                        continue
+                    image = getattr(output_image, field_name)
+                    with image.open('rb') as src, NamedTemporaryFile() as dst:
+                        shutil.copyfileobj(src, dst)
+                        zip_file.write(filename=dst.name, arcname=image_name)
 
         with NamedTemporaryFile() as zip_output:
             buffer.seek(0)
@@ -256,6 +936,106 @@ def zip_images_task(session_pk: str) -> None:
     logger.info('Created zip file for session %s', session_pk)
 
 
+def _stack_dtype(parameters: InputParameters) -> type[np.generic]:
+    # Raw images are stacked as they were rendered, and PNGs with their 16-bit values
+    return np.float32 if parameters.stores_npy else np.uint16
+
+
+@shared_task(soft_time_limit=120)
+def stack_images_task(session_pk: str) -> None:
+    """
+    Export a session's images as a single (N, H, W) array, along with a table of their poses.
+
+    Every image is read back from storage, for sessions whose shards' stacks couldn't be merged,
+    see `StackPart`.
+    """
+    session = Session.objects.select_related('parameters').get(pk=session_pk)
+    # Rows of the stack and of the pose table are both in the order of the sampled poses
+    output_images: QuerySet[OutputImage] = session.output_images.select_related('pack').order_by(
+        'index', 'pk'
+    )
+    count = output_images.count()
+    size = session.parameters.detector_resolution
+    dtype = _stack_dtype(session.parameters)
+
+    with TemporaryDirectory() as tmp:
+        stack_path = Path(tmp) / 'images.npy'
+        poses_path = Path(tmp) / 'poses.npz'
+        write_stack(
+            stack_path, map(read_image, output_images.iterator()), (count, size, size), dtype
+        )
+        with poses_path.open('wb') as poses:
+            write_pose_table(poses, map(output_image_pose, output_images.iterator()))
+        with stack_path.open('rb') as stack, poses_path.open('rb') as poses:
+            session.output_images_stack.save('images.npy', File(stack), save=False)
+            session.output_images_poses.save('poses.npz', File(poses), save=False)
+        session.save(update_fields=['output_images_stack', 'output_images_poses'])
+
+    logger.info('Created stacked images of session %s', session_pk)
+
+
+@shared_task(soft_time_limit=timedelta(hours=2).total_seconds())
+def export_dataset_task(export_pk: int) -> None:
+    """
+    Export the output images of a dataset export's sessions, as a series of tar shards.
+
+    Samples are in a fixed order (by the export's session IDs, then by sampled pose), so each
+    shard always holds the same slice of them. Shards which were already stored are skipped,
+    which lets a failed or interrupted export resume where it stopped. Once one of its sessions
+    is deleted, an export can't be resumed, as its remaining shards would hold other samples.
+    """
+    try:
+        export = DatasetExport.objects.get(pk=export_pk)
+    except DatasetExport.DoesNotExist:
+        logger.info('Dataset export %s was deleted, aborting export', export_pk)
+        return
+    DatasetExport.objects.filter(pk=export_pk).update(
+        status=DatasetExport.Status.RUNNING, progressed=timezone.now()
+    )
+
+    if Session.objects.filter(pk__in=export.session_ids).count() != len(export.session_ids):
+        logger.info('A session of dataset export %s was deleted, aborting export', export_pk)
+        DatasetExport.objects.filter(pk=export_pk).update(status=DatasetExport.Status.FAILED)
+        return
+    output_images: QuerySet[OutputImage] = (
+        OutputImage.objects.filter(session__in=export.session_ids)
+        .alias(
+            session_position=Case(
+                *(
+                    When(session_id=session_id, then=position)
+                    for position, session_id in enumerate(export.session_ids)
+                )
+            )
+        )
+        .select_related('pack')
+        .order_by('session_position', 'index', 'pk')
+    )
+    size = export.samples_per_shard
+    num_shards = -(-output_images.count() // size)
+    stored = set(export.shards.values_list('index', flat=True))
+    try:
+        for shard_index in range(num_shards):
+            if shard_index in stored:
+                continue
+            shard_images = output_images[shard_index * size : (shard_index + 1) * size]
+            with NamedTemporaryFile(suffix='.tar') as tmp:
+                num_samples = write_tar_shard(
+                    Path(tmp.name), map(output_image_sample, shard_images.iterator())
+                )
+                shard = DatasetExportShard(
+                    export=export, index=shard_index, num_samples=num_samples
+                )
+                shard.file.save(f'{export.pk}-{shard_index:06d}.tar', File(tmp), save=False)
+                shard.save()
+            DatasetExport.objects.filter(pk=export_pk).update(progressed=timezone.now())
+    except Exception:
+        DatasetExport.objects.filter(pk=export_pk).update(status=DatasetExport.Status.FAILED)
+        raise
+
+    DatasetExport.objects.filter(pk=export_pk).update(status=DatasetExport.Status.FINISHED)
+    logger.info('Exported %d shards of dataset export %s', num_shards, export_pk)
+
+
 @shared_task(soft_time_limit=60)
 def delete_session_task(session_pk: str) -> None:
     # This delete query will also trigger a bunch of Django signals
@@ -0,0 +1,171 @@
+from io import BytesIO
+from zipfile import ZipFile
+
+from django.core.files.storage import InMemoryStorage
+import pytest
+
+from xray_genius.core import tasks
+from xray_genius.core.coordination import ShardClaim
+from xray_genius.core.models import OutputImage, Session
+from xray_genius.core.render.archive import ArchivePart
+from xray_genius.core.render.outputs import OutputImageWriter, StoredFrame, store_output_file
+
+
+@pytest.fixture
+def storage(monkeypatch: pytest.MonkeyPatch) -> InMemoryStorage:
+    storage = InMemoryStorage()
+    for field in ('image', 'thumbnail', 'raw_image'):
+        monkeypatch.setattr(OutputImage._meta.get_field(field), 'storage', storage)
+    monkeypatch.setattr(Session._meta.get_field('output_images_zip'), 'storage', storage)
+    return storage
+
+
+def _stored_frame(index: int) -> StoredFrame:
+    return StoredFrame(
+        image_name=store_output_file('image', f'{index}.png', BytesIO(b'image')),
+        thumbnail_name=store_output_file('thumbnail', f'{index}_thumb.png', BytesIO(b'thumb')),
+        archive_contents={'image': b'image %d' % index},
+        carm_push_pull=float(index),
+        carm_head_foot_translation=0.0,
+        carm_raise_lower=0.0,
+        carm_alpha=0.0,
+        carm_beta=0.0,
+    )
+
+
+def _zip_entries(storage: InMemoryStorage, name: str) -> dict[str, bytes]:
+    with storage.open(name) as f, ZipFile(BytesIO(f.read())) as zip_file:
+        return {info.filename: zip_file.read(info) for info in zip_file.infolist()}
+
+
+@pytest.mark.django_db
+def test_output_image_writer_archives_saved_frames(storage, session_factory):
+    session = session_factory()
+    shared = _stored_frame(0)
+
+    with ArchivePart() as archive:
+        with OutputImageWriter(
+            session, batch_size=2, max_delay_seconds=60, archive=archive
+        ) as writer:
+            for frame in (shared, shared, _stored_frame(1)):
+                writer.add(frame)
+        part = archive.store()
+
+    assert archive.count == 3
+    # Images of identical poses each get their own entry, as in a zip of the saved images
+    output_images = list(session.output_images.order_by('pk'))
+    names = [output_image.file_name('image') for output_image in output_images]
+    assert _zip_entries(storage, part) == {
+        names[0]: b'image 0',
+        names[1].replace('.png', f'_{output_images[1].pk}.png'): b'image 0',
+        names[2]: b'image 1',
+    }
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('num_parts', [1, 2])
+def test_finish_deepdrr_run_archive_parts(storage, session_factory, mocker, num_parts: int):
+    zip_images_task = mocker.patch.object(tasks.zip_images_task, 'delay')
+    mocker.patch.object(tasks.stack_images_task, 'delay')
+    session: Session = session_factory(status=Session.Status.RUNNING)
+    results = []
+    for shard in range(num_parts):
+        with ArchivePart() as archive:
+            with OutputImageWriter(
+                session, batch_size=10, max_delay_seconds=60, archive=archive
+            ) as writer:
+                writer.add(_stored_frame(shard))
+            results.append(
+                {
+                    'created': 1,
+                    'resampled': 0,
+                    'rejected': 0,
+                    'replaced': 0,
+                    'archive': archive.store(),
+                }
+            )
+
+    tasks.finish_deepdrr_run_task(results, str(session.pk))
+
+    session.refresh_from_db()
+    parts = [result['archive'] for result in results]
+    if num_parts == 1:
+        # The zip is ready as soon as the session is, under the same name as a merged one
+        assert session.output_images_zip.name == 'output_images/zips/images.zip'
+        assert list(_zip_entries(storage, session.output_images_zip.name).values()) == [b'image 0']
+        assert not storage.exists(parts[0])
+        zip_images_task.assert_not_called()
+        return
+
+    zip_images_task.assert_called_once_with(str(session.pk), parts)
+    tasks.zip_images_task(str(session.pk), parts)
+
+    session.refresh_from_db()
+    assert sorted(_zip_entries(storage, session.output_images_zip.name).values()) == [
+        b'image 0',
+        b'image 1',
+    ]
+    assert not any(storage.exists(part) for part in parts)
+
+
+@pytest.mark.django_db
+def test_finish_deepdrr_run_incomplete_archive_parts(storage, session_factory, mocker):
+    zip_images_task = mocker.patch.object(tasks.zip_images_task, 'delay')
+    mocker.patch.object(tasks.stack_images_task, 'delay')
+    session: Session = session_factory(status=Session.Status.RUNNING)
+    # An image saved by an earlier delivery of the shard, which its zip doesn't hold
+    with OutputImageWriter(session, batch_size=10, max_delay_seconds=60) as writer:
+        writer.add(_stored_frame(0))
+    with ArchivePart() as archive:
+        with OutputImageWriter(
+            session, batch_size=10, max_delay_seconds=60, archive=archive
+        ) as writer:
+            writer.add(_stored_frame(1))
+        part = archive.store()
+
+    tasks.finish_deepdrr_run_task(
+        [{'created': 1, 'resampled': 0, 'rejected': 0, 'replaced': 0, 'archive': part}],
+        str(session.pk),
+    )
+
+    session.refresh_from_db()
+    assert not session.output_images_zip
+    assert not storage.exists(part)
+    zip_images_task.assert_called_once_with(str(session.pk))
+
+
+@pytest.mark.django_db
+def test_fail_deepdrr_run_deletes_parts(storage, session_factory):
+    session: Session = session_factory(status=Session.Status.RUNNING, sampler_seed=1)
+    with ArchivePart() as archive:
+        with OutputImageWriter(
+            session, batch_size=10, max_delay_seconds=60, archive=archive
+        ) as writer:
+            writer.add(_stored_frame(0))
+        part = archive.store()
+    # The first shard was rendered, and the second failed without a result
+    claim = ShardClaim(session.pk, run=1, shard=0)
+    claim.acquire('task-1')
+    claim.complete({'created': 1, 'resampled': 0, 'rejected': 0, 'replaced': 0, 'archive': part})
+
+    tasks.fail_deepdrr_run_task(None, RuntimeError('out of memory'), None, str(session.pk), 1, 2)
+
+    assert not storage.exists(part)
+
+
+@pytest.mark.django_db
+def test_zip_images_task_restarted_session(storage, session_factory):
+    # The session was started again after its shards were rendered
+    session: Session = session_factory(status=Session.Status.RUNNING)
+    with ArchivePart() as archive:
+        with OutputImageWriter(
+            session, batch_size=10, max_delay_seconds=60, archive=archive
+        ) as writer:
+            writer.add(_stored_frame(0))
+        part = archive.store()
+
+    tasks.zip_images_task(str(session.pk), [part])
+
+    session.refresh_from_db()
+    assert not session.output_images_zip
+    assert not storage.exists(part)
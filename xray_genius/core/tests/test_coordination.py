@@ -0,0 +1,218 @@
+from datetime import timedelta
+import threading
+import time
+from uuid import uuid4
+
+from django.test import Client
+from django.urls import reverse
+import pytest
+
+from xray_genius.core import coordination
+from xray_genius.core.coordination import (
+    CancellationListener,
+    PendingShard,
+    SessionCancelledError,
+    ShardClaim,
+    add_pending_shards,
+    add_session_progress,
+    clear_session_cancelled,
+    get_redis,
+    next_pose_preview_request,
+    pop_pending_shard,
+    request_pose_preview,
+    reset_session_progress,
+    send_pose_preview,
+    set_shard_progress,
+    signal_pose_preview_worker_alive,
+    signal_session_cancelled,
+)
+from xray_genius.core.models import Session
+
+
+def test_cancellation_listener_receives_signal():
+    session_pk = uuid4()
+    with CancellationListener(session_pk) as cancellation:
+        assert not cancellation.is_cancelled()
+
+        signal_session_cancelled(session_pk)
+
+        # Delivered in the background, so the check itself never blocks on Redis
+        assert cancellation.wait(timeout=5)
+        with pytest.raises(SessionCancelledError):
+            cancellation.raise_if_cancelled()
+
+
+def test_cancellation_listener_sees_earlier_signal():
+    session_pk = uuid4()
+    signal_session_cancelled(session_pk)
+
+    with CancellationListener(session_pk) as cancellation:
+        assert cancellation.is_cancelled()
+
+    clear_session_cancelled(session_pk)
+    with CancellationListener(session_pk) as cancellation:
+        assert not cancellation.is_cancelled()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_cancel_batch_run_signals_cancellation(user, session_factory, client: Client):
+    client.force_login(user)
+    session: Session = session_factory(owner=user, status=Session.Status.RUNNING)
+
+    with CancellationListener(session.pk) as cancellation:
+        response = client.post(reverse('cancel-batch-run', kwargs={'session_pk': session.pk}))
+        assert response.status_code == 302
+
+        assert cancellation.wait(timeout=5)
+
+    session.refresh_from_db()
+    assert session.status == Session.Status.CANCELLED
+
+
+def test_session_progress_is_aggregated():
+    session_pk = uuid4()
+    reset_session_progress(session_pk)
+
+    assert add_session_progress(session_pk, 2) == 2
+    assert add_session_progress(session_pk, 3) == 5
+
+    reset_session_progress(session_pk)
+    assert add_session_progress(session_pk, 1) == 1
+
+
+def test_shard_progress_is_recorded_once():
+    session_pk = uuid4()
+    reset_session_progress(session_pk)
+
+    assert set_shard_progress(session_pk, 0, 2, counter='fov_resampled') == 2
+    assert set_shard_progress(session_pk, 1, 3, counter='fov_resampled') == 5
+    # A redelivered shard records the same count again
+    assert set_shard_progress(session_pk, 0, 2, counter='fov_resampled') == 5
+    # Counters are summed separately, including those of `add_session_progress`
+    assert set_shard_progress(session_pk, 0, 1, counter='fov_rejected') == 1
+    assert add_session_progress(session_pk, 4, counter='fov') == 4
+    assert set_shard_progress(session_pk, 1, 0, counter='fov_resampled') == 2
+
+
+@pytest.fixture
+def pose_preview_queue(monkeypatch: pytest.MonkeyPatch) -> str:
+    # Give each test its own queue, and no preview worker to begin with
+    queue_key = f'xray_genius:test:{uuid4()}:requests'
+    monkeypatch.setattr(coordination, '_POSE_PREVIEW_QUEUE_KEY', queue_key)
+    monkeypatch.setattr(coordination, '_POSE_PREVIEW_WORKER_KEY', f'xray_genius:test:{uuid4()}')
+    return queue_key
+
+
+@pytest.mark.usefixtures('pose_preview_queue')
+def test_pose_preview_round_trip():
+    session_pk = uuid4()
+    requests = []
+
+    def serve() -> None:
+        request = next_pose_preview_request(timeout=5)
+        requests.append(request)
+        send_pose_preview(request, b'png')
+
+    signal_pose_preview_worker_alive()
+    worker = threading.Thread(target=serve)
+    worker.start()
+    png = request_pose_preview(session_pk, [1, 2, 3, 4, 5], timeout=5, max_queued=1)
+    worker.join()
+
+    assert png == b'png'
+    [request] = requests
+    assert (request.session_pk, request.pose) == (str(session_pk), [1, 2, 3, 4, 5])
+    assert not request.expired
+
+
+@pytest.mark.usefixtures('pose_preview_queue')
+def test_pose_preview_failed():
+    signal_pose_preview_worker_alive()
+    worker = threading.Thread(
+        target=lambda: send_pose_preview(next_pose_preview_request(timeout=5), b'')
+    )
+    worker.start()
+    png = request_pose_preview(uuid4(), [0, 0, 0, 0, 0], timeout=5, max_queued=1)
+    worker.join()
+
+    assert png is None
+
+
+def test_pose_preview_unavailable(pose_preview_queue: str):
+    client = get_redis()
+    # Without a preview worker
+    start = time.monotonic()
+    assert request_pose_preview(uuid4(), [0, 0, 0, 0, 0], timeout=5, max_queued=1) is None
+    assert time.monotonic() - start < 1
+    assert client.llen(pose_preview_queue) == 0
+
+    # With a busy preview worker
+    signal_pose_preview_worker_alive()
+    queued = threading.Thread(
+        target=lambda: request_pose_preview(uuid4(), [0, 0, 0, 0, 0], timeout=2, max_queued=1)
+    )
+    queued.start()
+    while not client.llen(pose_preview_queue):
+        time.sleep(0.01)
+    # The queue goes away once its requests have expired
+    assert 0 < client.ttl(pose_preview_queue) <= 2
+    start = time.monotonic()
+    assert request_pose_preview(uuid4(), [0, 0, 0, 0, 0], timeout=5, max_queued=1) is None
+    assert time.monotonic() - start < 1
+    queued.join()
+
+
+def test_shard_claim():
+    session_pk = uuid4()
+    claim = ShardClaim(session_pk, run=1, shard=0)
+
+    assert claim.acquire('task-1')
+    # Only one task may render the shard
+    assert not ShardClaim(session_pk, run=1, shard=0).acquire('task-2')
+    # The same task, redelivered after its worker died, takes its claim over
+    redelivered = ShardClaim(session_pk, run=1, shard=0)
+    assert redelivered.acquire('task-1')
+    # If the original task is still alive, it finds out it lost the claim
+    assert not claim.refresh()
+    assert not claim.release()
+    assert not claim.complete({'created': 1})
+    assert redelivered.refresh()
+    assert redelivered.release()
+    assert ShardClaim(session_pk, run=1, shard=0).result() is None
+    assert claim.acquire('task-1')
+    # Other shards, and other runs of the session, are claimed separately
+    assert ShardClaim(session_pk, run=1, shard=1).acquire('task-2')
+    assert ShardClaim(session_pk, run=2, shard=0).acquire('task-2')
+
+    claim.release()
+    assert claim.result() is None
+    assert claim.acquire('task-2')
+
+    claim.complete({'created': 3})
+    assert ShardClaim(session_pk, run=1, shard=0).result() == {'created': 3}
+
+
+def test_shard_claim_keep_alive(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(coordination, 'SHARD_CLAIM_TTL', timedelta(seconds=1))
+    claim = ShardClaim(uuid4(), run=1, shard=0)
+    assert claim.acquire('task-1')
+
+    # The claim outlives its TTL, e.g. while a large volume loads
+    with claim.keep_alive():
+        time.sleep(1.5)
+        assert not claim.acquire('task-2')
+
+    time.sleep(1.5)
+    assert claim.acquire('task-2')
+
+
+def test_pending_shards():
+    context = uuid4().hex
+    shards = [PendingShard(str(uuid4()), 1, shard, [[shard]]) for shard in range(2)]
+
+    add_pending_shards(context, shards)
+
+    assert pop_pending_shard(context) == shards[0]
+    assert pop_pending_shard(context) == shards[1]
+    assert pop_pending_shard(context) is None
+    assert pop_pending_shard(uuid4().hex) is None
@@ -0,0 +1,30 @@
+import pytest
+
+from xray_genius.core import tasks
+from xray_genius.core.models import CTInputFile
+
+
+@pytest.mark.django_db
+def test_ct_input_file_creation_queues_preprocessing(
+    ct_input_file_factory, django_capture_on_commit_callbacks, mocker
+):
+    apply_async = mocker.patch.object(tasks.preprocess_ct_input_file_task, 'apply_async')
+
+    with django_capture_on_commit_callbacks(execute=True):
+        ct_input_file = ct_input_file_factory()
+    ct_input_file.save()
+
+    apply_async.assert_called_once_with((ct_input_file.pk,), queue='celery')
+
+
+@pytest.mark.django_db
+def test_preprocessing_reuses_artifact_of_same_file(ct_input_file_factory, mocker):
+    write_render_artifact = mocker.patch.object(tasks, 'write_render_artifact')
+    preprocessed = ct_input_file_factory(render_artifact='ct_render_artifacts/sample.tar')
+    ct_input_file = CTInputFile.objects.create(file=preprocessed.file.name)
+
+    tasks.preprocess_ct_input_file_task(ct_input_file.pk)
+
+    ct_input_file.refresh_from_db()
+    assert ct_input_file.render_artifact.name == 'ct_render_artifacts/sample.tar'
+    write_render_artifact.assert_not_called()
@@ -0,0 +1,207 @@
+from datetime import timedelta
+from io import BytesIO
+import json
+import tarfile
+
+from django.core.files.storage import InMemoryStorage
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+import pytest
+
+from xray_genius.core import tasks
+from xray_genius.core.models import DatasetExport, DatasetExportShard, OutputImage, Session
+from xray_genius.core.render.outputs import store_output_file
+
+
+@pytest.fixture
+def storage(monkeypatch: pytest.MonkeyPatch) -> InMemoryStorage:
+    storage = InMemoryStorage()
+    for field in ('image', 'thumbnail', 'raw_image'):
+        monkeypatch.setattr(OutputImage._meta.get_field(field), 'storage', storage)
+    monkeypatch.setattr(DatasetExportShard._meta.get_field('file'), 'storage', storage)
+    return storage
+
+
+def _output_image(session: Session, index: int) -> OutputImage:
+    return OutputImage.objects.create(
+        session=session,
+        index=index,
+        image=store_output_file('image', f'{index}.png', BytesIO(b'png %d' % index)),
+        raw_image=store_output_file('raw_image', f'{index}.npy.zst', BytesIO(b'npy %d' % index)),
+        carm_push_pull=0.0,
+        carm_head_foot_translation=0.0,
+        carm_raise_lower=0.0,
+        carm_alpha=float(index),
+        carm_beta=0.0,
+    )
+
+
+def _read_shard(shard: DatasetExportShard) -> list[tuple[str, bytes]]:
+    with shard.file.open('rb') as f, tarfile.open(fileobj=BytesIO(f.read())) as tar:
+        return [(member.name, tar.extractfile(member).read()) for member in tar]
+
+
+@pytest.mark.django_db
+def test_export_dataset_task(storage, user, session_factory):
+    sessions = [session_factory(owner=user, status=Session.Status.PROCESSED) for _ in range(2)]
+    # Saved out of order, as parallel shards would
+    for session in sessions:
+        for index in (1, 0):
+            _output_image(session, index)
+    export = DatasetExport.objects.create(
+        owner=user, session_ids=[str(session.pk) for session in sessions], samples_per_shard=3
+    )
+
+    tasks.export_dataset_task(export.pk)
+
+    export.refresh_from_db()
+    assert export.status == DatasetExport.Status.FINISHED
+    shards = list(export.shards.order_by('index'))
+    assert [shard.num_samples for shard in shards] == [3, 1]
+
+    # The files of each sample are adjacent, in the order of the sessions and their poses
+    [first_shard, _] = shards
+    entries = _read_shard(first_shard)
+    first = OutputImage.objects.get(session=sessions[0], index=0)
+    assert [name for name, _ in entries[:3]] == [
+        f'{sessions[0].pk}_{first.pk}.png',
+        f'{sessions[0].pk}_{first.pk}.npy.zst',
+        f'{sessions[0].pk}_{first.pk}.json',
+    ]
+    assert entries[0][1] == b'png 0'
+    assert json.loads(entries[2][1]) == {
+        'session': str(sessions[0].pk),
+        'index': 0,
+        'carm_push_pull': 0.0,
+        'carm_head_foot_translation': 0.0,
+        'carm_raise_lower': 0.0,
+        'carm_alpha': 0.0,
+        'carm_beta': 0.0,
+    }
+    assert [json.loads(content)['index'] for name, content in entries if name.endswith('json')] == [
+        0,
+        1,
+        0,
+    ]
+
+
+@pytest.mark.django_db
+def test_export_dataset_task_resumes(storage, user, session_factory, mocker):
+    session = session_factory(owner=user, status=Session.Status.PROCESSED)
+    for index in range(5):
+        _output_image(session, index)
+    export = DatasetExport.objects.create(
+        owner=user, session_ids=[str(session.pk)], samples_per_shard=2
+    )
+
+    # Fail while exporting the second shard
+    write_tar_shard = tasks.write_tar_shard
+    calls = 0
+
+    def fail_second(*args):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            raise OSError('disk full')
+        return write_tar_shard(*args)
+
+    mocker.patch.object(tasks, 'write_tar_shard', side_effect=fail_second)
+    with pytest.raises(OSError, match='disk full'):
+        tasks.export_dataset_task(export.pk)
+    export.refresh_from_db()
+    assert export.status == DatasetExport.Status.FAILED
+    [first_shard] = export.shards.all()
+
+    tasks.export_dataset_task(export.pk)
+
+    export.refresh_from_db()
+    assert export.status == DatasetExport.Status.FINISHED
+    assert list(export.shards.order_by('index').values_list('index', 'num_samples')) == [
+        (0, 2),
+        (1, 2),
+        (2, 1),
+    ]
+    # The stored shard was kept as is
+    assert export.shards.get(index=0).pk == first_shard.pk
+    assert len(_read_shard(export.shards.get(index=1))) == 6
+
+
+@pytest.mark.django_db
+def test_export_dataset_task_deleted_session(storage, user, session_factory):
+    sessions = [session_factory(owner=user, status=Session.Status.PROCESSED) for _ in range(2)]
+    for session in sessions:
+        _output_image(session, 0)
+    export = DatasetExport.objects.create(
+        owner=user, session_ids=[str(session.pk) for session in sessions], samples_per_shard=1
+    )
+    sessions[0].delete()
+
+    tasks.export_dataset_task(export.pk)
+
+    # Otherwise, the samples of the second session would be in the shard of the first one
+    export.refresh_from_db()
+    assert export.status == DatasetExport.Status.FAILED
+    assert not export.shards.exists()
+
+
+@pytest.mark.django_db
+def test_create_dataset_export(
+    *,
+    user,
+    user_factory,
+    session_factory,
+    client: Client,
+    mocker,
+    django_capture_on_commit_callbacks,
+):
+    client.force_login(user)
+    export_dataset_task = mocker.patch.object(tasks.export_dataset_task, 'delay')
+    owned = session_factory(owner=user, status=Session.Status.PROCESSED)
+    unprocessed = session_factory(owner=user, status=Session.Status.RUNNING)
+    not_owned = session_factory(owner=user_factory(), status=Session.Status.PROCESSED)
+    url = reverse('api-0.1.0:create_dataset_export')
+
+    for session in (unprocessed, not_owned):
+        response = client.post(
+            url, {'sessions': [str(owned.pk), str(session.pk)]}, content_type='application/json'
+        )
+        assert response.status_code == 400
+    assert not DatasetExport.objects.exists()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(
+            url,
+            {'sessions': [str(owned.pk)], 'samples_per_shard': 10},
+            content_type='application/json',
+        )
+    assert response.status_code == 200
+    export = DatasetExport.objects.get()
+    assert response.json() == {
+        'id': export.pk,
+        'status': 'queued',
+        'samples_per_shard': 10,
+        'shards': [],
+    }
+    assert export.session_ids == [str(owned.pk)]
+    export_dataset_task.assert_called_once_with(export.pk)
+
+    # Only failed exports, or running ones which stopped making progress, are resumed
+    resume_url = reverse('api-0.1.0:resume_dataset_export', kwargs={'export_pk': export.pk})
+    assert client.post(resume_url).status_code == 400
+    DatasetExport.objects.filter(pk=export.pk).update(
+        status=DatasetExport.Status.RUNNING, progressed=timezone.now()
+    )
+    assert client.post(resume_url).status_code == 400
+    for status, progressed in (
+        (DatasetExport.Status.FAILED, timezone.now()),
+        (DatasetExport.Status.RUNNING, timezone.now() - timedelta(hours=1)),
+    ):
+        DatasetExport.objects.filter(pk=export.pk).update(status=status, progressed=progressed)
+        with django_capture_on_commit_callbacks(execute=True):
+            assert client.post(resume_url).status_code == 200
+    assert export_dataset_task.call_count == 3
+
+    client.force_login(user_factory())
+    get_url = reverse('api-0.1.0:get_dataset_export', kwargs={'export_pk': export.pk})
+    assert client.get(get_url).status_code == 404
@@ -0,0 +1,318 @@
+from types import SimpleNamespace
+
+from django.core.files.storage import InMemoryStorage
+import numpy as np
+import pytest
+
+from xray_genius.core import tasks
+from xray_genius.core.coordination import add_session_progress, pop_pending_shard
+from xray_genius.core.models import InputParameters, OutputImage, Session
+from xray_genius.core.render import backends
+from xray_genius.core.render.geometry import CArmGeometry
+from xray_genius.core.render.projectors import ProjectorKey, ProjectorPool
+from xray_genius.core.render.stack import POSE_COLUMNS, decode_raw_image
+from xray_genius.core.utils import ParameterSampler
+
+
+@pytest.mark.django_db
+def test_start_deepdrr_run_shards_poses(session_factory, settings, mocker):
+    settings.RENDER_SHARD_SIZE = 2
+    chord = mocker.patch.object(tasks, 'chord')
+    session: Session = session_factory(
+        status=Session.Status.QUEUED,
+        parameters__num_samples=5,
+        parameters__carm_push_pull_std_dev=10.0,
+    )
+
+    tasks.start_deepdrr_run(session)
+
+    header = list(chord.call_args.args[0])
+    shards = [signature.args for signature in header]
+    assert [len(index_groups) for _, index_groups in shards] == [2, 2, 1]
+    indices = [i for _, index_groups in shards for group in index_groups for i in group]
+    assert sorted(indices) == list(range(5))
+    assert {session_pk for session_pk, _ in shards} == {str(session.pk)}
+    assert [signature.kwargs['shard'] for signature in header] == [0, 1, 2]
+    callback = chord.return_value.call_args.args[0]
+    assert callback.task == tasks.finish_deepdrr_run_task.name
+    assert callback.args == (str(session.pk),)
+    # If a shard fails, the parts stored by the others are deleted
+    [errback] = callback.options['link_error']
+    assert errback.task == tasks.fail_deepdrr_run_task.name
+    assert errback.args == (str(session.pk), Session.objects.get(pk=session.pk).sampler_seed, 3)
+
+
+@pytest.mark.django_db
+def test_start_deepdrr_run_groups_identical_poses(session_factory, settings, mocker):
+    settings.RENDER_SHARD_SIZE = 2
+    chord = mocker.patch.object(tasks, 'chord')
+    # Nothing is randomized, so every pose is the same
+    session: Session = session_factory(status=Session.Status.QUEUED, parameters__num_samples=5)
+
+    tasks.start_deepdrr_run(session)
+
+    [header] = chord.call_args.args
+    [(_, [group])] = [signature.args for signature in header]
+    assert group == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.django_db
+def test_start_deepdrr_run_saves_sampler_seed(session_factory, mocker):
+    mocker.patch.object(tasks, 'chord')
+    session: Session = session_factory(
+        status=Session.Status.QUEUED,
+        parameters__num_samples=5,
+        parameters__carm_push_pull_std_dev=10.0,
+        parameters__carm_alpha_kappa=5.0,
+    )
+
+    tasks.start_deepdrr_run(session)
+    poses = ParameterSampler(session.parameters, seed=session.sampler_seed).sample()
+
+    # A shard samples the same poses from the saved seed
+    session = Session.objects.get(pk=session.pk)
+    assert session.sampler_seed is not None
+    assert (ParameterSampler(session.parameters, seed=session.sampler_seed).sample() == poses).all()
+
+
+@pytest.mark.django_db
+def test_start_deepdrr_run_preview(session_factory, settings, mocker):
+    settings.PREVIEW_NUM_SAMPLES = 3
+    settings.RENDER_SHARD_SIZE = 0
+    chord = mocker.patch.object(tasks, 'chord')
+    session: Session = session_factory(
+        status=Session.Status.QUEUED,
+        parameters__num_samples=50,
+        parameters__carm_push_pull_std_dev=10.0,
+    )
+
+    tasks.start_deepdrr_run(session, preview=True)
+
+    [header] = chord.call_args.args
+    [(_, index_groups)] = [signature.args for signature in header]
+    assert sorted(i for group in index_groups for i in group) == [0, 1, 2]
+    session = Session.objects.get(pk=session.pk)
+    assert session.preview
+    # Shards sample the same few poses
+    assert tasks._run_sampler(session, seed=session.sampler_seed).samples == 3
+
+
+@pytest.mark.django_db
+def test_start_deepdrr_run_announces_shards(session_factory, settings, mocker):
+    settings.RENDER_SHARD_SIZE = 2
+    mocker.patch.object(tasks, 'chord')
+    sample_file = session_factory().input_scan.file.name
+    sessions: list[Session] = [
+        session_factory(
+            status=Session.Status.QUEUED,
+            input_scan__file__from_path=None,
+            parameters__num_samples=3,
+            parameters__carm_push_pull_std_dev=10.0,
+            parameters__source_to_detector_distance=1000,
+        )
+        for _ in range(2)
+    ]
+    # Both sessions were started from the same sample dataset
+    for session in sessions:
+        session.input_scan.file.name = sample_file
+        session.input_scan.save()
+
+    for session in sessions:
+        tasks.start_deepdrr_run(session)
+
+    context = tasks._render_context(sessions[0])
+    assert context == tasks._render_context(sessions[1])
+    pending = []
+    while (shard := pop_pending_shard(context)) is not None:
+        pending.append(shard)
+    assert [(shard.session_pk, shard.shard) for shard in pending] == [
+        (str(session.pk), shard) for session in sessions for shard in range(2)
+    ]
+    assert pending[0].run == Session.objects.get(pk=sessions[0].pk).sampler_seed
+
+
+@pytest.mark.django_db
+def test_pending_renders(session_factory, output_image_factory):
+    session: Session = session_factory(status=Session.Status.RUNNING)
+    # The shard was interrupted after saving some of its images
+    output_image_factory(session=session, index=0)
+    output_image_factory(session=session, index=3)
+    output_image_factory(session=session_factory(), index=1)
+    poses = np.arange(4 * 5).reshape(4, 5)
+
+    renders = tasks._pending_renders(
+        session, [(poses[0], [0]), (poses[1], [1, 2]), (poses[2], [3, 4]), (poses[3], [5])]
+    )
+
+    assert [group for _, group in renders] == [[1, 2], [4], [5]]
+    assert (np.array([pose for pose, _ in renders]) == poses[1:]).all()
+    assert tasks._pending_renders(session, [(poses[0], [0, 3])]) == []
+
+
+@pytest.mark.parametrize(
+    ('parameters', 'replaced'),
+    [
+        (InputParameters(num_samples=10, carm_alpha_kappa=5), True),
+        # Every replacement of a fixed pose would be the very same pose
+        (InputParameters(num_samples=10), False),
+    ],
+)
+def test_low_information_replacement(*, parameters: InputParameters, replaced: bool):
+    sampler = ParameterSampler(parameters, seed=0)
+    [pose, *_] = sampler.sample()
+
+    replacement = tasks._low_information_replacement(
+        sampler,
+        0,
+        0,
+        pose=pose,
+        geometry=CArmGeometry(source_to_detector_distance=1000, pixel_size=1, sensor_size=8),
+        corners=np.zeros((8, 3)),
+        min_coverage=0,
+    )
+
+    if replaced:
+        new_pose, next_attempt = replacement
+        assert not np.array_equal(new_pose, pose)
+        assert next_attempt == 1
+    else:
+        assert replacement is None
+
+
+@pytest.mark.django_db
+def test_finish_deepdrr_run(session_factory, mocker):
+    zip_images_task = mocker.patch.object(tasks.zip_images_task, 'delay')
+    stack_images_task = mocker.patch.object(tasks.stack_images_task, 'delay')
+    session: Session = session_factory(status=Session.Status.RUNNING)
+
+    tasks.finish_deepdrr_run_task(
+        [
+            {'created': 3, 'resampled': 1, 'rejected': 0, 'replaced': 2},
+            {'created': 1, 'resampled': 2, 'rejected': 1, 'replaced': 0},
+        ],
+        str(session.pk),
+    )
+
+    session.refresh_from_db()
+    assert session.status == Session.Status.PROCESSED
+    assert (session.fov_resampled_poses, session.fov_rejected_poses) == (3, 1)
+    assert session.low_information_frames == 2
+    zip_images_task.assert_called_once_with(str(session.pk))
+    stack_images_task.assert_called_once_with(str(session.pk))
+
+
+@pytest.mark.django_db
+def test_finish_deepdrr_run_cancelled(session_factory, output_image_factory, mocker):
+    zip_images_task = mocker.patch.object(tasks.zip_images_task, 'delay')
+    stack_images_task = mocker.patch.object(tasks.stack_images_task, 'delay')
+    session: Session = session_factory(status=Session.Status.CANCELLED)
+    output_image_factory(session=session)
+
+    tasks.finish_deepdrr_run_task(
+        [
+            {'created': 1, 'resampled': 0, 'rejected': 0, 'replaced': 0},
+            {'created': 0, 'resampled': 0, 'rejected': 0, 'replaced': 0},
+        ],
+        str(session.pk),
+    )
+
+    session.refresh_from_db()
+    assert session.status == Session.Status.NOT_STARTED
+    assert not OutputImage.objects.filter(session=session).exists()
+    zip_images_task.assert_not_called()
+    stack_images_task.assert_not_called()
+
+
+@pytest.fixture
+def synthetic_volume():
+    # An 80mm cube of bone, centered at the isocenter, with the parts of a `Volume` renders use
+    data = np.full((20, 20, 20), 1.9, dtype=np.float32)
+    world_from_ijk = np.diag([4.0, 4.0, 4.0, 1.0])
+    world_from_ijk[:3, 3] = -4.0 * (np.array(data.shape) - 1) / 2
+    return SimpleNamespace(
+        data=data,
+        shape=data.shape,
+        materials={'bone': np.ones(data.shape, dtype=bool)},
+        world_from_ijk=SimpleNamespace(data=world_from_ijk),
+    )
+
+
+@pytest.mark.django_db
+def test_run_deepdrr_task_numpy_backend(
+    *, session_factory, synthetic_volume, settings, mocker, monkeypatch: pytest.MonkeyPatch
+):
+    settings.RENDER_SHARD_SIZE = 2
+    storage = InMemoryStorage()
+    for field in ('image', 'thumbnail', 'raw_image'):
+        monkeypatch.setattr(OutputImage._meta.get_field(field), 'storage', storage)
+    for field in ('output_images_zip', 'output_images_stack', 'output_images_poses'):
+        monkeypatch.setattr(Session._meta.get_field(field), 'storage', storage)
+    # deepdrr's spectra and attenuation tables aren't installed everywhere; a single energy
+    # is enough to render with
+    monkeypatch.setattr(
+        backends,
+        'spectral_attenuation',
+        lambda materials: (np.array([60.0]), np.array([1.0]), np.full((1, len(materials)), 0.3)),
+    )
+    pool = ProjectorPool(max_bytes=0, backend='numpy')
+    mocker.patch.object(
+        tasks,
+        'acquire_projector',
+        lambda _, geometry: pool.acquire(
+            ProjectorKey('synthetic', geometry), lambda: synthetic_volume
+        ),
+    )
+    send_message = mocker.spy(tasks.TaskTracker, 'send_message')
+    chord = mocker.patch.object(tasks, 'chord')
+    zip_images_task = mocker.patch.object(tasks.zip_images_task, 'delay')
+    stack_images_task = mocker.patch.object(tasks.stack_images_task, 'delay')
+    session: Session = session_factory(
+        status=Session.Status.QUEUED,
+        parameters__num_samples=3,
+        parameters__carm_alpha=0,
+        parameters__carm_beta=0,
+        parameters__carm_alpha_kappa=5.0,
+        parameters__source_to_detector_distance=1000,
+        parameters__detector_resolution=16,
+        parameters__output_format=InputParameters.OutputFormat.NPY,
+    )
+
+    tasks.start_deepdrr_run(session)
+    [header] = chord.call_args.args
+    results = [
+        tasks.run_deepdrr_task.apply(signature.args, signature.kwargs).get() for signature in header
+    ]
+    callback = chord.return_value.call_args.args[0]
+    callback.apply((results,)).get()
+
+    # Every pose was rendered, and stored as rendered from it
+    session.refresh_from_db()
+    assert session.status == Session.Status.PROCESSED
+    output_images = list(session.output_images.order_by('index'))
+    assert [output_image.index for output_image in output_images] == [0, 1, 2]
+    geometry = CArmGeometry.from_parameters(session.parameters)
+    backend = backends.create_backend('numpy', synthetic_volume, geometry)
+    backend.initialize()
+    for output_image in output_images:
+        [camera3d_from_world] = geometry.frames(
+            np.array([[getattr(output_image, field) for field in POSE_COLUMNS[1:]]])
+        ).camera3d_from_world
+        image = decode_raw_image(output_image.read_file('raw_image'))
+        np.testing.assert_array_equal(image, backend.render(camera3d_from_world))
+        # The cube is in the middle of the image
+        assert image[8, 8] > image[0, 0]
+        assert output_image.has_file('thumbnail')
+    backend.free()
+
+    # Progress was reported up to every image of the session
+    assert add_session_progress(session.pk, 0) == 3
+    assert max(call.args[1].progress for call in send_message.call_args_list) == 1
+
+    # The shards' stacks were merged, and their zips are merged next
+    assert len(results) == 2
+    zip_images_task.assert_called_once_with(
+        str(session.pk), [result['archive'] for result in results]
+    )
+    stack_images_task.assert_not_called()
+    with session.output_images_stack.open('rb') as f:
+        assert np.load(f).shape == (3, 16, 16)
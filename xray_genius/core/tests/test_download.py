@@ -0,0 +1,74 @@
+import hashlib
+import os
+from pathlib import Path
+import threading
+
+from django.core.files import File
+import pytest
+
+from xray_genius.core.render.download import download_file
+
+FILE_SIZE = 96 * 1024**2
+CHUNK_SIZE = 1024**2
+
+pytestmark = pytest.mark.skipif(
+    not Path('/proc/self/statm').exists(), reason='RSS is measured through procfs'
+)
+
+
+def _rss() -> int:
+    return int(Path('/proc/self/statm').read_text().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class PeakRss:
+    """Sample the RSS of this process in the background, keeping track of its peak."""
+
+    def __enter__(self):
+        self.baseline = self.peak = _rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(0.002):
+            self.peak = max(self.peak, _rss())
+
+    @property
+    def increase(self) -> int:
+        return self.peak - self.baseline
+
+
+@pytest.fixture
+def large_input_file(ct_input_file_factory, tmp_path):
+    # Written and uploaded in chunks, so that only the download itself affects the RSS
+    source = tmp_path / 'source.nii'
+    digest = hashlib.sha256()
+    with source.open('wb') as f:
+        for _ in range(FILE_SIZE // CHUNK_SIZE):
+            chunk = os.urandom(CHUNK_SIZE)
+            digest.update(chunk)
+            f.write(chunk)
+    with source.open('rb') as f:
+        ct_input_file = ct_input_file_factory(file=File(f, name='large.nii'))
+    source.unlink()
+    return ct_input_file, digest.hexdigest()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('connections', [1, 4])
+def test_download_file_bounded_memory(large_input_file, tmp_path, connections):
+    ct_input_file, expected_digest = large_input_file
+    dest = tmp_path / 'dest.nii'
+
+    with PeakRss() as rss:
+        download_file(ct_input_file.file, dest, chunk_size=CHUNK_SIZE, connections=connections)
+
+    assert dest.stat().st_size == FILE_SIZE
+    assert hashlib.sha256(dest.read_bytes()).hexdigest() == expected_digest
+    # Far less than the file itself, which used to be read into memory all at once
+    assert rss.increase < FILE_SIZE // 4
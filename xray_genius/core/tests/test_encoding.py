@@ -0,0 +1,132 @@
+from io import BytesIO
+import tempfile
+
+from django.core.files.storage import InMemoryStorage
+import numpy as np
+from PIL import Image
+import pytest
+
+from xray_genius.core import tasks
+from xray_genius.core.coordination import CancellationListener
+from xray_genius.core.models import InputParameters, OutputImage
+from xray_genius.core.render.encoding import encode_frame
+
+png = pytest.importorskip('png')
+
+
+@pytest.fixture
+def temp_file_counter(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    """Count every temporary file or directory created through the `tempfile` module."""
+    calls = []
+    for name in (
+        'mkstemp',
+        'mkdtemp',
+        'NamedTemporaryFile',
+        'TemporaryFile',
+        'SpooledTemporaryFile',
+        'TemporaryDirectory',
+    ):
+        original = getattr(tempfile, name)
+
+        def counted(*args, _original=original, _name=name, **kwargs):
+            calls.append(_name)
+            return _original(*args, **kwargs)
+
+        monkeypatch.setattr(tempfile, name, counted)
+        monkeypatch.setattr(tasks, name, counted, raising=False)
+    # Anything which bypasses the above still has to land in the temp dir
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    return calls
+
+
+def test_encode_frame_round_trip():
+    image = np.linspace(0, 1, 128 * 96, dtype=np.float32).reshape(128, 96)
+
+    encoded = encode_frame(image)
+
+    width, height, rows, info = png.Reader(file=encoded.image).read()
+    assert (width, height) == (96, 128)
+    assert info['bitdepth'] == 16
+    np.testing.assert_array_equal(
+        np.vstack(list(rows)), np.clip(image * 0xFFFF, 0, 0xFFFF).astype(np.uint16)
+    )
+
+    thumbnail = Image.open(encoded.thumbnail)
+    assert max(thumbnail.size) == 64
+
+
+def test_encode_frame_reuses_buffers():
+    first = encode_frame(np.ones((256, 256), dtype=np.float32))
+    first_image_buffer = first.image
+    # A smaller image must not leave trailing bytes from the previous, larger one
+    second = encode_frame(np.zeros((16, 16), dtype=np.float32))
+
+    assert second.image is first_image_buffer
+    width, height, _, _ = png.Reader(file=second.image).read()
+    assert (width, height) == (16, 16)
+
+
+def test_encode_frame_npy(tmp_path):
+    image = np.random.default_rng(0).random((128, 96), dtype=np.float32)
+
+    encoded = encode_frame(image, png=False, npy=True)
+
+    assert encoded.image is None
+    path = tmp_path / 'image.npy'
+    path.write_bytes(encoded.raw.getvalue())
+    # Raw images are memory-mapped as they are, without any decoding
+    loaded = np.load(path, mmap_mode='r')
+    assert isinstance(loaded, np.memmap)
+    assert loaded.dtype == np.float32
+    np.testing.assert_array_equal(loaded, image)
+
+
+def test_encode_frame_npy_zstd():
+    zstandard = pytest.importorskip('zstandard')
+    image = np.zeros((256, 256), dtype=np.float32)
+    image[64:192, 64:192] = np.linspace(0, 1, 128 * 128, dtype=np.float32).reshape(128, 128)
+
+    encoded = encode_frame(image, npy=True, compress_npy=True)
+
+    raw = encoded.raw.getvalue()
+    assert len(raw) < image.nbytes
+    np.testing.assert_array_equal(
+        np.load(BytesIO(zstandard.ZstdDecompressor().decompress(raw))), image
+    )
+
+
+def test_encode_and_store_frame_creates_no_temp_files(
+    monkeypatch: pytest.MonkeyPatch, temp_file_counter, tmp_path
+):
+    storage = InMemoryStorage()
+    monkeypatch.setattr(OutputImage._meta.get_field('image'), 'storage', storage)
+    monkeypatch.setattr(OutputImage._meta.get_field('thumbnail'), 'storage', storage)
+    monkeypatch.setattr(OutputImage._meta.get_field('raw_image'), 'storage', storage)
+
+    rng = np.random.default_rng(0)
+    for _ in range(3):
+        [frame] = tasks._encode_and_store_frame(
+            rng.random((64, 64), dtype=np.float32),
+            [
+                {
+                    'carm_push_pull': 0.0,
+                    'carm_head_foot_translation': 0.0,
+                    'carm_raise_lower': 0.0,
+                    'carm_alpha': 0.0,
+                    'carm_beta': 0.0,
+                }
+            ],
+            parameters=InputParameters(output_format=InputParameters.OutputFormat.PNG_AND_NPY),
+            pack=False,
+            archive=False,
+            cancellation=CancellationListener('session'),
+        )
+        assert storage.exists(frame.image_name)
+        assert storage.exists(frame.thumbnail_name)
+        with storage.open(frame.image_name) as f:
+            assert png.Reader(file=BytesIO(f.read())).read()[:2] == (64, 64)
+        with storage.open(frame.raw_image_name) as f:
+            assert np.load(BytesIO(f.read())).shape == (64, 64)
+
+    assert temp_file_counter == []
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from xray_genius.core.render.fov import check_field_of_view, detector_coverage, volume_corners
+from xray_genius.core.render.geometry import CArmGeometry
+
+
+@pytest.fixture
+def geometry() -> CArmGeometry:
+    return CArmGeometry(source_to_detector_distance=1000, pixel_size=0.15, sensor_size=1536)
+
+
+@pytest.fixture
+def corners() -> np.ndarray:
+    # A 200mm cube of 1mm voxels, centered on the world's origin
+    world_from_ijk = np.eye(4)
+    world_from_ijk[:3, 3] = -99.5
+    return volume_corners((200, 200, 200), world_from_ijk)
+
+
+def test_volume_corners(corners):
+    assert corners.shape == (8, 3)
+    np.testing.assert_allclose(corners.min(axis=0), [-100, -100, -100])
+    np.testing.assert_allclose(corners.max(axis=0), [100, 100, 100])
+
+
+def test_detector_coverage(geometry, corners):
+    poses = np.array(
+        [
+            [0, 0, 0, 0, 0],
+            [0, 0, 0, 60, 30],
+            # Translated far past the volume along each axis
+            [1000, 0, 0, 0, 0],
+            [0, -1000, 0, 0, 0],
+        ]
+    )
+
+    coverage = detector_coverage(geometry, poses, corners)
+
+    # The volume is magnified 2.5 to 5 times onto the 230mm detector, so it covers all of it
+    np.testing.assert_allclose(coverage[:2], 1)
+    np.testing.assert_allclose(coverage[2:], 0)
+
+
+def test_detector_coverage_partial(geometry, corners):
+    # The volume's edge is at the isocenter, so it covers half of the detector
+    coverage = detector_coverage(geometry, np.array([[100, 0, 0, 0, 0]]), corners)
+
+    np.testing.assert_allclose(coverage, [0.5])
+
+
+def test_detector_coverage_source_inside_volume(geometry, corners):
+    # The source is 500mm below the isocenter, so it's inside the volume
+    coverage = detector_coverage(geometry, np.array([[0, 0, -450, 0, 0]]), corners)
+
+    np.testing.assert_allclose(coverage, [1])
+
+
+def test_check_field_of_view(geometry, corners):
+    poses = np.array(
+        [
+            [0, 0, 0, 0, 0],
+            [1000, 0, 0, 0, 0],
+            [1000, 0, 0, 0, 0],
+            [0, 1000, 0, 0, 0],
+        ],
+        dtype=np.float64,
+    )
+    attempts = []
+
+    def resample(index: int, attempt: int) -> np.ndarray:
+        attempts.append((index, attempt))
+        # Sample 1 is covered on its second attempt, and sample 3 never is
+        return poses[0] if (index, attempt) == (1, 1) else poses[3]
+
+    check = check_field_of_view(
+        poses,
+        [[0], [1, 2], [3]],
+        geometry=geometry,
+        corners=corners,
+        min_coverage=0.01,
+        max_resamples=3,
+        resample=resample,
+    )
+
+    assert [(pose.tolist(), group) for pose, group in check.renders] == [
+        ([0, 0, 0, 0, 0], [0]),
+        ([0, 0, 0, 0, 0], [1]),
+    ]
+    assert (check.resampled, check.rejected) == (1, 2)
+    assert sorted(attempts) == [(1, 0), (1, 1), (2, 0), (2, 1), (2, 2), (3, 0), (3, 1), (3, 2)]
+
+
+def test_check_field_of_view_disabled(geometry, corners):
+    poses = np.array([[1000, 0, 0, 0, 0]], dtype=np.float64)
+
+    check = check_field_of_view(
+        poses,
+        [[0]],
+        geometry=geometry,
+        corners=corners,
+        min_coverage=0,
+        max_resamples=3,
+        resample=lambda *_: poses[0],
+    )
+
+    assert [group for _, group in check.renders] == [[0]]
+    assert (check.resampled, check.rejected) == (0, 0)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from xray_genius.core.render.quality import FrameQualityThresholds, frame_statistics
+
+
+@pytest.fixture
+def thresholds() -> FrameQualityThresholds:
+    return FrameQualityThresholds(
+        min_foreground_fraction=0.05, min_dynamic_range=0.05, min_entropy=1
+    )
+
+
+def test_frame_statistics_blank():
+    # The projector maps an image which misses the volume entirely to 0
+    statistics = frame_statistics(np.zeros((256, 256), dtype=np.float32))
+
+    assert statistics.foreground_fraction == 0
+    assert statistics.dynamic_range == 0
+    assert statistics.entropy == 0
+
+
+def test_frame_statistics_gradient():
+    image = np.tile(np.linspace(0, 1, 256, dtype=np.float32), (256, 1))
+
+    statistics = frame_statistics(image)
+
+    assert statistics.foreground_fraction == pytest.approx(0.98, abs=0.02)
+    assert statistics.dynamic_range == pytest.approx(0.98, abs=0.02)
+    # The values are spread evenly across the 64 bins of the histogram
+    assert statistics.entropy == pytest.approx(5, abs=0.1)
+
+
+def test_is_low_information(thresholds):
+    rng = np.random.default_rng(0)
+    image = np.zeros((256, 256), dtype=np.float32)
+    # The volume is barely in view, in a corner of the detector
+    image[:24, :24] = rng.uniform(0.2, 1, (24, 24))
+
+    assert thresholds.is_low_information(frame_statistics(image))
+
+    image[:128, :128] = rng.uniform(0.2, 1, (128, 128))
+    assert not thresholds.is_low_information(frame_statistics(image))
+
+
+def test_thresholds_disabled():
+    thresholds = FrameQualityThresholds()
+
+    assert not thresholds.enabled
+    assert not thresholds.is_low_information(frame_statistics(np.zeros((64, 64))))
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from xray_genius.core.render.geometry import CArmGeometry, pose_isocenters
+
+
+@pytest.fixture
+def poses() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return np.column_stack([rng.normal(0, 30, (50, 3)), rng.uniform(-180, 180, (50, 2))])
+
+
+@pytest.fixture
+def geometry() -> CArmGeometry:
+    return CArmGeometry(source_to_detector_distance=1000, pixel_size=0.15, sensor_size=1536)
+
+
+def _project(projections: np.ndarray, points: np.ndarray) -> np.ndarray:
+    homogeneous = np.einsum(
+        'nij,nj->ni', projections, np.column_stack([points, np.ones(len(points))])
+    )
+    return homogeneous[:, :2] / homogeneous[:, 2:]
+
+
+def test_frames_default_pose(geometry):
+    frames = geometry.frames(np.zeros((1, 5)))
+
+    # The source is below the isocenter, and the detector above it
+    np.testing.assert_allclose(frames.sources, [[0, 0, -500]], atol=1e-9)
+    np.testing.assert_allclose(frames.detector_centers, [[0, 0, 500]], atol=1e-9)
+    np.testing.assert_allclose(_project(frames.projections, np.zeros((1, 3))), [[768, 768]])
+
+
+def test_frames_shapes(geometry, poses):
+    frames = geometry.frames(poses)
+
+    assert len(frames) == 50
+    assert frames.camera3d_from_world.shape == (50, 4, 4)
+    assert frames.projections.shape == (50, 3, 4)
+    assert frames.sources.shape == frames.detector_centers.shape == (50, 3)
+
+
+def test_frames_geometry(geometry, poses):
+    frames = geometry.frames(poses)
+    isocenters = pose_isocenters(poses)
+
+    # Rotations are rigid
+    rotations = frames.camera3d_from_world[:, :3, :3]
+    np.testing.assert_allclose(
+        rotations @ rotations.transpose(0, 2, 1), np.broadcast_to(np.eye(3), (50, 3, 3)), atol=1e-9
+    )
+    # The isocenter is on the principal ray, halfway between the source and the detector
+    np.testing.assert_allclose(
+        (frames.sources + frames.detector_centers) / 2, isocenters, atol=1e-9
+    )
+    np.testing.assert_allclose(
+        np.linalg.norm(frames.detector_centers - frames.sources, axis=1), 1000
+    )
+    np.testing.assert_allclose(_project(frames.projections, isocenters), np.full((50, 2), 768.0))
+
+
+def test_frames_match_mobile_carm(geometry, poses):
+    deepdrr = pytest.importorskip('deepdrr')
+
+    carm = deepdrr.MobileCArm(
+        source_to_detector_distance=geometry.source_to_detector_distance,
+        source_to_isocenter_vertical_distance=geometry.source_to_isocenter_distance,
+        sensor_height=geometry.sensor_size,
+        sensor_width=geometry.sensor_size,
+        pixel_size=geometry.pixel_size,
+        min_alpha=-180,
+        max_alpha=180,
+        min_beta=-180,
+        max_beta=180,
+    )
+    frames = geometry.frames(poses)
+
+    for i, (push_pull, head_foot, raise_lower, alpha, beta) in enumerate(poses):
+        carm.move_to(
+            alpha=alpha,
+            beta=beta,
+            degrees=True,
+            isocenter=deepdrr.geo.p(-head_foot, push_pull, -raise_lower),
+        )
+        projection = carm.get_camera_projection()
+        np.testing.assert_allclose(
+            frames.camera3d_from_world[i], projection.extrinsic.data, rtol=1e-5, atol=1e-3
+        )
+        # The intrinsics of deepdrr are single precision
+        np.testing.assert_allclose(
+            frames.projections[i], np.array(projection)[:3], rtol=1e-5, atol=1e-2
+        )
+        np.testing.assert_allclose(
+            frames.sources[i], np.array(projection.center_in_world), rtol=1e-5, atol=1e-3
+        )
+
+
+@pytest.mark.django_db
+def test_from_parameters_resolution(session_factory):
+    parameters = session_factory(
+        parameters__detector_diameter=230.4, parameters__detector_resolution=384
+    ).parameters
+
+    geometry = CArmGeometry.from_parameters(parameters)
+    preview = CArmGeometry.from_parameters(parameters, sensor_size=256)
+
+    # The detector keeps its physical size at any resolution
+    assert (geometry.sensor_size, geometry.pixel_size) == (384, pytest.approx(0.6))
+    assert (preview.sensor_size, preview.pixel_size) == (256, pytest.approx(0.9))
+    assert geometry.intrinsic[0, 2] == 192
@@ -0,0 +1,232 @@
+import dataclasses
+from io import BytesIO
+
+from django.core.files.storage import InMemoryStorage
+import pytest
+
+from xray_genius.core.models import OutputImage, OutputPack
+from xray_genius.core.render.outputs import OutputImageWriter, StoredFrame, store_output_file
+
+
+@pytest.fixture
+def storage(monkeypatch: pytest.MonkeyPatch) -> InMemoryStorage:
+    storage = InMemoryStorage()
+    monkeypatch.setattr(OutputImage._meta.get_field('image'), 'storage', storage)
+    monkeypatch.setattr(OutputImage._meta.get_field('thumbnail'), 'storage', storage)
+    monkeypatch.setattr(OutputImage._meta.get_field('raw_image'), 'storage', storage)
+    monkeypatch.setattr(OutputPack._meta.get_field('file'), 'storage', storage)
+    return storage
+
+
+def _stored_frame(index: int) -> StoredFrame:
+    return StoredFrame(
+        image_name=store_output_file('image', f'{index}.png', BytesIO(b'image')),
+        thumbnail_name=store_output_file('thumbnail', f'{index}_thumb.png', BytesIO(b'thumb')),
+        carm_push_pull=float(index),
+        carm_head_foot_translation=0.0,
+        carm_raise_lower=0.0,
+        carm_alpha=0.0,
+        carm_beta=0.0,
+    )
+
+
+@pytest.mark.django_db
+def test_output_image_writer_batches_inserts(storage, session_factory, django_assert_num_queries):
+    session = session_factory()
+    frames = [_stored_frame(i) for i in range(7)]
+
+    writer = OutputImageWriter(session, batch_size=3, max_delay_seconds=60)
+    # Two full batches, each written with a single INSERT (inside a savepoint)
+    with django_assert_num_queries(6):
+        for frame in frames[:6]:
+            writer.add(frame)
+    assert writer.created == 6
+
+    writer.add(frames[6])
+    assert OutputImage.objects.filter(session=session).count() == 6
+    with django_assert_num_queries(3):
+        writer.flush()
+
+    assert writer.created == 7
+    assert sorted(session.output_images.values_list('carm_push_pull', flat=True)) == list(
+        map(float, range(7))
+    )
+
+
+@pytest.mark.django_db
+def test_output_image_writer_flushes_after_delay(storage, session_factory):
+    session = session_factory()
+    writer = OutputImageWriter(session, batch_size=100, max_delay_seconds=0)
+
+    writer.add(_stored_frame(0))
+
+    assert writer.created == 1
+    assert OutputImage.objects.filter(session=session).count() == 1
+
+
+@pytest.mark.django_db
+def test_output_image_writer_discards_on_error(storage, session_factory):
+    session = session_factory()
+    frames = [_stored_frame(i) for i in range(5)]
+
+    def run() -> None:
+        with OutputImageWriter(session, batch_size=3, max_delay_seconds=60) as writer:
+            for frame in frames:
+                writer.add(frame)
+            raise RuntimeError('render failed')
+
+    with pytest.raises(RuntimeError, match='render failed'):
+        run()
+
+    # The first batch was saved, but the partial batch must leave no rows or files behind
+    assert OutputImage.objects.filter(session=session).count() == 3
+    for frame in frames[3:]:
+        assert not storage.exists(frame.image_name)
+        assert not storage.exists(frame.thumbnail_name)
+    for frame in frames[:3]:
+        assert storage.exists(frame.image_name)
+
+
+@pytest.mark.django_db
+def test_output_image_writer_keeps_shared_files_of_saved_frames(storage, session_factory):
+    session = session_factory()
+    # Three identical poses, rendered once, whose frames straddle a batch boundary
+    [shared, *_] = frames = [_stored_frame(0)] * 3
+
+    def run() -> None:
+        with OutputImageWriter(session, batch_size=2, max_delay_seconds=60) as writer:
+            writer.extend(frames)
+            writer.add(_stored_frame(1))
+            raise RuntimeError('render failed')
+
+    with pytest.raises(RuntimeError, match='render failed'):
+        run()
+
+    assert OutputImage.objects.filter(session=session).count() == 3
+    assert storage.exists(shared.image_name)
+
+    # Shared files are only deleted along with the last image which references them
+    images = list(OutputImage.objects.filter(session=session))
+    images[0].delete()
+    assert storage.exists(shared.image_name)
+    OutputImage.objects.filter(session=session).delete()
+    assert not storage.exists(shared.image_name)
+    assert not storage.exists(shared.thumbnail_name)
+
+
+@pytest.mark.django_db
+def test_output_image_writer_discards_raw_only_frames(storage, session_factory):
+    session = session_factory()
+    saved, unsaved = (
+        StoredFrame(
+            image_name='',
+            thumbnail_name=store_output_file('thumbnail', f'{i}_thumb.png', BytesIO(b'thumb')),
+            raw_image_name=store_output_file('raw_image', f'{i}.npy', BytesIO(b'raw')),
+            carm_push_pull=0.0,
+            carm_head_foot_translation=0.0,
+            carm_raise_lower=0.0,
+            carm_alpha=0.0,
+            carm_beta=0.0,
+        )
+        for i in range(2)
+    )
+
+    writer = OutputImageWriter(session, batch_size=100, max_delay_seconds=60)
+    writer.add(saved)
+    writer.flush()
+    writer.add(unsaved)
+    writer.discard()
+
+    assert storage.exists(saved.raw_image_name)
+    assert not storage.exists(unsaved.raw_image_name)
+    assert not storage.exists(unsaved.thumbnail_name)
+    [output_image] = session.output_images.all()
+    assert not output_image.image
+    assert output_image.raw_image.name == saved.raw_image_name
+
+    output_image.delete()
+    assert not storage.exists(saved.raw_image_name)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('packed', [False, True])
+def test_output_image_writer_drops_samples_saved_by_another_task(
+    storage, session_factory, *, packed: bool
+):
+    session = session_factory()
+    frame = _packed_frame if packed else _stored_frame
+    # Both copies of a redelivered task render the first samples
+    with OutputImageWriter(session, batch_size=10, max_delay_seconds=60) as other:
+        other.extend(dataclasses.replace(frame(i), index=i) for i in range(2))
+    frames = [dataclasses.replace(frame(i), index=i) for i in range(3)]
+
+    with OutputImageWriter(session, batch_size=10, max_delay_seconds=60) as writer:
+        writer.extend(frames)
+
+    assert writer.created == 1
+    assert sorted(session.output_images.values_list('index', flat=True)) == [0, 1, 2]
+    if not packed:
+        # The files of the dropped images are deleted
+        assert [storage.exists(frame.image_name) for frame in frames] == [False, False, True]
+
+
+def _packed_frame(index: int) -> StoredFrame:
+    return StoredFrame(
+        image_name='',
+        thumbnail_name='',
+        packed_files={
+            'image': (f'{index}.png', f'image {index}'.encode()),
+            'thumbnail': (f'{index}_thumb.png', f'thumb {index}'.encode()),
+        },
+        carm_push_pull=float(index),
+        carm_head_foot_translation=0.0,
+        carm_raise_lower=0.0,
+        carm_alpha=0.0,
+        carm_beta=0.0,
+    )
+
+
+@pytest.mark.django_db
+def test_output_image_writer_packs_batches(storage, session_factory):
+    session = session_factory()
+    shared = _packed_frame(0)
+
+    with OutputImageWriter(session, batch_size=3, max_delay_seconds=60) as writer:
+        for frame in [shared, shared, _packed_frame(1), _packed_frame(2)]:
+            writer.add(frame)
+
+    # One pack per batch, in which frames of identical poses share their slices
+    assert OutputPack.objects.filter(session=session).count() == 2
+    output_images = list(session.output_images.select_related('pack').order_by('pk'))
+    assert output_images[0].pack_slices == output_images[1].pack_slices
+    assert output_images[0].pack == output_images[2].pack != output_images[3].pack
+    for output_image in output_images:
+        index = int(output_image.carm_push_pull)
+        assert not output_image.image
+        assert output_image.file_name('image') == f'{index}.png'
+        assert output_image.read_file('image') == f'image {index}'.encode()
+        assert output_image.read_file('thumbnail') == f'thumb {index}'.encode()
+        assert not output_image.has_file('raw_image')
+
+    # A pack is deleted along with the last image in it
+    pack = output_images[3].pack
+    output_images[3].delete()
+    assert not OutputPack.objects.filter(pk=pack.pk).exists()
+    assert not storage.exists(pack.file.name)
+    assert storage.exists(output_images[0].pack.file.name)
+
+
+@pytest.mark.django_db
+def test_output_image_writer_discards_pack_on_error(storage, session_factory, mocker):
+    session = session_factory()
+    mocker.patch.object(OutputImage.objects, 'bulk_create', side_effect=RuntimeError('db down'))
+    save = mocker.spy(storage, 'save')
+
+    writer = OutputImageWriter(session, batch_size=100, max_delay_seconds=60)
+    writer.add(_packed_frame(0))
+    with pytest.raises(RuntimeError, match='db down'):
+        writer.flush()
+
+    [pack_name] = [call.args[0] for call in save.call_args_list]
+    assert not storage.exists(pack_name)
+    assert not OutputPack.objects.exists()
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from xray_genius.core.models import InputParameters
+from xray_genius.core.utils import ParameterSampler
+
+
+@pytest.fixture
+def randomized_parameters() -> InputParameters:
+    return InputParameters(
+        num_samples=1000,
+        carm_push_pull_std_dev=10,
+        carm_head_foot_translation=5,
+        carm_head_foot_std_dev=2,
+        carm_alpha=30,
+        carm_alpha_kappa=5,
+        carm_beta_kappa=20,
+    )
+
+
+def test_parameter_sampler_poses(randomized_parameters):
+    poses = ParameterSampler(randomized_parameters, seed=0).sample()
+
+    assert poses.shape == (1000, 5)
+    assert poses.dtype == np.float64
+    assert poses.flags.c_contiguous
+    # Not randomized
+    assert (poses[:, 2] == 0).all()
+    assert poses[:, 1].mean() == pytest.approx(5, abs=0.5)
+    assert poses[:, 3].mean() == pytest.approx(30, abs=5)
+    assert ((poses[:, 3:] >= -180) & (poses[:, 3:] < 180)).all()
+
+
+def test_parameter_sampler_seeded(randomized_parameters):
+    poses = ParameterSampler(randomized_parameters, seed=1).sample()
+
+    assert (ParameterSampler(randomized_parameters, seed=1).sample() == poses).all()
+    assert not (ParameterSampler(randomized_parameters, seed=2).sample() == poses).all()
+
+
+def test_parameter_sampler_unseeded_is_reproducible(randomized_parameters):
+    sampler = ParameterSampler(randomized_parameters)
+
+    assert (
+        sampler.sample() == ParameterSampler(randomized_parameters, sampler.seed).sample()
+    ).all()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000, 4096])
+@pytest.mark.parametrize('sampling_mode', InputParameters.SamplingMode.values)
+def test_parameter_sampler_chunks(randomized_parameters, chunk_size, sampling_mode):
+    randomized_parameters.sampling_mode = sampling_mode
+    sampler = ParameterSampler(randomized_parameters, seed=3)
+
+    chunks = list(sampler.iter_chunks(chunk_size))
+
+    assert all(len(chunk) <= chunk_size for chunk in chunks)
+    assert (np.concatenate(chunks) == sampler.sample()).all()
+
+
+def test_parameter_sampler_no_samples(randomized_parameters):
+    randomized_parameters.num_samples = 0
+
+    assert ParameterSampler(randomized_parameters).sample().shape == (0, 5)
+
+
+@pytest.mark.parametrize(
+    'sampling_mode',
+    [InputParameters.SamplingMode.SOBOL, InputParameters.SamplingMode.LATIN_HYPERCUBE],
+)
+def test_parameter_sampler_low_discrepancy(randomized_parameters, sampling_mode):
+    randomized_parameters.sampling_mode = sampling_mode
+    poses = ParameterSampler(randomized_parameters, seed=4).sample()
+
+    assert (ParameterSampler(randomized_parameters, seed=4).sample() == poses).all()
+    # The same distributions are sampled, only more evenly
+    assert (poses[:, 2] == 0).all()
+    assert poses[:, 0].mean() == pytest.approx(0, abs=0.5)
+    assert poses[:, 0].std() == pytest.approx(10, rel=0.05)
+    assert poses[:, 1].mean() == pytest.approx(5, abs=0.1)
+    assert poses[:, 3].mean() == pytest.approx(30, abs=1)
+    assert ((poses[:, 3:] >= -180) & (poses[:, 3:] < 180)).all()
+
+
+@pytest.mark.parametrize(
+    'sampling_mode',
+    [InputParameters.SamplingMode.SOBOL, InputParameters.SamplingMode.LATIN_HYPERCUBE],
+)
+def test_parameter_sampler_discrepancy(randomized_parameters, sampling_mode):
+    randomized_parameters.num_samples = 64
+
+    def mean_discrepancy() -> float:
+        discrepancies = []
+        for seed in range(10):
+            sampler = ParameterSampler(randomized_parameters, seed=seed)
+            discrepancies.append(sampler.discrepancy(sampler.sample()))
+        return float(np.mean(discrepancies))
+
+    random_discrepancy = mean_discrepancy()
+    randomized_parameters.sampling_mode = sampling_mode
+
+    assert mean_discrepancy() < random_discrepancy * 0.75
+
+
+def test_parameter_sampler_discrepancy_not_randomized():
+    sampler = ParameterSampler(InputParameters(num_samples=10))
+
+    assert not sampler.randomized
+    assert sampler.discrepancy(sampler.sample()) is None
+
+
+def test_parameter_sampler_resample(randomized_parameters):
+    randomized_parameters.sampling_mode = InputParameters.SamplingMode.SOBOL
+    sampler = ParameterSampler(randomized_parameters, seed=5)
+
+    replacement = sampler.resample(3, 0)
+
+    assert sampler.randomized
+    assert replacement.shape == (5,)
+    assert (ParameterSampler(randomized_parameters, seed=5).resample(3, 0) == replacement).all()
+    assert not (sampler.resample(3, 1) == replacement).all()
+    assert not (sampler.resample(4, 0) == replacement).all()
+    assert not (sampler.sample() == replacement).all(axis=1).any()
@@ -1,8 +1,10 @@
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
 from django.test import Client
 from django.urls import reverse
 import pytest
 
-from xray_genius.core.models import Session
+from xray_genius.core.models import OutputImage, OutputPack, Session
 
 
 @pytest.mark.django_db
@@ -28,6 +30,7 @@ def test_dashboard_permissions(user, user_factory, session_factory, client: Clie
         ('download-input-ct-file', 'get', 302),
         ('viewer', 'get', 200),
         ('initiate-batch-run', 'post', 302),
+        ('initiate-preview-run', 'post', 302),
     ],
 )
 def test_permissions_views(
@@ -95,3 +98,47 @@ def test_permissions_parameters_rest_endpoint(
     assert owned_session.parameters.carm_alpha == carm_alpha
     assert owned_session.parameters.carm_beta == carm_beta
     assert owned_session.parameters.source_to_detector_distance == source_to_detector_distance
+
+
+@pytest.mark.django_db
+def test_permissions_packed_output_image_file(
+    user, user_factory, session_factory, monkeypatch: pytest.MonkeyPatch, client: Client
+):
+    storage = InMemoryStorage()
+    monkeypatch.setattr(OutputPack._meta.get_field('file'), 'storage', storage)
+    client.force_login(user)
+
+    def packed_image(session: Session) -> OutputImage:
+        pack = OutputPack.objects.create(
+            session=session, file=storage.save('1.pack', ContentFile(b'xxthumbimage'))
+        )
+        return OutputImage.objects.create(
+            session=session,
+            pack=pack,
+            pack_slices={
+                'thumbnail': {'name': '1_thumbnail.png', 'offset': 2, 'length': 5},
+                'image': {'name': '1.png', 'offset': 7, 'length': 5},
+            },
+        )
+
+    def url(output_image: OutputImage, field_name: str) -> str:
+        return reverse(
+            'output-image-file',
+            kwargs={
+                'session_pk': output_image.session_id,
+                'output_image_pk': output_image.pk,
+                'field_name': field_name,
+            },
+        )
+
+    not_owned = packed_image(session_factory(owner=user_factory()))
+    assert client.get(url(not_owned, 'image')).status_code == 404
+
+    owned = packed_image(session_factory(owner=user))
+    assert owned.image_url == url(owned, 'image')
+    response = client.get(url(owned, 'image'))
+    assert response.status_code == 200
+    assert response.content == b'image'
+    assert response['Content-Disposition'] == 'inline; filename="1.png"'
+    assert client.get(url(owned, 'raw_image')).status_code == 404
+    assert client.get(url(owned, 'session')).status_code == 404
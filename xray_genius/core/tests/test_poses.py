@@ -0,0 +1,23 @@
+import numpy as np
+
+from xray_genius.core.render.poses import group_identical_poses
+
+
+def test_group_identical_poses():
+    poses = np.array(
+        [
+            [0.0, 0.0, 0.0, 10.0, 0.0],
+            [1.0, 0.0, 0.0, 10.0, 0.0],
+            [0.0, 0.0, 0.0, 10.0 + 1e-9, 0.0],
+            [1.0, 0.0, 0.0, 10.0, 0.0],
+            [0.0, 0.0, 0.0, 10.0, 0.0],
+        ]
+    )
+
+    assert group_identical_poses(poses) == [[0, 2, 4], [1, 3]]
+
+
+def test_group_identical_poses_all_unique():
+    poses = np.random.default_rng(0).normal(size=(20, 5))
+
+    assert group_identical_poses(poses) == [[i] for i in range(20)]
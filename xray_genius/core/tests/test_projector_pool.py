@@ -0,0 +1,87 @@
+from collections.abc import Iterator
+from unittest import mock
+
+import pytest
+
+from xray_genius.core.render.geometry import CArmGeometry
+from xray_genius.core.render.projectors import ProjectorKey, ProjectorPool
+
+
+@pytest.fixture(autouse=True)
+def create_backend() -> Iterator[mock.Mock]:
+    # Volumes are stood in for by their size, and projectors by mocks
+    with (
+        mock.patch(
+            'xray_genius.core.render.projectors.estimate_projector_bytes',
+            side_effect=lambda volume, _geometry: volume,
+        ),
+        mock.patch(
+            'xray_genius.core.render.projectors.create_backend',
+            side_effect=lambda *_: mock.Mock(),
+        ) as create_backend,
+    ):
+        yield create_backend
+
+
+def _key(volume: str, sensor_size: int = 256) -> ProjectorKey:
+    return ProjectorKey(volume, CArmGeometry(1000, 0.9, sensor_size=sensor_size))
+
+
+def test_projector_pool_reuses_projectors(create_backend: mock.Mock):
+    pool = ProjectorPool(max_bytes=100, backend='numpy')
+    load = mock.Mock(return_value=10)
+
+    with pool.acquire(_key('a'), load) as first:
+        pass
+    with pool.acquire(_key('a'), load) as second:
+        pass
+    # A different detector needs its own projector
+    with pool.acquire(_key('a', sensor_size=384), load):
+        pass
+
+    assert second is first
+    assert load.call_count == 2
+    assert create_backend.call_count == 2
+    assert create_backend.call_args.args[0] == 'numpy'
+    first.backend.initialize.assert_called_once()
+    stats = pool.stats()
+    assert (stats.hits, stats.misses, stats.evictions) == (1, 2, 0)
+    first.backend.free.assert_not_called()
+
+
+def test_projector_pool_evicts_least_recently_used():
+    pool = ProjectorPool(max_bytes=100)
+
+    with pool.acquire(_key('a'), lambda: 40) as a:
+        pass
+    with pool.acquire(_key('b'), lambda: 40) as b:
+        pass
+    with pool.acquire(_key('a'), lambda: 40):
+        pass
+    with pool.acquire(_key('c'), lambda: 40):
+        pass
+
+    # b was used less recently than a, so it's freed to make room for c
+    b.backend.free.assert_called_once()
+    a.backend.free.assert_not_called()
+    assert pool.nbytes == 80
+    assert pool.stats().evictions == 1
+
+
+def test_projector_pool_frees_oversized_and_failed():
+    pool = ProjectorPool(max_bytes=100)
+
+    with pool.acquire(_key('large'), lambda: 200) as large:
+        pass
+    large.backend.free.assert_called_once()
+
+    with pool.acquire(_key('a'), lambda: 10) as failed:
+        # As set by a failed render
+        failed.failed = True
+    failed.backend.free.assert_called_once()
+
+    # Other errors (e.g. cancellation) leave the projector usable
+    with pytest.raises(RuntimeError), pool.acquire(_key('b'), lambda: 10) as kept:
+        raise RuntimeError
+    kept.backend.free.assert_not_called()
+    assert pool.nbytes == 10
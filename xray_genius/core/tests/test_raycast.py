@@ -0,0 +1,128 @@
+from django.core.exceptions import ImproperlyConfigured
+import numpy as np
+import pytest
+
+from xray_genius.core.render.backends import NumpyBackend, create_backend
+from xray_genius.core.render.geometry import CArmGeometry
+from xray_genius.core.render.raycast import (
+    attenuate,
+    detector_rays,
+    material_densities,
+    neglog,
+    trace_area_densities,
+)
+
+
+@pytest.fixture
+def ijk_from_world() -> np.ndarray:
+    # A 20mm cube of 1mm voxels, centered on the world's origin
+    world_from_ijk = np.eye(4)
+    world_from_ijk[:3, 3] = -9.5
+    return np.linalg.inv(world_from_ijk)
+
+
+def test_detector_rays():
+    geometry = CArmGeometry(source_to_detector_distance=1000, pixel_size=10, sensor_size=8)
+    frames = geometry.frames(np.array([[10, -20, 5, 30, -45]]))
+
+    source, directions = detector_rays(
+        geometry.intrinsic, frames.camera3d_from_world[0], geometry.sensor_size
+    )
+
+    np.testing.assert_allclose(source, frames.sources[0])
+    np.testing.assert_allclose(np.linalg.norm(directions, axis=1), 1)
+    # Each ray projects onto the center of its pixel, in row-major order
+    points = np.column_stack([source + 500 * directions, np.ones(len(directions))])
+    homogeneous = points @ frames.projections[0].T
+    v, u = np.mgrid[:8, :8] + 0.5
+    np.testing.assert_allclose(
+        homogeneous[:, :2] / homogeneous[:, 2:], np.column_stack([u.ravel(), v.ravel()])
+    )
+
+
+def test_trace_area_densities(ijk_from_world):
+    densities = material_densities(
+        np.ones((20, 20, 20), dtype=np.float32), [np.ones((20, 20, 20)), np.zeros((20, 20, 20))]
+    )
+    directions = np.array(
+        [
+            # Straight through the middle
+            [0.0, 0.0, 1.0],
+            # Wide of the volume
+            [0.0, 1.0, 0.0],
+        ]
+    )
+
+    area_densities = trace_area_densities(
+        densities, ijk_from_world, np.array([0.0, 0.0, -100.0]), directions, step=0.1
+    )
+
+    # 20mm of material, except that the density fades out over the last half voxel on each side
+    np.testing.assert_allclose(area_densities[0], [1.975, 0], rtol=1e-2)
+    np.testing.assert_array_equal(area_densities[1], [0, 0])
+
+
+def test_trace_area_densities_in_chunks(ijk_from_world, mocker):
+    rng = np.random.default_rng(0)
+    densities = material_densities(
+        rng.uniform(0, 2, (20, 20, 20)).astype(np.float32), [np.ones((20, 20, 20))]
+    )
+    directions = rng.normal([0, 0, 1], 0.05, (64, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    source = np.array([0.0, 0.0, -100.0])
+
+    expected = trace_area_densities(densities, ijk_from_world, source, directions, step=0.5)
+    mocker.patch('xray_genius.core.render.raycast._CHUNK_SAMPLES', 100)
+    chunked = trace_area_densities(densities, ijk_from_world, source, directions, step=0.5)
+
+    np.testing.assert_allclose(chunked, expected, rtol=1e-5)
+
+
+def test_attenuate_neglog():
+    energies = np.array([40.0, 60.0])
+    pdf = np.array([0.5, 0.5])
+    coefficients = np.array([[0.3, 1.0], [0.2, 0.5]])
+    area_densities = np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0]])
+
+    intensity = attenuate(area_densities, energies, pdf, coefficients)
+    image = neglog(intensity)
+
+    assert intensity[0] == pytest.approx(50)
+    assert intensity[0] > intensity[1] > intensity[2]
+    # Empty space is mapped to 0, and the most attenuated ray to 1
+    assert image[0] == 0
+    assert image[1] > 0
+    assert image[2] == pytest.approx(1)
+    np.testing.assert_array_equal(neglog(np.full(4, 50.0)), np.zeros(4))
+
+
+def test_create_backend():
+    geometry = CArmGeometry(source_to_detector_distance=1000, pixel_size=1, sensor_size=64)
+
+    assert isinstance(create_backend('numpy', None, geometry), NumpyBackend)
+    with pytest.raises(ImproperlyConfigured, match='Unknown projector backend'):
+        create_backend('opencl', None, geometry)
+
+
+def test_numpy_backend_render():
+    deepdrr = pytest.importorskip('deepdrr')
+    from xray_genius.core.render.volumes import place_supine
+
+    # A 40mm cube of bone, which covers about 10 pixels of the detector at the isocenter
+    volume = deepdrr.Volume.from_parameters(
+        data=np.full((40, 40, 40), 1.9, dtype=np.float32),
+        materials={'bone': np.ones((40, 40, 40), dtype=bool)},
+        origin=[0, 0, 0],
+        anatomical_coordinate_system='LPS',
+    )
+    place_supine(volume)
+    geometry = CArmGeometry(source_to_detector_distance=1000, pixel_size=8, sensor_size=32)
+    backend = create_backend('numpy', volume, geometry)
+
+    backend.initialize()
+    image = backend.render(geometry.frames(np.zeros((1, 5))).camera3d_from_world[0])
+    backend.free()
+
+    assert image.shape == (32, 32)
+    assert image[16, 16] == pytest.approx(1, abs=0.05)
+    assert image[0, 0] == 0
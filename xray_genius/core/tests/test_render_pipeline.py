@@ -0,0 +1,96 @@
+import random
+import threading
+import time
+
+import pytest
+
+from xray_genius.core.render.pipeline import RenderPipeline
+
+
+def _slow_identity(value: int) -> int:
+    # Finish out of order, to make sure the pipeline restores submission order
+    time.sleep(random.uniform(0, 0.01))
+    return value
+
+
+def test_render_pipeline_preserves_order():
+    results = []
+    with RenderPipeline(results.append, max_workers=4, max_pending=6) as pipeline:
+        for i in range(50):
+            pipeline.submit(_slow_identity, i)
+
+    assert results == list(range(50))
+
+
+def test_render_pipeline_backpressure():
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def work(value: int) -> int:
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.005)
+        with lock:
+            in_flight -= 1
+        return value
+
+    results = []
+    with RenderPipeline(results.append, max_workers=8, max_pending=3) as pipeline:
+        for i in range(30):
+            pipeline.submit(work, i)
+            assert pipeline.pending <= 3
+
+    assert max_in_flight <= 3
+    assert results == list(range(30))
+
+
+def test_render_pipeline_surfaces_errors():
+    def work(value: int) -> int:
+        if value == 5:
+            raise ValueError('encoding failed')
+        return value
+
+    def run() -> None:
+        with RenderPipeline(
+            results.append, on_discard=discarded.append, max_workers=2, max_pending=4
+        ) as pipeline:
+            for i in range(20):
+                pipeline.submit(work, i)
+
+    results = []
+    discarded = []
+    with pytest.raises(ValueError, match='encoding failed'):
+        run()
+
+    # Nothing after the failed frame may be handed over, and everything that was completed
+    # but not handed over must be discarded.
+    assert results == list(range(len(results)))
+    assert len(results) <= 5
+    assert set(results).isdisjoint(discarded)
+    assert 5 not in discarded
+
+
+def test_render_pipeline_abort_discards_pending():
+    release = threading.Event()
+
+    def work(value: int) -> int:
+        release.wait()
+        return value
+
+    results = []
+    discarded = []
+    with RenderPipeline(
+        results.append, on_discard=discarded.append, max_workers=2, max_pending=4
+    ) as pipeline:
+        for i in range(4):
+            pipeline.submit(work, i)
+        release.set()
+        pipeline.abort()
+
+    assert results == []
+    # Frames which were already running are discarded; those that never started are cancelled
+    assert set(discarded) <= {0, 1, 2, 3}
+    assert {0, 1} <= set(discarded)
@@ -87,6 +87,9 @@ def test_set_parameters_rest(user, session_factory, client: Client):
         'carm_beta_kappa': 3282.806,
         'num_samples': 10,
         'detector_diameter': 228.6,
+        'sampling_mode': InputParameters.SamplingMode.SOBOL,
+        'detector_resolution': 384,
+        'output_format': InputParameters.OutputFormat.PNG_AND_NPY,
     }
 
     response = client.post(
@@ -100,3 +103,82 @@ def test_set_parameters_rest(user, session_factory, client: Client):
 
     # Ensure all parameters got accepted
     assert model_to_dict(parameters, exclude=['id', 'session']) == param_data
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    'resolution',
+    [0, 32, 4096],
+)
+def test_detector_resolution_invalid(user, session_factory, client: Client, resolution: int):
+    client.force_login(user)
+
+    session: Session = session_factory(owner=user, parameters=None)
+
+    response = client.post(
+        reverse('api-0.1.0:set_parameters', kwargs={'session_pk': session.pk}),
+        content_type='application/json',
+        data={
+            'source_to_detector_distance': 1000,
+            'detector_resolution': resolution,
+        },
+    )
+    assert response.status_code == 422
+    assert not InputParameters.objects.filter(session=session).exists()
+
+
+@pytest.mark.django_db
+def test_set_parameters_after_preview(user, session_factory, output_image_factory, client: Client):
+    client.force_login(user)
+
+    session: Session = session_factory(
+        owner=user, status=Session.Status.PROCESSED, preview=True, parameters=None
+    )
+    output_image_factory(session=session)
+
+    response = client.post(
+        reverse('api-0.1.0:set_parameters', kwargs={'session_pk': session.pk}),
+        content_type='application/json',
+        data={'source_to_detector_distance': 1000},
+    )
+    assert response.status_code == 200
+
+    # The preview's images are discarded, and the session can run again
+    session.refresh_from_db()
+    assert session.status == Session.Status.NOT_STARTED
+    assert not session.output_images.exists()
+
+
+@pytest.mark.django_db
+def test_preview_pose(user, session_factory, client: Client, mocker):
+    request_pose_preview = mocker.patch(
+        'xray_genius.core.rest.session.request_pose_preview', return_value=b'png'
+    )
+    client.force_login(user)
+
+    session: Session = session_factory(owner=user)
+
+    response = client.post(
+        reverse('api-0.1.0:preview_pose', kwargs={'session_pk': session.pk}),
+        content_type='application/json',
+        data={'carm_alpha': 30, 'carm_push_pull': -10},
+    )
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'image/png'
+    assert response.content == b'png'
+    assert request_pose_preview.call_args.args == (session.pk, [-10, 0, 0, 30, 0])
+
+
+@pytest.mark.django_db
+def test_preview_pose_unavailable(user, session_factory, client: Client, mocker):
+    mocker.patch('xray_genius.core.rest.session.request_pose_preview', return_value=None)
+    client.force_login(user)
+
+    session: Session = session_factory(owner=user)
+
+    response = client.post(
+        reverse('api-0.1.0:preview_pose', kwargs={'session_pk': session.pk}),
+        content_type='application/json',
+        data={},
+    )
+    assert response.status_code == 503
@@ -0,0 +1,189 @@
+from io import BytesIO
+
+from django.core.files.storage import InMemoryStorage
+import numpy as np
+import pytest
+
+from xray_genius.core import tasks
+from xray_genius.core.models import InputParameters, OutputImage, Session
+from xray_genius.core.render.encoding import encode_frame
+from xray_genius.core.render.outputs import store_output_file
+from xray_genius.core.render.stack import (
+    POSE_COLUMNS,
+    StackPart,
+    merge_stack_parts,
+    write_stack,
+)
+
+
+@pytest.fixture
+def storage(monkeypatch: pytest.MonkeyPatch) -> InMemoryStorage:
+    storage = InMemoryStorage()
+    for field in ('image', 'thumbnail', 'raw_image'):
+        monkeypatch.setattr(OutputImage._meta.get_field(field), 'storage', storage)
+    for field in ('output_images_stack', 'output_images_poses'):
+        monkeypatch.setattr(Session._meta.get_field(field), 'storage', storage)
+    return storage
+
+
+def _pose(index: int) -> dict[str, float | int]:
+    return {
+        'index': index,
+        'carm_push_pull': 0.0,
+        'carm_head_foot_translation': 0.0,
+        'carm_raise_lower': 0.0,
+        'carm_alpha': float(index),
+        'carm_beta': 0.0,
+    }
+
+
+def _load(storage: InMemoryStorage, name: str) -> np.ndarray | np.lib.npyio.NpzFile:
+    with storage.open(name, 'rb') as f:
+        return np.load(BytesIO(f.read()))
+
+
+def test_write_stack(tmp_path):
+    images = np.random.default_rng(0).random((3, 8, 8), dtype=np.float32)
+    path = tmp_path / 'images.npy'
+
+    write_stack(path, iter(images), images.shape, np.float32)
+
+    stack = np.load(path, mmap_mode='r')
+    assert isinstance(stack, np.memmap)
+    np.testing.assert_array_equal(stack, images)
+    with pytest.raises(ValueError, match='Expected 4 images, got 3'):
+        write_stack(path, iter(images), (4, 8, 8), np.float32)
+    with pytest.raises(ValueError, match='Expected 2 images, got more'):
+        write_stack(path, iter(images), (2, 8, 8), np.float32)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    ('output_format', 'dtype'),
+    [
+        (InputParameters.OutputFormat.PNG, np.uint16),
+        (InputParameters.OutputFormat.NPY, np.float32),
+    ],
+)
+def test_stack_images_task(storage, session_factory, output_format: str, dtype: np.dtype):
+    pytest.importorskip('png')
+    session: Session = session_factory()
+    session.parameters.detector_resolution = 16
+    session.parameters.output_format = output_format
+    session.parameters.save()
+    images = np.random.default_rng(0).random((3, 16, 16), dtype=np.float32)
+    # Saved out of order, as parallel shards would
+    for index in (2, 0, 1):
+        encoded = encode_frame(
+            images[index], png=session.parameters.stores_png, npy=session.parameters.stores_npy
+        )
+        files = {'image': encoded.image, 'raw_image': encoded.raw}
+        OutputImage.objects.create(
+            session=session,
+            index=index,
+            **{
+                field_name: store_output_file(field_name, f'{index}', BytesIO(content.getvalue()))
+                for field_name, content in files.items()
+                if content is not None
+            },
+            carm_push_pull=0.0,
+            carm_head_foot_translation=0.0,
+            carm_raise_lower=0.0,
+            carm_alpha=float(index),
+            carm_beta=0.0,
+        )
+
+    tasks.stack_images_task(str(session.pk))
+
+    session.refresh_from_db()
+    with session.output_images_stack.open('rb') as f:
+        stack = np.load(BytesIO(f.read()))
+    assert stack.dtype == dtype
+    expected = images if dtype == np.float32 else (images * 0xFFFF).astype(np.uint16)
+    np.testing.assert_array_equal(stack, expected)
+    with session.output_images_poses.open('rb') as f, np.load(BytesIO(f.read())) as poses:
+        assert set(poses.files) == set(POSE_COLUMNS)
+        np.testing.assert_array_equal(poses['index'], [0, 1, 2])
+        np.testing.assert_array_equal(poses['carm_alpha'], [0.0, 1.0, 2.0])
+
+
+@pytest.mark.django_db
+def test_merge_stack_parts(storage, tmp_path):
+    images = np.random.default_rng(0).random((3, 8, 8), dtype=np.float32)
+    sources = []
+    # Shards render the poses of their groups in any order, and identical poses share an image
+    for part_images in ([(images[2], [2]), (images[0], [0, 3])], [(images[1], [1])]):
+        with StackPart(np.float32) as part:
+            for image, indices in part_images:
+                part.add(image, [_pose(index) for index in indices])
+            assert part.count == sum(len(indices) for _, indices in part_images)
+            stack_name, poses_name = part.store()
+        stack_path, poses_path = tmp_path / f'{len(sources)}.npy', tmp_path / f'{len(sources)}.npz'
+        stack_path.write_bytes(storage.open(stack_name).read())
+        poses_path.write_bytes(storage.open(poses_name).read())
+        sources.append((stack_path, poses_path))
+
+    merge_stack_parts(sources, tmp_path / 'images.npy', tmp_path / 'poses.npz')
+
+    np.testing.assert_array_equal(np.load(tmp_path / 'images.npy'), images[[0, 1, 2, 0]])
+    with np.load(tmp_path / 'poses.npz') as poses:
+        np.testing.assert_array_equal(poses['index'], [0, 1, 2, 3])
+        np.testing.assert_array_equal(poses['carm_alpha'], [0.0, 1.0, 2.0, 3.0])
+
+
+@pytest.mark.django_db
+def test_stack_part_quantizes(storage):
+    image = np.random.default_rng(0).random((8, 8), dtype=np.float32)
+
+    with StackPart(np.uint16) as part:
+        part.add(image, [_pose(0)])
+        stack_name, _ = part.store()
+
+    stack = _load(storage, stack_name)
+    assert stack.dtype == np.uint16
+    np.testing.assert_array_equal(stack, [(image * 0xFFFF).astype(np.uint16)])
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('complete', [True, False])
+def test_finish_deepdrr_run_stack_parts(storage, session_factory, mocker, *, complete: bool):
+    mocker.patch.object(tasks.zip_images_task, 'delay')
+    stack_images_task = mocker.patch.object(tasks.stack_images_task, 'delay')
+    session: Session = session_factory(status=Session.Status.RUNNING)
+    images = np.random.default_rng(0).random((2, 8, 8), dtype=np.float32)
+    results = []
+    for index, image in enumerate(images):
+        OutputImage.objects.create(session=session, **_pose(index))
+        with StackPart(np.float32) as part:
+            part.add(image, [_pose(index)])
+            stack_name, poses_name = part.store()
+        results.append(
+            {
+                'created': 1,
+                'resampled': 0,
+                'rejected': 0,
+                'replaced': 0,
+                'stack': stack_name,
+                'poses': poses_name,
+            }
+        )
+    if not complete:
+        # An image saved by an earlier delivery of a shard, which its stack doesn't hold
+        OutputImage.objects.create(session=session, **_pose(2))
+
+    tasks.finish_deepdrr_run_task(results, str(session.pk))
+
+    session.refresh_from_db()
+    assert session.status == Session.Status.PROCESSED
+    parts = [result[key] for result in results for key in ('stack', 'poses')]
+    assert not any(storage.exists(part) for part in parts)
+    if not complete:
+        assert not session.output_images_stack
+        stack_images_task.assert_called_once_with(str(session.pk))
+        return
+
+    # The stack is ready as soon as the session is
+    stack_images_task.assert_not_called()
+    np.testing.assert_array_equal(_load(storage, session.output_images_stack.name), images)
+    with _load(storage, session.output_images_poses.name) as poses:
+        np.testing.assert_array_equal(poses['index'], [0, 1])
@@ -0,0 +1,76 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from pathlib import Path
+import time
+
+from xray_genius.core.render.volume_cache import VolumeCache
+
+
+def _build(size: int):
+    def build(entry: Path) -> None:
+        (entry / 'data').write_bytes(b'\0' * size)
+
+    return build
+
+
+def test_volume_cache_builds_once(tmp_path):
+    cache = VolumeCache(tmp_path, max_bytes=1024**2)
+    builds = []
+
+    def build(entry: Path) -> None:
+        builds.append(entry)
+        (entry / 'data').write_bytes(b'volume')
+
+    with cache.open('input.nrrd:6', build) as entry:
+        assert (entry / 'data').read_bytes() == b'volume'
+    with cache.open('input.nrrd:6', build) as entry:
+        assert (entry / 'data').read_bytes() == b'volume'
+
+    assert len(builds) == 1
+    stats = cache.stats()
+    assert (stats.hits, stats.misses) == (1, 1)
+
+
+def test_volume_cache_evicts_least_recently_used(tmp_path):
+    cache = VolumeCache(tmp_path, max_bytes=2500)
+
+    for key in ('a', 'b'):
+        with cache.open(key, _build(1000)):
+            pass
+    # Use 'a' again, so that 'b' becomes the least recently used entry
+    time.sleep(0.01)
+    with cache.open('a', _build(1000)):
+        pass
+    time.sleep(0.01)
+    with cache.open('c', _build(1000)):
+        pass
+
+    assert cache.stats().evictions == 1
+    with cache.open('a', _build(1000)):
+        pass
+    assert cache.stats().misses == 3
+    with cache.open('b', _build(1000)):
+        pass
+    assert cache.stats().misses == 4
+
+
+def _open_in_process(root: Path, key: str) -> int:
+    cache = VolumeCache(root, max_bytes=1024**2)
+
+    def build(entry: Path) -> None:
+        # Slow enough that every process tries to use the entry while it's being built
+        time.sleep(0.2)
+        (entry / 'pid').write_text(str(os.getpid()))
+
+    with cache.open(key, build) as entry:
+        return int((entry / 'pid').read_text())
+
+
+def test_volume_cache_concurrent_processes(tmp_path):
+    with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context('spawn')) as executor:
+        builders = set(executor.map(_open_in_process, [tmp_path] * 4, ['shared'] * 4))
+
+    assert len(builders) == 1
+    stats = VolumeCache(tmp_path, max_bytes=1024**2).stats()
+    assert (stats.hits, stats.misses) == (3, 1)
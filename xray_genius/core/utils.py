@@ -1,119 +1,255 @@
-from collections.abc import Collection
+from collections.abc import Iterator
+from dataclasses import dataclass
+import functools
+import warnings
 
 import numpy as np
-from scipy.stats import vonmises
 
 from xray_genius.core.models import InputParameters
 
 DEFAULT_MEAN = 0
 DEFAULT_STD_DEV = 10
 
+# The number of poses sampled at once by `ParameterSampler.iter_chunks`, about 2.5 MiB
+DEFAULT_CHUNK_SIZE = 65536
 
-def sample_gaussian_distribution(mean: float, std_dev: float, num_samples=1000):
+# Keeps points of the unit hypercube off its bounds, where the inverse CDFs are infinite
+_UNIT_EPSILON = 1e-12
+
+
+@functools.lru_cache(maxsize=32)
+def _von_mises_cdf_table(kappa: float) -> tuple[np.ndarray, np.ndarray]:
     """
-    Sample values from a Gaussian distribution and plot a histogram.
+    Tabulate the CDF of a von Mises distribution around 0 with concentration ``kappa``.
 
-    Parameters:
-    - mean: The mean (μ) of the Gaussian distribution.
-    - std_dev: The standard deviation (σ) of the Gaussian distribution.
-    - num_samples: The number of samples to generate. Default is 1000.
+    The table only spans the angles (in radians) where the distribution has any mass, so that
+    concentrated distributions are tabulated as finely as flat ones.
+    """
+    half_width = min(np.pi, 12 / np.sqrt(kappa))
+    angles = np.linspace(-half_width, half_width, 4097)
+    # Scaled by exp(-kappa) to avoid overflow, which the normalization cancels out
+    pdf = np.exp(kappa * (np.cos(angles) - 1))
+    cdf = np.concatenate([[0], np.cumsum((pdf[1:] + pdf[:-1]) / 2)])
+    return angles, cdf / cdf[-1]
 
-    Returns:
-    - A numpy array of sampled values.
-    """  # noqa: RUF002
-    # Random sampling from a Gaussian distribution
-    return np.random.normal(mean, std_dev, num_samples)  # noqa: NPY002
 
+def _wrap_degrees(angles: np.ndarray) -> np.ndarray:
+    return (angles + 180) % 360 - 180
 
-def sample_von_mises_angles_degrees(mean_angle_deg: float, kappa: float, num_samples: int = 1):
-    """
-    Sample angles from a von Mises distribution around a mean angle in degrees.
 
-    Parameters:
-    - mean_angle_deg: Mean angle in degrees.
-    - kappa: Concentration parameter (κ), analogous to 1/variance in a Gaussian.
-             Higher kappa means less spread.
-    - num_samples: Number of angles to sample.
+@dataclass(frozen=True)
+class _Distribution:
+    """
+    The distribution of one parameter of a pose.
 
-    Returns:
-    - An array of sampled angles in degrees, normalized to [0, 360).
+    Behavior:
+    - spread is     None: every sample is ``mean``
+    - spread is not None, von_mises is False: sample a gaussian with standard deviation ``spread``
+    - spread is not None, von_mises is  True: sample a von Mises distribution around ``mean``
+      degrees, with concentration (κ) ``spread``
     """
-    mean_angle_rad = np.deg2rad(mean_angle_deg)  # Convert mean angle to radians
-    sampled_angles_rad = vonmises.rvs(kappa, loc=mean_angle_rad, size=num_samples)  # Sample
-    return np.rad2deg(sampled_angles_rad)
-
-
-def sample_gaussian_with_defaults(
-    translation: float | None,
-    std_dev: float | None,
-    num_samples=1000,
-    default_mean=DEFAULT_MEAN,
-    default_std_dev=DEFAULT_STD_DEV,
-):
+
+    mean: float
+    spread: float | None = None
+    von_mises: bool = False
+
+    @property
+    def randomized(self) -> bool:
+        return self.spread is not None
+
+    def sample(self, rng: np.random.Generator, out: np.ndarray) -> None:
+        """Fill ``out`` with samples drawn by ``rng``."""
+        if self.spread is None:
+            out[:] = self.mean
+        elif self.von_mises:
+            # Angles are drawn in [-180, 180) degrees, which matches the range of the C-arm
+            out[:] = np.rad2deg(rng.vonmises(np.deg2rad(self.mean), self.spread, len(out)))
+        else:
+            out[:] = rng.normal(self.mean, self.spread, len(out))
+
+    def ppf(self, units: np.ndarray, out: np.ndarray) -> None:
+        """Fill ``out`` with the values at quantiles ``units``, for a randomized parameter."""
+        if self.von_mises:
+            angles, cdf = _von_mises_cdf_table(self.spread)
+            out[:] = _wrap_degrees(self.mean + np.rad2deg(np.interp(units, cdf, angles)))
+        else:
+            from scipy.special import ndtri
+
+            out[:] = self.mean + self.spread * ndtri(units)
+
+    def cdf(self, values: np.ndarray) -> np.ndarray:
+        """Get the quantiles of ``values``, for a randomized parameter."""
+        if self.von_mises:
+            angles, cdf = _von_mises_cdf_table(self.spread)
+            return np.interp(np.deg2rad(_wrap_degrees(values - self.mean)), angles, cdf)
+
+        from scipy.special import ndtr
+
+        return ndtr((values - self.mean) / self.spread)
+
+
+def _gaussian_with_defaults(translation: float | None, std_dev: float | None) -> _Distribution:
     """
-    Sample values from a Gaussian distribution with default values.
+    Get the distribution of a translation, with default values.
 
     Behavior:
     - translation is not None and std_dev is not None: sample the gaussian
     - translation is     None and std_dev is not None: sample the gaussian
     - translation is not None and std_dev is     None: return translation
     - translation is     None and std_dev is     None: sample the gaussian
-
-    Parameters:
-    - translation: the mean of the gaussian.
-    - std_dev: the standard deviation of the gaussian.
-
-    Returns:
-    - A numpy array of sampled values.
     """
     if translation is not None and std_dev is None:
-        return [translation] * num_samples
+        return _Distribution(translation)
 
-    return sample_gaussian_distribution(
-        translation or default_mean, std_dev or default_std_dev, num_samples
-    )
+    return _Distribution(translation or DEFAULT_MEAN, std_dev or DEFAULT_STD_DEV)
 
 
 class ParameterSampler:
+    """
+    Sample the C-arm poses of a session from the distributions of its input parameters.
+
+    Each pose is a row of (push/pull, head/foot, raise/lower, alpha, beta). Each parameter is
+    drawn by its own generator (all derived from ``seed``), so the same seed always gives the
+    same poses, whether they're sampled all at once or streamed in chunks of any size.
+
+    In the Sobol and Latin hypercube sampling modes, points of a (scrambled) low-discrepancy
+    sequence are mapped through the inverse CDFs of the randomized parameters instead, so
+    fewer poses are needed to cover the same distributions evenly.
+    """
+
     samples: int
-    carm_push_pull_translation: Collection[float]
-    carm_head_foot_translation: Collection[float]
-    carm_raise_lower_translation: Collection[float]
-    carm_alpha: Collection[float]
-    carm_beta: Collection[float]
-
-    def __init__(self, input_parameters: InputParameters) -> None:
-        self.samples = input_parameters.num_samples
-        self.carm_push_pull_translation = sample_gaussian_with_defaults(
-            input_parameters.carm_push_pull_translation,
-            input_parameters.carm_push_pull_std_dev,
-            num_samples=self.samples,
-        )
-        self.carm_head_foot_translation = sample_gaussian_with_defaults(
-            input_parameters.carm_head_foot_translation,
-            input_parameters.carm_head_foot_std_dev,
-            num_samples=self.samples,
+    seed: int
+    mode: InputParameters.SamplingMode
+
+    def __init__(
+        self,
+        input_parameters: InputParameters,
+        seed: int | None = None,
+        samples: int | None = None,
+    ) -> None:
+        self.samples = input_parameters.num_samples if samples is None else samples
+        self.mode = input_parameters.sampling_mode
+        # Without a seed, sample from fresh entropy, but keep it so the sampler is reproducible
+        self.seed = np.random.SeedSequence(seed).entropy
+        self._distributions = (
+            _gaussian_with_defaults(
+                input_parameters.carm_push_pull_translation,
+                input_parameters.carm_push_pull_std_dev,
+            ),
+            _gaussian_with_defaults(
+                input_parameters.carm_head_foot_translation,
+                input_parameters.carm_head_foot_std_dev,
+            ),
+            _gaussian_with_defaults(
+                input_parameters.carm_raise_lower_translation,
+                input_parameters.carm_raise_lower_std_dev,
+            ),
+            _Distribution(
+                input_parameters.carm_alpha, input_parameters.carm_alpha_kappa, von_mises=True
+            ),
+            _Distribution(
+                input_parameters.carm_beta, input_parameters.carm_beta_kappa, von_mises=True
+            ),
         )
-        self.carm_raise_lower_translation = sample_gaussian_with_defaults(
-            input_parameters.carm_raise_lower_translation,
-            input_parameters.carm_raise_lower_std_dev,
-            num_samples=self.samples,
-        )
-        self.carm_alpha = (
-            [input_parameters.carm_alpha] * self.samples
-            if input_parameters.carm_alpha_kappa is None
-            else sample_von_mises_angles_degrees(
-                mean_angle_deg=input_parameters.carm_alpha,
-                kappa=input_parameters.carm_alpha_kappa,
-                num_samples=self.samples,
-            )
-        )
-        self.carm_beta = (
-            [input_parameters.carm_beta] * self.samples
-            if input_parameters.carm_beta_kappa is None
-            else sample_von_mises_angles_degrees(
-                mean_angle_deg=input_parameters.carm_beta,
-                kappa=input_parameters.carm_beta_kappa,
-                num_samples=self.samples,
-            )
+
+    @property
+    def randomized(self) -> bool:
+        """Whether any parameter is randomized, i.e. whether poses differ between samples."""
+        return bool(self._randomized_columns)
+
+    @property
+    def _randomized_columns(self) -> list[int]:
+        return [
+            column
+            for column, distribution in enumerate(self._distributions)
+            if distribution.randomized
+        ]
+
+    def _generators(self) -> list[np.random.Generator]:
+        return [
+            np.random.default_rng(child)
+            for child in np.random.SeedSequence(self.seed).spawn(len(self._distributions))
+        ]
+
+    def _iter_unit_chunks(self, chunk_size: int) -> Iterator[np.ndarray]:
+        """Stream points of the low-discrepancy sequence, one dimension per randomized column."""
+        from scipy.stats import qmc
+
+        dimensions = len(self._randomized_columns)
+        rng = np.random.default_rng(np.random.SeedSequence(self.seed))
+        if self.mode == InputParameters.SamplingMode.SOBOL:
+            engine = qmc.Sobol(dimensions, scramble=True, rng=rng)
+            for start in range(0, self.samples, chunk_size):
+                with warnings.catch_warnings():
+                    # Balance is only guaranteed for powers of 2, but any number of samples
+                    # is still far more even than independent draws
+                    warnings.filterwarnings('ignore', message='The balance properties of Sobol')
+                    units = engine.random(min(chunk_size, self.samples - start))
+                yield units
+        else:
+            # Latin hypercube strata depend on the total number of samples, so every point is
+            # sampled at once, and only streamed in chunks
+            units = qmc.LatinHypercube(dimensions, rng=rng).random(self.samples)
+            for start in range(0, self.samples, chunk_size):
+                yield units[start : start + chunk_size]
+
+    def sample(self) -> np.ndarray:
+        """Sample every pose, as a contiguous (N, 5) float64 array."""
+        return next(self.iter_chunks(max(self.samples, 1)), np.empty((0, 5)))
+
+    def iter_chunks(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[np.ndarray]:
+        """Sample the poses lazily, in contiguous (chunk_size, 5) arrays."""
+        if self.mode == InputParameters.SamplingMode.RANDOM or not self._randomized_columns:
+            generators = self._generators()
+            for start in range(0, self.samples, chunk_size):
+                chunk = np.empty((min(chunk_size, self.samples - start), 5))
+                for column, (distribution, rng) in enumerate(
+                    zip(self._distributions, generators, strict=True)
+                ):
+                    distribution.sample(rng, chunk[:, column])
+                yield chunk
+            return
+
+        for units in self._iter_unit_chunks(chunk_size):
+            chunk = np.empty((len(units), 5))
+            dimensions = iter(np.clip(units, _UNIT_EPSILON, 1 - _UNIT_EPSILON).T)
+            for column, distribution in enumerate(self._distributions):
+                if distribution.randomized:
+                    distribution.ppf(next(dimensions), chunk[:, column])
+                else:
+                    chunk[:, column] = distribution.mean
+            yield chunk
+
+    def resample(self, index: int, attempt: int) -> np.ndarray:
+        """
+        Draw a replacement for the pose at ``index``, as a (5,) array.
+
+        Replacements are independent random draws (whatever the sampling mode), which are the
+        same for the same seed, index and attempt.
+        """
+        sequence = np.random.SeedSequence(self.seed, spawn_key=(index, attempt))
+        pose = np.empty((1, 5))
+        for column, (distribution, child) in enumerate(
+            zip(self._distributions, sequence.spawn(len(self._distributions)), strict=True)
+        ):
+            distribution.sample(np.random.default_rng(child), pose[:, column])
+        return pose[0]
+
+    def discrepancy(self, poses: np.ndarray) -> float | None:
+        """
+        Measure how evenly poses cover the distributions of the randomized parameters.
+
+        The randomized parameters are mapped to the unit hypercube through their CDFs, where
+        the centered L2 discrepancy of the poses is computed; lower is more even. If nothing is
+        randomized, or there are no poses, there is nothing to measure, and None is returned.
+        """
+        randomized_columns = self._randomized_columns
+        if not randomized_columns or not len(poses):
+            return None
+
+        from scipy.stats import qmc
+
+        units = np.column_stack(
+            [self._distributions[column].cdf(poses[:, column]) for column in randomized_columns]
         )
+        return float(qmc.discrepancy(np.clip(units, 0, 1), method='CD'))
@@ -1,4 +1,5 @@
 from collections.abc import Callable
+from functools import partial
 from typing import ParamSpec, TypeVar
 from urllib.parse import urlencode
 
@@ -17,12 +18,14 @@ from django.views.decorators.http import require_GET, require_http_methods, requ
 from django_celery_results.models import TaskResult
 from login_required import login_not_required
 
+from .coordination import clear_session_cancelled, signal_session_cancelled
 from .forms import ContactForm, CTInputFileUploadForm
-from .models import CTInputFile, SampleDataset, SampleDatasetFile, Session
+from .models import CTInputFile, OutputImage, SampleDataset, SampleDatasetFile, Session
+from .models.output_image import FILE_FIELDS
 from .tasks import (
     delete_session_task,
-    run_deepdrr_task,
     send_contact_form_submission_to_admins_task,
+    start_deepdrr_run,
 )
 
 T = TypeVar('T')
@@ -165,6 +168,24 @@ def download_ct_file(request: HttpRequest, session_pk: str):
     return redirect(session.input_scan.file.url)
 
 
+@permission_check
+@require_GET
+def output_image_file(request: HttpRequest, session_pk: str, output_image_pk: int, field_name: str):
+    output_image = get_object_or_404(
+        OutputImage.objects.select_related('pack'), pk=output_image_pk, session_id=session_pk
+    )
+    if field_name not in FILE_FIELDS or not output_image.has_file(field_name):
+        raise Http404
+    if field_name not in output_image.pack_slices:
+        return redirect(getattr(output_image, field_name).url)
+
+    # Packed files are read out of their pack, since they have no URL of their own
+    content_type = 'application/octet-stream' if field_name == 'raw_image' else 'image/png'
+    response = HttpResponse(output_image.read_file(field_name), content_type=content_type)
+    response['Content-Disposition'] = f'inline; filename="{output_image.file_name(field_name)}"'
+    return response
+
+
 @permission_check
 @require_GET
 def volview_viewer(request: HttpRequest, session_pk: str):
@@ -172,24 +193,38 @@ def volview_viewer(request: HttpRequest, session_pk: str):
     return render(request, 'viewer.html', context={'session': session})
 
 
-@permission_check
-@require_POST
-def initiate_batch_run(request: HttpRequest, session_pk: str):
+def _initiate_run(session_pk: str, *, preview: bool) -> HttpResponse:
     with transaction.atomic():
         session = get_object_or_404(Session.objects.select_for_update(), pk=session_pk)
         if not session.parameters:
             # Error: parameters missing. The UI should prevent this from ever happening.
             return HttpResponseBadRequest('Parameters missing')
-        if session.status != Session.Status.NOT_STARTED:
+        # A session which was only previewed may run again
+        if session.status != Session.Status.NOT_STARTED and not session.is_finished_preview:
             return HttpResponseBadRequest('Invalid start state.')
+        session.discard_preview()
         session.status = Session.Status.QUEUED
         session.started = timezone.now()
         session.save()
-    task = run_deepdrr_task.delay(session_pk)
-    Session.objects.filter(pk=session_pk).update(celery_task_id=task.id)
+    # Don't let a cancellation of a previous run abort this one
+    clear_session_cancelled(session_pk)
+    task_id = start_deepdrr_run(session, preview=preview)
+    Session.objects.filter(pk=session_pk).update(celery_task_id=task_id)
     return redirect('dashboard')
 
 
+@permission_check
+@require_POST
+def initiate_batch_run(request: HttpRequest, session_pk: str):
+    return _initiate_run(session_pk, preview=False)
+
+
+@permission_check
+@require_POST
+def initiate_preview_run(request: HttpRequest, session_pk: str):
+    return _initiate_run(session_pk, preview=True)
+
+
 @permission_check
 @require_POST
 def cancel_batch_run(request: HttpRequest, session_pk: str):
@@ -198,6 +233,7 @@ def cancel_batch_run(request: HttpRequest, session_pk: str):
         session.status = Session.Status.CANCELLED
         session.started = None
         session.save()
+        transaction.on_commit(partial(signal_session_cancelled, session_pk))
     return redirect('dashboard')
 
 
@@ -3,6 +3,7 @@ from __future__ import annotations
 from datetime import timedelta
 import os
 from pathlib import Path
+from tempfile import gettempdir
 from typing import TYPE_CHECKING
 
 from composed_configuration import (
@@ -68,6 +69,12 @@ class XrayGeniusMixin(ConfigMixin):
         },
     }
 
+    # Use db 2 for coordinating web and worker processes (e.g. cancellation signals)
+    COORDINATION_REDIS = {
+        'address': os.environ['REDIS_URL'],
+        'db': 2,
+    }
+
     # The maximum number of failed login attempts before a user is locked out
     AXES_FAILURE_LIMIT = 10
     # Disable overly-verbose django-axes startup logs
@@ -76,6 +83,69 @@ class XrayGeniusMixin(ConfigMixin):
     # The maximum number of sessions a user can start
     USER_SESSION_LIMIT = values.IntegerValue(5)
 
+    # The number of threads that encode and upload rendered images, and the maximum number of
+    # rendered images that may wait on them before rendering is paused
+    RENDER_PIPELINE_WORKERS = values.IntegerValue(4)
+    RENDER_PIPELINE_MAX_PENDING = values.IntegerValue(8)
+    # Output images are saved to the DB in batches of this size, or once the oldest unsaved
+    # image has waited this many seconds, whichever comes first
+    OUTPUT_IMAGE_BATCH_SIZE = values.IntegerValue(25)
+    OUTPUT_IMAGE_BATCH_MAX_DELAY = values.FloatValue(5.0)
+    # Store the files of each batch of output images in a single pack, rather than uploading
+    # each of them on its own. Packed files are served by the app, with ranged reads of the pack.
+    OUTPUT_IMAGE_PACKING = values.BooleanValue(default=False)
+    # Sessions are split into shards of at most this many images, each of which may be rendered
+    # by a different worker. Set to 0 to render every session in a single task.
+    RENDER_SHARD_SIZE = values.IntegerValue(25)
+    # Poses whose projection of the input volume covers less than this fraction of the detector
+    # are resampled (up to RENDER_FOV_MAX_RESAMPLES times) before rendering, and skipped if no
+    # resampled pose is covered either. Set to 0 to render every pose.
+    RENDER_MIN_DETECTOR_COVERAGE = values.FloatValue(0.01)
+    RENDER_FOV_MAX_RESAMPLES = values.IntegerValue(10)
+    # Rendered images with less than this fraction of non-background pixels, spread of pixel
+    # values, or histogram entropy (in bits) are dropped, and rendered again from a fresh pose,
+    # up to RENDER_LOW_INFORMATION_RETRIES times per shard. Set a threshold to 0 to disable it.
+    RENDER_MIN_FOREGROUND_FRACTION = values.FloatValue(0.05)
+    RENDER_MIN_DYNAMIC_RANGE = values.FloatValue(0.05)
+    RENDER_MIN_FRAME_ENTROPY = values.FloatValue(1.0)
+    RENDER_LOW_INFORMATION_RETRIES = values.IntegerValue(10)
+    # Preview runs render at most this many poses, at this detector resolution (in pixels), so
+    # that parameters can be checked in seconds before committing to a full run
+    PREVIEW_NUM_SAMPLES = values.IntegerValue(8)
+    PREVIEW_DETECTOR_RESOLUTION = values.IntegerValue(256)
+    # Single poses are previewed by the `run_pose_preview_worker` command, which the API waits on
+    # for up to POSE_PREVIEW_TIMEOUT seconds (this includes loading the volume, the first time).
+    # The worker frees a volume after it's unused for POSE_PREVIEW_IDLE_TIMEOUT seconds. Previews
+    # are refused once POSE_PREVIEW_MAX_QUEUED requests are waiting for the worker.
+    POSE_PREVIEW_TIMEOUT = values.FloatValue(20.0)
+    POSE_PREVIEW_IDLE_TIMEOUT = values.FloatValue(300.0)
+    POSE_PREVIEW_MAX_QUEUED = values.IntegerValue(16)
+    # Once a render task is done with its own shard, it renders up to this many queued shards of
+    # other sessions with the same volume and geometry (e.g. those of a sample dataset). Their
+    # own tasks check back every RENDER_COSCHEDULED_RETRY_DELAY seconds until they're done.
+    RENDER_COSCHEDULED_SHARDS = values.IntegerValue(4)
+    RENDER_COSCHEDULED_RETRY_DELAY = values.FloatValue(5.0)
+    # Images are rendered with deepdrr's projector on the GPU ('cuda'), or by ray marching with
+    # NumPy on the CPU ('numpy'), which is much slower, but runs on workers without a GPU.
+    RENDER_PROJECTOR_BACKEND = values.Value('cuda')
+    # Each worker process keeps initialized projectors (with their volume on the GPU) for later
+    # sessions of the same input file, up to about this many bytes of (device) memory in total.
+    # Set to 0 to free every projector once its task is done.
+    PROJECTOR_POOL_MAX_BYTES = values.IntegerValue(4 * 1024**3)
+    # Workers cache downloaded and parsed input volumes on disk, up to this many bytes in total.
+    # Set the size to 0 to disable the cache.
+    VOLUME_CACHE_DIR = values.Value(str(Path(gettempdir()) / 'xray_genius' / 'volume_cache'))
+    VOLUME_CACHE_MAX_BYTES = values.IntegerValue(20 * 1024**3)
+    # Input files are downloaded in chunks of this size, over this many connections at once
+    INPUT_DOWNLOAD_CHUNK_SIZE = values.IntegerValue(8 * 1024**2)
+    INPUT_DOWNLOAD_CONNECTIONS = values.IntegerValue(4)
+    # The queue of the workers which preprocess uploaded input files. This doesn't need a GPU, so
+    # it may be a separate queue of CPU-only workers.
+    VOLUME_PREPROCESSING_QUEUE = values.Value('celery')
+    # A running dataset export which hasn't stored a shard for this many seconds (e.g. because
+    # its worker died) may be resumed
+    DATASET_EXPORT_STALE_TIMEOUT = values.FloatValue(30 * 60.0)
+
     REQUIRE_APPROVAL_FOR_NEW_USERS = values.BooleanValue(default=True)
     ADDITIONAL_ADMIN_EMAILS = values.ListValue()
 
@@ -190,6 +260,7 @@ class HerokuProductionConfiguration(XrayGeniusMixin, HerokuProductionBaseConfigu
 
         # Redis providers on Heroku use self-signed certs, so we need to disable verification
         configuration.CHANNEL_LAYERS['default']['CONFIG']['hosts'][0]['ssl_cert_reqs'] = None
+        configuration.COORDINATION_REDIS['ssl_cert_reqs'] = None
 
         # We're configuring sentry by hand since we need to pass custom options (sentry cron).
         configuration.INSTALLED_APPS.remove('composed_configuration.sentry.apps.SentryConfig')
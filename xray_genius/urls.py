@@ -5,10 +5,12 @@ from django.views.generic import RedirectView
 from ninja import NinjaAPI
 
 from .core import views
+from .core.rest.dataset_export import dataset_export_router
 from .core.rest.session import session_router
 
 api = NinjaAPI(title='X-ray Genius', version='0.1.0')
 api.add_router('/session/', session_router)
+api.add_router('/dataset-export/', dataset_export_router)
 
 urlpatterns = [
     path('accounts/', include('allauth.urls')),
@@ -41,11 +43,21 @@ urlpatterns = [
         views.volview_viewer,
         name='viewer',
     ),
+    path(
+        'session/<uuid:session_pk>/output-images/<int:output_image_pk>/<str:field_name>/',
+        views.output_image_file,
+        name='output-image-file',
+    ),
     path(
         'session/<uuid:session_pk>/initiate-batch-run/',
         views.initiate_batch_run,
         name='initiate-batch-run',
     ),
+    path(
+        'session/<uuid:session_pk>/initiate-preview-run/',
+        views.initiate_preview_run,
+        name='initiate-preview-run',
+    ),
     path(
         'session/<uuid:session_pk>/cancel-batch-run/',
         views.cancel_batch_run,